@@ -0,0 +1,15 @@
+import os
+import sys
+
+
+# same environment as tests/conftest.py, so the skill modules can be
+# imported the way Lambda imports them (flat, from the function dir)
+os.environ.setdefault('SKILL_TABLE_NAME', 'bench-table')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('REGION', os.uname().nodename)
+os.environ.setdefault('SERVICE', 'alexa-math-skill')
+os.environ.setdefault('STAGE', 'localtest')
+
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src')) # for core
+sys.path.insert(0, os.path.join(here, '..', 'src', 'functions', 'skill'))
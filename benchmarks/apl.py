@@ -0,0 +1,79 @@
+"""
+Per-turn cost of the APL directive: building the document, the
+directive and serializing it, before and after freezing the document.
+
+    python -m benchmarks.apl
+"""
+import json
+import timeit
+import tracemalloc
+
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_model.interfaces.alexa.presentation.apl import \
+    RenderDocumentDirective
+
+import content
+import utils
+
+
+def legacy_apl_document():
+    # content.apl_document as it was before being loaded from the json file
+    return \
+    {'type': 'APL',
+     'version': '1.0',
+     'import': [{'name': 'alexa-styles', 'version': '1.0.0'},
+                {'name': 'alexa-viewport-profiles', 'version': '1.0.0'}],
+     'mainTemplate': {
+         'parameters': ['payload'],
+         'item':
+             {'type': 'Container',
+              'alignItems': 'center',
+              'justifyContent': 'center',
+              'height': '100vh',
+              'width': '100vw',
+              'items': [
+                  {'type': 'Text',
+                   'fontSize': '${@viewportProfile == @hubRoundSmall ? @fontSizeLarge : @fontSizeXXLarge}',
+                   'fontWeight': '@fontWeightLight',
+                   'text': '${payload.data.properties.op1} ${payload.data.properties.operand} ${payload.data.properties.op2}'}]}}}
+
+def datasources():
+    return {'data': {'type': 'object',
+                     'properties': {'op1': 12, 'op2': 4, 'operand': '÷'}}}
+
+def legacy_turn(serializer=DefaultSerializer()):
+    directive = RenderDocumentDirective(document=legacy_apl_document(),
+                                        datasources=datasources())
+    return serializer.serialize(directive)
+
+def frozen_turn(serializer=utils.Serializer()):
+    directive = RenderDocumentDirective(document=content.apl_document(),
+                                        datasources=datasources())
+    return serializer.serialize(directive)
+
+def per_call_us(fn, number=20000):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+def allocations(fn, number=1000):
+    # peak memory allocated during a call, averaged over calls; tracing
+    # restarts for each, as tracemalloc.reset_peak is Python 3.9+
+    fn()
+    peak_bytes = 0
+    for _ in range(number):
+        tracemalloc.start()
+        fn()
+        peak_bytes += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return peak_bytes / number
+
+def main():
+    assert json.dumps(legacy_turn()) == json.dumps(frozen_turn())
+
+    print('per turn            time (us)   peak alloc (bytes)')
+    for name, fn in [('legacy', legacy_turn), ('frozen', frozen_turn)]:
+        print(name.ljust(20), f'{per_call_us(fn):8.2f}',
+              f'{allocations(fn):17.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Cold start of the skill function with and without LAZY_INIT, with
+LAZY_INIT and ASYNC_IO, and with LAZY_INIT after a warm-up event (its
+time not counted, the schedule pays for it). Every sample is a fresh
+interpreter that imports main and handles one event.
+
+    python -m benchmarks.cold_start [--runs N]
+
+DynamoDB itself is replaced with an in-memory table, but the boto3
+import and resource creation are real: the standard mode pays for them
+at import time (DynamoDbAdapter creates its default resource then), the
+lazy mode when the first request touches persistent attributes.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from . import here
+
+
+PROBE = '''
+import json, os, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+
+class Table:
+    def get_item(self, **_kwargs):
+        return {}
+    def put_item(self, **_kwargs):
+        pass
+
+class Resource:
+    def __init__(self, connect):
+        self.connect = connect
+    def Table(self, _name):
+        if self.connect:
+            import boto3
+            boto3.resource('dynamodb')
+        return Table()
+
+main.sb.dynamodb_client = Resource(connect=main.LAZY_INIT)
+event = json.loads(sys.stdin.read())
+if os.environ.get('WARM_UP'):
+    main.handler({'warmup': True}, None)
+t2 = time.perf_counter()
+main.handler(event, None)
+t3 = time.perf_counter()
+print(json.dumps([t1 - t0, t3 - t2]))
+'''
+
+def sample(event, lazy, async_io, warm_up):
+    env = dict(os.environ, LAZY_INIT='true' if lazy else '',
+               ASYNC_IO='true' if async_io else '',
+               WARM_UP='true' if warm_up else '',
+               STAGE='benchmark') # log to stdout, as in Lambda
+    skill_dir = os.path.join(here, '..', 'src', 'functions', 'skill')
+    completed = subprocess.run([sys.executable, '-c', PROBE],
+                               input=json.dumps(event), env=env,
+                               cwd=skill_dir, check=True,
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    # the last line is ours, the rest are invocation logs
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='samples per row, the median is reported')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.join(here, '..'))
+    from tests.functions.skill.fixtures import ( # pylint: disable=import-outside-toplevel
+        load_event, build_intent_event)
+
+    runs = args.runs
+    events = [('LaunchRequest', load_event('launch_request')),
+              ('AMAZON.HelpIntent', build_intent_event('AMAZON.HelpIntent'))]
+
+    print('median of', runs, 'runs (ms)               import   first event   total')
+    for name, event in events:
+        for lazy, async_io, warm_up in [(False, False, False),
+                                        (True, False, False),
+                                        (True, True, False),
+                                        (True, False, True)]:
+            samples = [sample(event, lazy, async_io, warm_up)
+                       for _ in range(runs)]
+            imports = statistics.median(s[0] for s in samples) * 1000
+            firsts = statistics.median(s[1] for s in samples) * 1000
+            mode = 'lazy' if lazy else 'standard'
+            if async_io:
+                mode += ', async I/O'
+            if warm_up:
+                mode += ', warmed up'
+            print(f'{name} ({mode})'.ljust(40),
+                  f'{imports:7.1f} {firsts:13.1f} {imports + firsts:7.1f}')
+
+
+if __name__ == '__main__':
+    main()
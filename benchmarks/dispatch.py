@@ -0,0 +1,111 @@
+"""
+Cost of finding the handler for a DidAnswer request, with the SDK's
+linear can_handle scan and with the index, as more intents get added.
+
+    python -m benchmarks.dispatch
+"""
+import json
+import os
+import sys
+import timeit
+
+from ask_sdk_core.attributes_manager import AttributesManager
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_core.utils import is_request_type, is_intent_name
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_runtime.dispatch_components import (
+    GenericRequestHandlerChain, GenericRequestMapper)
+from ask_sdk_runtime.skill_builder import AbstractSkillBuilder
+import jmespath
+
+from . import here
+import dispatch
+
+
+def noop(_handler_input):
+    return None
+
+def has_session_attribute(handler_input, attr_name):
+    # main.has_session_attribute before the index
+    skill_attributes = handler_input.attributes_manager.session_attributes
+    value = jmespath.search(f'session_data.{attr_name}', skill_attributes)
+    return value is not None
+
+def legacy_mapper(extra_intents):
+    # the handlers of main.py (in their order) registered the old way
+    sb = AbstractSkillBuilder()
+
+    def intent_handler(*intent_names):
+        has_intent = lambda handler_input: \
+            any([is_intent_name(name)(handler_input)
+                 for name in intent_names])
+        return sb.request_handler(has_intent)
+
+    sb.request_handler(is_request_type('LaunchRequest'))(noop)
+    sb.request_handler(is_request_type('SessionEndedRequest'))(noop)
+    for name in extra_intents:
+        intent_handler(name)(noop)
+    intent_handler('DidSelectOperation')(noop)
+    sb.request_handler(lambda hi: is_intent_name('DidSelectDifficulty')(hi) and
+                       has_session_attribute(hi, 'operation'))(noop)
+    sb.request_handler(lambda hi: is_intent_name('DidAnswer')(hi) and
+                       has_session_attribute(hi, 'operation') and
+                       has_session_attribute(hi, 'difficulty'))(noop)
+    intent_handler('AMAZON.StopIntent', 'AMAZON.CancelIntent')(noop)
+    intent_handler('AMAZON.HelpIntent', 'AMAZON.FallbackIntent')(noop)
+    return sb.runtime_configuration_builder.get_runtime_configuration()\
+             .request_mappers[0]
+
+def indexed_mapper(extra_intents):
+    handlers = [
+        dispatch.IndexedRequestHandler(noop, [('LaunchRequest', None)]),
+        dispatch.IndexedRequestHandler(noop, [('SessionEndedRequest', None)])
+    ]
+    handlers += [dispatch.IndexedRequestHandler(noop, [('IntentRequest', name)])
+                 for name in extra_intents]
+    handlers += [
+        dispatch.IndexedRequestHandler(
+            noop, [('IntentRequest', 'DidSelectOperation')]),
+        dispatch.IndexedRequestHandler(
+            noop, [('IntentRequest', 'DidSelectDifficulty')], ['operation']),
+        dispatch.IndexedRequestHandler(
+            noop, [('IntentRequest', 'DidAnswer')], ['operation', 'difficulty']),
+        dispatch.IndexedRequestHandler(
+            noop, [('IntentRequest', 'AMAZON.StopIntent'),
+                   ('IntentRequest', 'AMAZON.CancelIntent')]),
+        dispatch.IndexedRequestHandler(
+            noop, [('IntentRequest', 'AMAZON.HelpIntent'),
+                   ('IntentRequest', 'AMAZON.FallbackIntent')])
+    ]
+    chains = [GenericRequestHandlerChain(request_handler=handler)
+              for handler in handlers]
+    return dispatch.IndexedRequestMapper(chains)
+
+def main():
+    sys.path.insert(0, os.path.join(here, '..'))
+    from tests.functions.skill.fixtures import load_event # pylint: disable=import-outside-toplevel
+
+    event = load_event('did_answer_correct')
+    envelope = DefaultSerializer().deserialize(json.dumps(event),
+                                               RequestEnvelope)
+    handler_input = HandlerInput(envelope, AttributesManager(envelope))
+
+    print('DidAnswer dispatch (us)    linear   indexed')
+    for extra in [0, 10, 50, 200]:
+        extra_intents = [f'Extra{i}Intent' for i in range(extra)]
+        mappers = [legacy_mapper(extra_intents), indexed_mapper(extra_intents)]
+        timings = []
+        for mapper in mappers:
+            assert mapper.get_request_handler_chain(handler_input) is not None
+            number = 2000
+            seconds = min(timeit.repeat(
+                lambda m=mapper: m.get_request_handler_chain(handler_input),
+                number=number, repeat=5))
+            timings.append(seconds / number * 1e6)
+        print(f'{extra} extra intents'.ljust(24),
+              f'{timings[0]:9.2f} {timings[1]:9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Per-turn cost of deserializing the request envelope of each fixture
+event: fully, like sb.lambda_handler() and main.handler do it by
+default, and with LAZY_ENVELOPE, reading what a turn of the skill reads
+(the SDK's skill id check, session attributes, user id for persistence,
+locale, intent slots and APL support).
+
+    python -m benchmarks.envelope
+"""
+import json
+import timeit
+
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_model import IntentRequest, RequestEnvelope
+
+import envelope
+import utils
+from tests.functions.skill import fixtures # pylint: disable=wrong-import-order
+
+
+EVENTS = ['launch_request', 'did_select_operation', 'did_select_difficulty',
+          'did_answer_correct', 'session_ended_request']
+
+serializer = utils.Serializer()
+
+def full(event):
+    return serializer.deserialize(payload=json.dumps(event),
+                                  obj_type=RequestEnvelope)
+
+def lazy(event):
+    return envelope.lazy(event, RequestEnvelope)
+
+def turn(deserialize, event):
+    request_envelope = deserialize(event)
+    system = request_envelope.context.system
+    request = request_envelope.request
+    return (system.application.application_id,
+            request_envelope.session.attributes,
+            system.user.user_id,
+            request.locale,
+            request.intent.slots if isinstance(request, IntentRequest) else None,
+            utils.has_apl_support(HandlerInput(request_envelope)))
+
+def per_call_us(fn, number=2000):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+def main():
+    print('event                        full us    lazy us')
+    for name in EVENTS:
+        event = fixtures.load_event(name)
+        assert turn(full, event)[:4] == turn(lazy, event)[:4]
+        times = [per_call_us(lambda d=deserialize: turn(d, event))
+                 for deserialize in [full, lazy]]
+        print(name.ljust(26), *(f'{us:9.1f}' for us in times))
+
+
+if __name__ == '__main__':
+    main()
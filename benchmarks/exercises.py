@@ -0,0 +1,85 @@
+"""
+Compares the exercise bank with the generator it replaced.
+
+    python -m benchmarks.exercises
+"""
+import collections
+import math
+import random
+import timeit
+
+import content
+import exercises
+from models import Operation
+
+
+def legacy_generate_ops(operation, difficulty):
+    # content.generate_ops as it was before the exercise bank
+    # pylint: disable=invalid-name
+    add_sub_limits = {1: (10, 10), 2: (50, 50), 3: (100, 100),
+                      4: (1000, 100), 5: (1000, 1000)}
+    mul_div_limits = {1: (10, 10), 2: (30, 30), 3: (50, 50),
+                      4: (100, 50), 5: (1000, 100)}
+
+    if operation.value in [Operation.ADD.value, Operation.SUB.value]:
+        op1_max, op2_max = add_sub_limits[difficulty]
+    else:
+        op1_max, op2_max = mul_div_limits[difficulty]
+
+    op1 = random.randint(1, op1_max)
+    op2 = random.randint(1, op2_max)
+
+    if (operation.value in [Operation.SUB.value, Operation.DIV.value] and
+        op1 < op2): # pylint: disable=bad-continuation
+        op1, op2 = op2, op1
+
+    if operation.value == Operation.DIV.value and op1 % op2 != 0:
+        op1 = math.ceil(op1 / op2) * op2
+
+    return op1, op2, operation(op1, op2)
+
+def per_call_us(fn, number=100000):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+def distribution(generate, operation, difficulty, draws):
+    op1_max, op2_max = exercises.limits(operation, difficulty)
+    counts = collections.Counter(generate(operation, difficulty)[:2]
+                                 for _ in range(draws))
+    out_of_range = sum(count for (op1, op2), count in counts.items()
+                       if op1 > op1_max or op2 > op2_max)
+    most, least = max(counts.values()), min(counts.values())
+    return len(counts), most / least, out_of_range / draws
+
+def main():
+    print('per call (us)           legacy     bank')
+    for operation in Operation:
+        for difficulty in [1, 3, 5]:
+            exercises.pool(operation, difficulty) # build outside the timing
+            legacy = per_call_us(
+                lambda: legacy_generate_ops(operation, difficulty))
+            bank = per_call_us(
+                lambda: content.generate_ops(operation, difficulty))
+            print(f'{operation.value} level {difficulty}'.ljust(20),
+                  f'{legacy:9.3f} {bank:8.3f}')
+
+    print()
+    print('division level 2, 1M draws   pairs  max/min  out of limits')
+    for name, generate in [('legacy', legacy_generate_ops),
+                           ('bank', content.generate_ops)]:
+        pairs, spread, out = distribution(generate, Operation.DIV, 2, 10 ** 6)
+        print(name.ljust(28), f'{pairs:5d} {spread:8.2f} {out:13.2%}')
+
+    print()
+    print('10k exercises (ms)      loop     batch')
+    for operation in Operation:
+        loop = per_call_us(
+            lambda: [content.generate_ops(operation, 3) for _ in range(10000)],
+            number=5) / 1000
+        batch = per_call_us(
+            lambda: content.generate_ops_batch(operation, 3, 10000),
+            number=5) / 1000
+        print(f'{operation.value} level 3'.ljust(20), f'{loop:8.2f} {batch:8.2f}')
+
+
+if __name__ == '__main__':
+    main()
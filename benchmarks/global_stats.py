@@ -0,0 +1,103 @@
+"""
+Throughput of global_stats' question counter, one item (what a naive
+global counter would be) against sharded, on the local DynamoDB
+stand-in (tests/functions/skill/local_dynamodb.py) with per-item write
+capacity, i.e. DynamoDB's per-partition limit.
+
+    python -m benchmarks.global_stats [--threads N] [--seconds S]
+                                      [--shards N [N ...]]
+                                      [--key-capacity UNITS]
+
+Threads play containers ending sessions as fast as they can, each a
+count() with the stand-in's latency (lognormal, 5 ms median, 20 ms
+p99). Throttled writes are retried like botocore does, so a hot item
+shows as lower throughput and a latency tail first, and as failed writes
+when the retries run out. The capacity is scaled down (100 units a
+second instead of DynamoDB's 1000) so that a single process can
+saturate it; the ratios are what matter.
+"""
+import argparse
+import threading
+import time
+
+from . import here # pylint: disable=unused-import
+import global_stats
+from tests.functions.skill import local_dynamodb
+
+
+def percentile(sorted_values, fraction):
+    # nearest-rank
+    index = max(0, int(round(fraction * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+def run(shards, threads, seconds, key_capacity):
+    # pylint: disable=too-many-locals
+    resource = local_dynamodb.Resource(
+        latency=local_dynamodb.lognormal(0.005, 0.02),
+        key_write_capacity=key_capacity)
+    table = resource.Table('bench-table')
+    stats = global_stats.GlobalStats(lambda: table, shards=shards)
+    # today's, as roll_up sums it
+    name = f'{global_stats.QUESTIONS}#{global_stats.day(time.time())}'
+    latencies, failures = [], []
+    deadline = time.perf_counter() + seconds
+
+    def container():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                stats.count(name, 10)
+            except Exception: # pylint: disable=broad-except
+                failures.append(1)
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    workers = [threading.Thread(target=container) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    roll_up_started = time.perf_counter()
+    aggregates = stats.roll_up()
+    roll_up_ms = (time.perf_counter() - roll_up_started) * 1000
+    assert aggregates[name]['count'] == 10 * len(latencies)
+
+    latencies.sort()
+    return {'shards': shards,
+            'writes_per_s': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.5) if latencies else None,
+            'p99': percentile(latencies, 0.99) if latencies else None,
+            'failed': len(failures),
+            'throttled': sum(table.throttled.values()),
+            'roll_up_ms': roll_up_ms}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--shards', type=int, nargs='+',
+                        default=[1, global_stats.SHARDS])
+    parser.add_argument('--key-capacity', type=float, default=100,
+                        help='write units per second of an item')
+    args = parser.parse_args(argv)
+
+    print(f'{args.threads} threads, {args.key_capacity:g} write units/s '
+          f'per item')
+    print('shards   writes/s     p50 ms     p99 ms   throttled   failed'
+          '   roll-up ms')
+    results = []
+    for shards in args.shards:
+        result = run(shards, args.threads, args.seconds, args.key_capacity)
+        results.append(result)
+        print(f"{shards:6d} {result['writes_per_s']:10.0f}",
+              f"{result['p50']:10.2f} {result['p99']:10.2f}",
+              f"{result['throttled']:11d} {result['failed']:8d}",
+              f"{result['roll_up_ms']:12.2f}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Load test of the skill handler: replays simulated sessions (launch,
+operation and difficulty, a run of answers, some help, stop and session
+end) against main.handler in-process, with the in-memory DynamoDB table
+of the tests. Each response's session attributes go into the next event
+of the session, like Alexa does it, so the skill walks its real paths.
+
+Reports throughput and p50/p95/p99 latency per intent, and the peak
+memory of a worker, to compare with the function's MemorySize.
+
+    python -m benchmarks.loadtest [--workers N] [--sessions N]
+                                  [--answers N] [--lazy] [--lazy-envelope]
+                                  [--seed N] [--ddb-latency MS[,P99_MS]]
+                                  [--ddb-throttle-rate FRACTION]
+                                  [--async-io]
+
+The table is the local DynamoDB stand-in (tests/functions/skill/
+local_dynamodb.py). By default it answers instantly; --ddb-latency makes
+each call take MS (lognormal with a P99_MS tail if given) and
+--ddb-throttle-rate throttles that fraction of calls, which the client
+retries. What the table did is reported too: calls, throttled calls and
+consumed capacity units.
+
+Workers are separate processes, each with its own "container" (module
+state, caches, table). Logging goes to /dev/null, but it still costs
+what it costs in Lambda; the LOG_* variables of core apply.
+"""
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+from . import here
+
+os.environ['STAGE'] = 'benchmark' # print the logs, as in Lambda
+
+
+OPERATIONS = ['addition', 'subtraction', 'multiplication', 'division']
+DIFFICULTIES = ['easy', 'normal', 'hard']
+
+def percentile(sorted_values, fraction):
+    # nearest-rank
+    index = max(0, int(round(fraction * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+class Session:
+    """Events of one simulated user's session, built from the fixtures."""
+
+    def __init__(self, templates, user_id):
+        self.templates = templates
+        self.user_id = user_id
+        self.attributes = {}
+        self.new = True
+
+    def event(self, name, **slots):
+        event = copy.deepcopy(self.templates[name])
+        event['session']['new'] = self.new
+        event['session']['user']['userId'] = self.user_id
+        event['session']['attributes'] = self.attributes
+        event['context']['System']['user']['userId'] = self.user_id
+        for slot, value in slots.items():
+            event['request']['intent']['slots'][slot] = {'name': slot,
+                                                         'value': value}
+        self.new = False
+        return event
+
+    def respond(self, response):
+        self.attributes = response.get('sessionAttributes') or {}
+
+
+def load_templates():
+    from tests.functions.skill import fixtures # pylint: disable=import-outside-toplevel
+    templates = {name: fixtures.load_event(name)
+                 for name in ['launch_request', 'did_select_operation',
+                              'did_select_difficulty', 'did_answer_correct',
+                              'session_ended_request']}
+    for intent_name in ['AMAZON.HelpIntent', 'AMAZON.StopIntent']:
+        templates[intent_name] = fixtures.build_intent_event(intent_name)
+    return templates
+
+def table_options(latency, throttle_rate, seed):
+    # local_dynamodb.Resource options of the command line's --ddb-*
+    from tests.functions.skill import local_dynamodb # pylint: disable=import-outside-toplevel
+    options = {'throttle_rate': throttle_rate, 'seed': seed}
+    if latency:
+        median, _, p99 = latency.partition(',')
+        options['latency'] = local_dynamodb.lognormal(
+            float(median) / 1000, float(p99) / 1000) if p99 \
+            else local_dynamodb.constant(float(median) / 1000)
+    return options
+
+def init_worker(latency=None, throttle_rate=0.0, seed=0):
+    # each worker is a container of its own
+    from tests.functions.skill import fixtures # pylint: disable=import-outside-toplevel
+    import main # pylint: disable=import-outside-toplevel
+    main.sb.dynamodb_client = fixtures.mock_dynamodb_client(
+        **table_options(latency, throttle_rate, seed))
+    sys.stdout = open(os.devnull, 'w')
+
+def run_worker(args):
+    # pylint: disable=too-many-locals
+    worker, sessions, answers, seed = args
+    import content # pylint: disable=import-outside-toplevel
+    import main # pylint: disable=import-outside-toplevel
+    import models # pylint: disable=import-outside-toplevel
+
+    rng = random.Random(seed + worker)
+    # the skill's session seeds (so its questions) come from random too
+    random.seed(seed + worker)
+    templates = load_templates()
+    latencies = {}
+
+    def invoke(session, event):
+        request = event['request']
+        intent = request['intent']['name'] if 'intent' in request \
+            else request['type']
+        start = time.perf_counter()
+        response = main.handler(event, None)
+        latencies.setdefault(intent, []).append(
+            (time.perf_counter() - start) * 1000)
+        session.respond(response)
+
+    started = time.perf_counter()
+    for number in range(sessions):
+        # returning users, so there's something in the table to read
+        user_id = f'amzn1.ask.account.load{worker}.{number % 100}'
+        session = Session(templates, user_id)
+        invoke(session, session.event('launch_request'))
+        invoke(session, session.event('did_select_operation',
+                                      operation=rng.choice(OPERATIONS)))
+        invoke(session, session.event('did_select_difficulty',
+                                      difficulty=rng.choice(DIFFICULTIES)))
+        for _ in range(answers):
+            if rng.random() < 0.05:
+                invoke(session, session.event('AMAZON.HelpIntent'))
+            usage = models.SkillUsage.from_attributes(session.attributes)
+            answer = content.asked_question(usage)[2]
+            if rng.random() < 0.2:
+                answer += rng.choice([-1, 1])
+            invoke(session, session.event('did_answer_correct',
+                                          answer=str(answer)))
+        invoke(session, session.event('AMAZON.StopIntent'))
+        invoke(session, session.event('session_ended_request'))
+    elapsed = time.perf_counter() - started
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    table = main.sb.dynamodb_client.local_table.stats()
+    return latencies, elapsed, peak_rss_mb, table
+
+def report(results, wall_time):
+    latencies = {}
+    table = {'calls': 0, 'throttled': 0, 'read': 0, 'write': 0}
+    for worker_latencies, _, _, worker_table in results:
+        for intent, values in worker_latencies.items():
+            latencies.setdefault(intent, []).extend(values)
+        table['calls'] += sum(worker_table['calls'].values())
+        table['throttled'] += sum(worker_table['throttled'].values())
+        for kind in ['read', 'write']:
+            table[kind] += worker_table['consumed'].get(kind, 0)
+    total = sum(len(values) for values in latencies.values())
+
+    print(f'{total} requests in {wall_time:.2f} s, '
+          f'{total / wall_time:.0f} requests/s over {len(results)} worker(s), '
+          f'peak worker RSS {max(result[2] for result in results):.0f} MB')
+    print(f"table: {table['calls']} calls, {table['throttled']} throttled, "
+          f"{table['read']:g} read and {table['write']:g} write units")
+    print('intent                   count     p50 ms     p95 ms     p99 ms')
+    for intent in sorted(latencies):
+        values = sorted(latencies[intent])
+        print(intent.ljust(22), f'{len(values):7d}',
+              *(f'{percentile(values, p):10.3f}' for p in [0.5, 0.95, 0.99]))
+    return latencies
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--sessions', type=int, default=200,
+                        help='sessions per worker')
+    parser.add_argument('--answers', type=int, default=10,
+                        help='answers per session')
+    parser.add_argument('--lazy', action='store_true',
+                        help='run the skill with LAZY_INIT')
+    parser.add_argument('--lazy-envelope', action='store_true',
+                        help='run the skill with LAZY_ENVELOPE')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--async-io', action='store_true',
+                        help='run the skill with ASYNC_IO (implies --lazy)')
+    parser.add_argument('--ddb-latency', metavar='MS[,P99_MS]',
+                        help='latency of each DynamoDB call')
+    parser.add_argument('--ddb-throttle-rate', type=float, default=0.0,
+                        metavar='FRACTION',
+                        help='fraction of DynamoDB calls throttled')
+    args = parser.parse_args(argv)
+
+    os.environ['LAZY_INIT'] = 'true' if args.lazy or args.async_io else ''
+    os.environ['ASYNC_IO'] = 'true' if args.async_io else ''
+    os.environ['LAZY_ENVELOPE'] = 'true' if args.lazy_envelope else ''
+    tasks = [(worker, args.sessions, args.answers, args.seed)
+             for worker in range(args.workers)]
+
+    started = time.perf_counter()
+    initargs = (args.ddb_latency, args.ddb_throttle_rate, args.seed)
+    with multiprocessing.Pool(args.workers, initializer=init_worker,
+                              initargs=initargs) as pool:
+        results = pool.map(run_worker, tasks)
+    wall_time = time.perf_counter() - started
+    return report(results, wall_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Cost of core.log_invocation per invocation of a DidAnswer request:
+logging everything every time (as before) vs allow-listed fields,
+sampling and both. Logs go to a byte counter through structlog's
+PrintLogger like they go to stdout in Lambda; the bytes are all the lines
+an invocation writes, the metrics line and the service context included.
+
+    python -m benchmarks.log_invocation
+"""
+import contextlib
+import io
+import json
+import os
+import timeit
+
+from . import here
+
+# not "localtest", which logs through the stdlib logging for tests
+os.environ['STAGE'] = 'benchmark'
+import core # pylint: disable=wrong-import-position
+
+
+INVOCATION_FIELDS = ['version',
+                     'session.new',
+                     'session.sessionId',
+                     'request.type',
+                     'request.requestId',
+                     'request.locale',
+                     'request.intent.name',
+                     'request.reason']
+RESULT_FIELDS = ['response.outputSpeech.ssml',
+                 'response.shouldEndSession']
+
+def load_event():
+    path = os.path.join(here, '..', 'tests', 'functions', 'skill',
+                        'events', 'did_answer_correct.json')
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def response():
+    # roughly what the skill returns for DidAnswer, APL directive included
+    with open(os.path.join(here, '..', 'src', 'functions', 'skill',
+                           'apl_document.json'), encoding='utf-8') as f:
+        document = json.load(f)
+    return {'version': '1.0',
+            'sessionAttributes': {'v': 1, 'o': 'mul', 'd': 2, 'r': 24,
+                                  'q': 10, 'c': 8, 's': 3},
+            'response': {
+                'outputSpeech': {
+                    'type': 'SSML',
+                    'ssml': '<speak>Correct! How much is 8 times 3?</speak>'},
+                'reprompt': {'outputSpeech': {
+                    'type': 'SSML',
+                    'ssml': '<speak>How much is 8 times 3?</speak>'}},
+                'directives': [{
+                    'type': 'Alexa.Presentation.APL.RenderDocument',
+                    'document': document,
+                    'datasources': {'data': {'type': 'object', 'properties': {
+                        'op1': 8, 'op2': 3, 'operand': '×'}}}}],
+                'shouldEndSession': False}}
+
+class Output(io.TextIOBase):
+    """Counts what's written, as stdout would get it."""
+
+    def __init__(self):
+        super().__init__()
+        self.bytes = 0
+
+    def write(self, s):
+        self.bytes += len(s.encode('utf-8'))
+        return len(s)
+
+def per_call_us(fn, number=5000):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+def bytes_per_call(fn, output, number=20000):
+    # sampling is random, hence the many calls
+    output.bytes = 0
+    for _ in range(number):
+        fn()
+    return output.bytes / number
+
+def main():
+    event, result = load_event(), response()
+    configs = [
+        ('everything', {'sample_rate': 1}),
+        ('allow-lists', {'sample_rate': 1,
+                         'invocation_fields': INVOCATION_FIELDS,
+                         'result_fields': RESULT_FIELDS}),
+        ('allow-lists, cap', {'sample_rate': 1,
+                              'max_payload': 512,
+                              'invocation_fields': INVOCATION_FIELDS,
+                              'result_fields': RESULT_FIELDS}),
+        ('sample 10%', {'sample_rate': 0.1}),
+        ('sample 10%, lists', {'sample_rate': 0.1,
+                               'invocation_fields': INVOCATION_FIELDS,
+                               'result_fields': RESULT_FIELDS}),
+        ('nothing logged', {'sample_rate': 0}),
+    ]
+
+    print('config              time (us)   logged bytes/invocation')
+    output = Output()
+    with contextlib.redirect_stdout(output):
+        rows = []
+        for name, config in configs:
+            handler = core.log_invocation(lambda _e, _c: result, **config)
+            call = lambda h=handler: h(event, None)
+            rows.append((name, per_call_us(call),
+                         bytes_per_call(call, output)))
+
+    for name, us, logged in rows:
+        print(name.ljust(20), f'{us:8.2f}', f'{logged:18.0f}')
+
+
+if __name__ == '__main__':
+    main()
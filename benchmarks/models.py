@@ -0,0 +1,131 @@
+"""
+Per-turn cost of the models: decoding the session attributes, applying
+and describing the operation and encoding the attributes back, the way
+the DidAnswer handler does it, with attrs-based models as they were and
+with the slots models and their compiled codecs.
+
+    python -m benchmarks.models
+"""
+import enum
+import time
+import timeit
+from typing import Optional
+
+import attr
+
+import models
+
+
+class LegacyOperation(enum.Enum):
+    ADD = 'add'
+    SUB = 'sub'
+    MUL = 'mul'
+    DIV = 'div'
+
+    def __call__(self, op1, op2):
+        cls = self.__class__
+        mapping = {cls.ADD: op1 + op2,
+                   cls.SUB: op1 - op2,
+                   cls.MUL: op1 * op2,
+                   cls.DIV: int(op1 / op2)}
+        return mapping[self]
+
+    def as_verb(self, _locale):
+        cls = self.__class__
+        mapping = {cls.ADD: 'plus',
+                   cls.SUB: 'minus',
+                   cls.MUL: 'times',
+                   cls.DIV: 'divided by'}
+        return mapping[self]
+
+    def as_symbol(self):
+        cls = self.__class__
+        mapping = {cls.ADD: '+',
+                   cls.SUB: '-',
+                   cls.MUL: '×',
+                   cls.DIV: '÷'}
+        return mapping[self]
+
+
+@attr.s(auto_attribs=True)
+class LegacySessionData:
+    # pylint: disable=too-few-public-methods
+    operation: Optional[LegacyOperation] = attr.ib(
+        default=None,
+        converter=lambda a: LegacyOperation(a) if a else None)
+    difficulty: Optional[int] = attr.ib(default=None)
+    correct_result: int = attr.ib(default=0)
+    questions_count: int = attr.ib(default=0)
+    correct_answers_count: int = attr.ib(default=0)
+    streak_count: int = attr.ib(default=0)
+
+    @classmethod
+    def from_attributes(cls, attributes):
+        attributes = attributes or {}
+        return cls(operation=attributes.get('operation'),
+                   difficulty=attributes.get('difficulty'),
+                   correct_result=attributes.get('correct_result', 0),
+                   questions_count=attributes.get('questions_count', 0),
+                   correct_answers_count=attributes.get('correct_answers_count', 0),
+                   streak_count=attributes.get('streak_count', 0))
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class LegacySkillUsage:
+    launch_count: int = attr.ib(default=0)
+    previous_session_end: int = attr.ib(default=0, converter=int)
+    session_data: Optional[LegacySessionData] = attr.ib(default=None)
+
+    @classmethod
+    def from_attributes(cls, attributes):
+        attributes = attributes or {}
+        return cls(launch_count=attributes.get('launch_count', 0),
+                   previous_session_end=attributes.get('previous_session_end', 0),
+                   session_data=LegacySessionData.from_attributes(
+                       attributes.get('session_data')))
+
+
+VERBOSE = {'launch_count': 23,
+           'previous_session_end': int(time.time()),
+           'session_data': {'operation': 'mul',
+                            'difficulty': 2,
+                            'correct_result': 12,
+                            'questions_count': 9,
+                            'correct_answers_count': 7,
+                            'streak_count': 2}}
+COMPACT = models.SkillUsage.from_attributes(VERBOSE).to_session_attributes()
+
+def legacy_turn():
+    usage = LegacySkillUsage.from_attributes(VERBOSE)
+    operation = usage.session_data.operation
+    usage.session_data.correct_result = operation(24, 2)
+    text = f'24 {operation.as_verb("en-US")} 2 {operation.as_symbol()}'
+    usage.session_data.operation = operation.value # the old persist HACK
+    return attr.asdict(usage), text
+
+def turn():
+    usage = models.SkillUsage.from_attributes(COMPACT)
+    operation = usage.session_data.operation
+    usage.session_data.correct_result = operation(24, 2)
+    text = f'24 {operation.as_verb("en-US")} 2 {operation.as_symbol()}'
+    return usage.to_session_attributes(), text
+
+def per_call_us(fn, number=20000):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+def main():
+    assert legacy_turn()[1] == turn()[1]
+
+    print('per turn            time (us)')
+    for name, fn in [('legacy', legacy_turn), ('slots', turn)]:
+        print(name.ljust(20), f'{per_call_us(fn):8.2f}')
+
+    print('operation calls     time (us)')
+    for name, operation in [('legacy', LegacyOperation.DIV),
+                            ('tables', models.Operation.DIV)]:
+        fn = lambda op=operation: (op(24, 2), op.as_verb(None), op.as_symbol())
+        print(name.ljust(20), f'{per_call_us(fn):8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Microbenchmarks of the functions on the path of every answer turn, with
+stored baselines to compare against.
+
+    python -m benchmarks.suite                    # just run
+    python -m benchmarks.suite --save [FILE]      # run, store a baseline
+    python -m benchmarks.suite --compare [FILE] [--threshold 0.2]
+
+A typical change: --save on main, then --compare on the branch, on the
+same machine; timings from different machines don't compare. --compare
+flags cases slower than the baseline by more than the threshold (a
+fraction) and exits with 1 if there are any. On a shared or virtual
+machine, rerun the comparison before trusting a single regression.
+
+FILE defaults to benchmarks/baseline.json, the reference baseline in the
+repo, saved with --save (its environment is in the file). It shows what
+the numbers should roughly be; refresh it when a change moves them for
+good. CI (buildspec.yml) doesn't run the suite, nor keep baselines.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+from . import here
+import content
+import models
+import utils
+
+
+DEFAULT_BASELINE = os.path.join(here, 'baseline.json')
+
+SESSION_ATTRIBUTES = {'v': 1, 'l': 23, 'p': 1539255600, 'o': 'mul', 'd': 2,
+                      'q': 9, 'c': 7, 's': 2, 'e': 2891336453}
+PERSISTENT_ATTRIBUTES = models.asdict(
+    models.SkillUsage.from_attributes(SESSION_ATTRIBUTES))
+
+def cases():
+    # name -> function to time; names are the keys of the baselines
+    usage = models.SkillUsage.from_attributes(SESSION_ATTRIBUTES)
+    session_data = usage.session_data
+    return {
+        'content.generate_ops':
+            lambda: content.generate_ops(models.Operation.MUL, 3),
+        'content.build_question':
+            lambda: content.build_question(usage, 'en-US'),
+        'content.asked_question':
+            lambda: content.asked_question(usage),
+        'content.training_question':
+            lambda: content.training_question(7, 8, session_data, 'en-US'),
+        'utils.combine_messages':
+            lambda: utils.combine_messages('Correct.', 'How about 7 times 8?'),
+        'content.correct':
+            lambda: content.correct('en-US'),
+        'content.session_summary':
+            lambda: content.session_summary(session_data, 'en-US'),
+        'SkillUsage.from_attributes (session)':
+            lambda: models.SkillUsage.from_attributes(SESSION_ATTRIBUTES),
+        'SkillUsage.from_attributes (persistent)':
+            lambda: models.SkillUsage.from_attributes(PERSISTENT_ATTRIBUTES),
+        'SkillUsage.to_session_attributes':
+            usage.to_session_attributes,
+        'models.asdict':
+            lambda: models.asdict(usage),
+    }
+
+def per_call_us(fn, number, repeat=3):
+    random.seed(0)
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+def run(rounds=4):
+    # the cases take turns over several rounds, keeping the best time of
+    # each, so that a noisy moment of the machine doesn't hit one case only
+    timed = cases()
+    # about 50 ms per repeat (autorange aims for 200 ms)
+    numbers = {name: max(1, timeit.Timer(fn).autorange()[0] // 4)
+               for name, fn in timed.items()}
+    results = {}
+    for _ in range(rounds):
+        for name, fn in timed.items():
+            us = per_call_us(fn, numbers[name])
+            results[name] = min(us, results.get(name, us))
+    return results
+
+def environment():
+    return {'python': platform.python_version(),
+            'machine': platform.machine(),
+            'node': platform.node()}
+
+def compare(baseline, results, threshold):
+    # prints the comparison, returns the names of regressed cases
+    regressions = []
+    print('case                                     baseline us   now us   change')
+    for name, now in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(name.ljust(40), '        -', f'{now:8.3f}', '     new')
+            continue
+        change = now / before - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(name.ljust(40), f'{before:9.3f}', f'{now:8.3f}',
+              f'{change:+8.1%}{flag}')
+
+    if baseline.get('environment') != environment():
+        print('note: the baseline comes from a different environment:',
+              baseline.get('environment'))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--save', nargs='?', const=DEFAULT_BASELINE,
+                      metavar='FILE')
+    mode.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE,
+                      metavar='FILE')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run()
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        return 1 if regressions else 0
+
+    for name, us in results.items():
+        print(name.ljust(40), f'{us:8.3f} us')
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'results': results},
+                      f, indent=2)
+            f.write('\n')
+        print('baseline saved to', args.save)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
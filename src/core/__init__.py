@@ -1,7 +1,11 @@
+import collections
 import functools
+import json
 import logging
 import os
+import random
 import sys
+import time
 
 import structlog
 
@@ -43,28 +47,230 @@ structlog.configure_once(
 
 logger = structlog.get_logger()
 
-def log_invocation(fn):
+
+class Timer:
+    """Context manager recording how long its block took into Metrics."""
+
+    __slots__ = ('collector', 'name', 'start')
+
+    def __init__(self, collector, name):
+        self.collector = collector
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = self.collector.clock()
+        return self
+
+    def __exit__(self, *_exc_info):
+        collector = self.collector
+        collector.record(self.name, (collector.clock() - self.start) * 1000)
+
+
+class Metrics:
+    """
+    Collects durations (in milliseconds) of the phases of an invocation
+    and emits them in one log line, in the CloudWatch embedded metric
+    format. CloudWatch extracts the metrics from the log, percentiles
+    included, so there are no API calls to make. A phase recorded more
+    than once in an invocation is emitted as a list of values.
+
+    Dimensions set while timing (e.g. the handler) apply to all the
+    metrics of the invocation, along with the stage. Annotations are
+    logged in the same line but are neither metrics nor dimensions,
+    they're there for log analytics (see tools/log_analytics.py).
+
+    log_invocation samples the line like the invocation's other logs:
+    flush() is given the sample rate, which is logged with the line
+    (when it's below 1) so that log analytics can scale the counts back
+    up, and clear() drops what wasn't sampled. Percentiles of sampled
+    metrics are as good as of all of them, sums and sample counts in
+    CloudWatch are not.
+    """
+
+    def __init__(self, namespace, clock=time.perf_counter):
+        self.namespace = namespace
+        self.clock = clock
+        self.dimensions = {}
+        self.properties = {}
+        self.values = collections.defaultdict(list)
+
+    def timed(self, name, **dimensions):
+        if dimensions:
+            self.dimensions.update(dimensions)
+        return Timer(self, name)
+
+    def record(self, name, milliseconds):
+        self.values[name].append(milliseconds)
+
+    def annotate(self, **properties):
+        self.properties.update(properties)
+
+    def flush(self, sample_rate=1):
+        if not self.values:
+            self.properties = {}
+            return
+
+        values = {}
+        for name, durations in self.values.items():
+            durations = [round(duration, 3) for duration in durations]
+            values[name] = durations[0] if len(durations) == 1 else durations
+        aws = {'Timestamp': int(time.time() * 1000),
+               'CloudWatchMetrics': [{
+                   'Namespace': self.namespace,
+                   'Dimensions': [['stage'] + sorted(self.dimensions)],
+                   'Metrics': [{'Name': name, 'Unit': 'Milliseconds'}
+                               for name in values]}]}
+        if sample_rate < 1:
+            self.properties['sample_rate'] = sample_rate
+        logger.info('metrics', _aws=aws, **self.dimensions,
+                    **self.properties, **values)
+        self.clear()
+
+    def clear(self):
+        self.dimensions = {}
+        self.properties = {}
+        self.values = collections.defaultdict(list)
+
+metrics = Metrics(os.environ.get('SERVICE', 'local'))
+timed = metrics.timed
+annotate = metrics.annotate
+
+def _env_list(name):
+    value = os.environ.get(name)
+    if not value:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+# What log_invocation logs, configurable per function. The defaults log
+# everything, every time.
+#   LOG_SAMPLE_RATE - fraction of invocations (0 to 1) with their event,
+#       result and metrics logged; errors are logged always
+#   LOG_MAX_PAYLOAD - logged payloads with a longer JSON are cut to this
+#       many characters (0 for no limit)
+#   LOG_INVOCATION_FIELDS, LOG_RESULT_FIELDS - comma separated allow-lists
+#       of dotted paths of the event and result to log, e.g.
+#       "request.type,request.intent.name"; anything else, like user
+#       and device IDs, is left out
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1))
+LOG_MAX_PAYLOAD = int(os.environ.get('LOG_MAX_PAYLOAD', 0))
+LOG_INVOCATION_FIELDS = _env_list('LOG_INVOCATION_FIELDS')
+LOG_RESULT_FIELDS = _env_list('LOG_RESULT_FIELDS')
+
+def select_fields(data, paths):
+    """
+    Returns a copy of data with only the given paths (tuples of keys
+    into nested dicts), or data itself when paths is None. Paths not
+    in data are skipped.
+    """
+    if paths is None or not isinstance(data, dict):
+        return data
+
+    selected = {}
+    for path in paths:
+        value = data
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = selected
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+    return selected
+
+def cap_size(data, max_size):
+    # data if its JSON is short enough, otherwise the JSON cut to max_size
+    if not max_size:
+        return data
+    rendered = json.dumps(data, default=str)
+    if len(rendered) <= max_size:
+        return data
+    return rendered[:max_size] + '...'
+
+def is_warmup(event):
+    """
+    Is the event a keep-warm ping? Either a scheduled CloudWatch event or
+    anything with a true "warmup" field, like the input of the KeepWarm
+    schedule in functions.yml.
+    """
+    return isinstance(event, dict) and \
+        (event.get('warmup') is True or event.get('source') == 'aws.events')
+
+def log_invocation(fn=None, *, sample_rate=None, max_payload=None,
+                   invocation_fields=None, result_fields=None,
+                   rng=random):
     """
     A decorator for Lambda handlers that logs the input event and the return
     value of the function. Easy and convenient way how to add more visibility
     to the runtime of your Lambdas.
+
+    Used bare, it's configured by the LOG_* environment variables above;
+    the keyword arguments override them.
+
+    It also times the whole invocation and flushes the metrics once
+    it's done, if the invocation was sampled or failed. Warm-up events
+    (see is_warmup) are passed to the function without any of that,
+    they aren't invocations worth logging.
     """
+    # pylint: disable=too-many-arguments
+    if fn is None:
+        return functools.partial(log_invocation,
+                                 sample_rate=sample_rate,
+                                 max_payload=max_payload,
+                                 invocation_fields=invocation_fields,
+                                 result_fields=result_fields,
+                                 rng=rng)
+
+    if sample_rate is None:
+        sample_rate = LOG_SAMPLE_RATE
+    if max_payload is None:
+        max_payload = LOG_MAX_PAYLOAD
+    if invocation_fields is None:
+        invocation_fields = LOG_INVOCATION_FIELDS
+    if result_fields is None:
+        result_fields = LOG_RESULT_FIELDS
+    invocation_paths = invocation_fields and \
+        [tuple(field.split('.')) for field in invocation_fields]
+    result_paths = result_fields and \
+        [tuple(field.split('.')) for field in result_fields]
+
+    def shape(data, paths):
+        return cap_size(select_fields(data, paths), max_payload)
 
     @functools.wraps(fn)
     def wrapper(event, context):
+        if is_warmup(event):
+            return fn(event, context)
+        sampled = sample_rate >= 1 or rng.random() < sample_rate
+        failed = False
         try:
-            logger.info('lambda invocation', invocation=event)
-            result = fn(event, context)
+            if sampled:
+                logger.info('lambda invocation',
+                            invocation=shape(event, invocation_paths))
+            with timed('total'):
+                result = fn(event, context)
         except Exception as e: # pylint: disable=broad-except,invalid-name
+            failed = True
             logger.error('execution error',
                          exc_info=e,
-                         invocation=event,
+                         invocation=shape(event, invocation_paths),
                          function_name=context.function_name,
                          function_version=context.function_version,
                          aws_request_id=context.aws_request_id)
             raise e
         else:
-            logger.info('lambda result', result=result)
+            if sampled:
+                logger.info('lambda result',
+                            result=shape(result, result_paths))
             return result
+        finally:
+            if failed:
+                metrics.flush() # errors are logged always
+            elif sampled:
+                metrics.flush(min(sample_rate, 1))
+            else:
+                metrics.clear()
 
     return wrapper
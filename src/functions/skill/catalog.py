@@ -0,0 +1,59 @@
+import functools
+import json
+import os
+import random
+import sys
+
+
+DEFAULT_LOCALE = 'en-US'
+LOCALES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                           'locales')
+
+def available_locales():
+    return sorted(name[:-len('.json')] for name in os.listdir(LOCALES_DIR)
+                  if name.endswith('.json'))
+
+def resolve(locale):
+    """
+    The locale whose catalog serves locale: the locale itself if there is
+    one for it, else one of the same language, else DEFAULT_LOCALE.
+    """
+    available = available_locales()
+    if locale in available:
+        return locale
+    language = (locale or '').split('-')[0]
+    for candidate in available:
+        if candidate.split('-')[0] == language:
+            return candidate
+    return DEFAULT_LOCALE
+
+def compile_entry(entry):
+    # a message is a template or a list of variants to pick from randomly;
+    # either way, it ends up as a tuple of interned templates
+    variants = entry if isinstance(entry, list) else [entry]
+    return tuple(sys.intern(variant) for variant in variants)
+
+@functools.lru_cache(maxsize=None)
+def load(locale):
+    with open(os.path.join(LOCALES_DIR, f'{locale}.json'),
+              encoding='utf-8') as f:
+        entries = json.load(f)
+    messages = {} if locale == DEFAULT_LOCALE else dict(load(DEFAULT_LOCALE))
+    # a partial translation falls back to the default for what it lacks
+    messages.update((key, compile_entry(entry))
+                    for key, entry in entries.items())
+    return messages
+
+@functools.lru_cache(maxsize=None)
+def catalog(locale):
+    """
+    Message id -> tuple of templates for the locale of a request. Each
+    locale's file is read and compiled the first time it's asked for and
+    then shared by all locales resolving to it.
+    """
+    return load(resolve(locale))
+
+def message(key, locale, **values):
+    variants = catalog(locale)[key]
+    template = variants[0] if len(variants) == 1 else random.choice(variants)
+    return template.format(**values) if values else template
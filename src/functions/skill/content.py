@@ -1,136 +1,136 @@
-import math
-import random
+import functools
+import json
+import os
 
 from ask_sdk_model.interfaces.alexa.presentation.apl import \
     RenderDocumentDirective
 
-from models import Operation
+import catalog
+import exercises
 import utils
 
 
-@utils.randomize
-def confirmation(_locale):
-    return ['OK.', 'Alright.', 'Got it.'] # add some speechcons? gotcha?
+def confirmation(locale):
+    return catalog.message('confirmation', locale)
 
-@utils.randomize
-def congratulations(_locale):
-    return ['Yay!', 'Great job.', 'Hooray.'] # speechcons
+def congratulations(locale):
+    return catalog.message('congratulations', locale)
 
-@utils.randomize
-def correct(_locale):
-    return ['Yes.', 'Indeed.', 'You\'ve got that right.', 'Correct.']
+def correct(locale):
+    return catalog.message('correct', locale)
 
-def incorrect(result, _locale):
-    return f'The correct result is {result}. Try another one.'
+def incorrect(result, locale):
+    return catalog.message('incorrect', locale, result=result)
 
-@utils.randomize
-def streak_confirmation(streak_count, _locale):
-    return [f'That\'s {streak_count} correct answers in a row. Keep going.',
-            f'You got {streak_count} right answers in a row.',
-            f'You\'re on a streak! {streak_count} so far. Can you do more?']
+def streak_confirmation(streak_count, locale):
+    return catalog.message('streak_confirmation', locale,
+                           streak_count=streak_count)
 
-def streak_encouragement(streak_count, _locale):
-    return utils.combine_messages(congratulations(_locale),
-                                  streak_confirmation(streak_count, _locale))
+def streak_encouragement(streak_count, locale):
+    return utils.combine_messages(congratulations(locale),
+                                  streak_confirmation(streak_count, locale))
 
-def dead_end_message(_locale):
-    # pylint: disable=line-too-long
-    return 'Sorry, I don\'t understand that. Let\'s try from the beginning. What would you like to train? Addition, subtraction, multiplication, or division?'
+def dead_end_message(locale):
+    return catalog.message('dead_end', locale)
 
-def help_message(_locale):
-    # pylint: disable=line-too-long
-    return 'This skill helps you practice your math arithmetics. Simply choose the operation you want to practice and a difficulty level. Alexa will then keep on giving you math exercises until you tell her to stop. So what would you like to train? Addition, subtraction, multiplication, or division?'
+def help_message(locale):
+    return catalog.message('help', locale)
 
-def intro_message(launch_count, _locale):
-    # pulint: disable=line-too-long
+def intro_message(launch_count, locale):
     if launch_count == 0:
-        return 'Hello and welcome to match practice. This skill helps you to get great in basic math arithmetics by you training exercise to solve.'
-    return 'Welcome back to math practice.'
+        return catalog.message('intro_first', locale)
+    return catalog.message('intro_returning', locale)
 
-def start_message(_locale):
-    return 'Let\'s get started'
+def start_message(locale):
+    return catalog.message('start', locale)
 
-def session_summary(session_data, _locale):
-    return f'You\'ve got {session_data.correct_answers_count} out of {session_data.questions_count} correct. Talk to you soon!'
+def session_summary(session_data, locale):
+    return catalog.message(
+        'session_summary', locale,
+        correct_answers_count=session_data.correct_answers_count,
+        questions_count=session_data.questions_count)
 
 # prompts
 
-def prompt_for_difficulty(_locale):
+def prompt_for_difficulty(locale):
     # should work as a reprompt
-    return 'Choose your difficulty level. Easy, normal, or hard?'
+    return catalog.message('prompt_for_difficulty', locale)
 
-def prompt_for_operation(_locale):
+def prompt_for_operation(locale):
     # should work as a reprompt
-    return 'What would you like to train? Addition, subtraction, multiplication, or division?'
+    return catalog.message('prompt_for_operation', locale)
 
 # training
 
 def build_question(usage, locale):
-    op1, op2, result = generate_ops(usage.session_data.operation,
-                                    usage.session_data.difficulty)
-    question = training_question(op1, op2, usage.session_data, locale)
+    question, result, apl_data = next_question(usage, locale)
+    apl = RenderDocumentDirective(document=apl_document(),
+                                  datasources=apl_data)
+    return question, result, apl
+
+def next_question(usage, locale):
+    # build_question with the APL data source instead of the directive
+    session_data = usage.session_data
+    if session_data.seed is None:
+        session_data.seed = exercises.new_seed()
+    # derived from the seed now, nothing to store
+    session_data.correct_result = session_data.op1 = session_data.op2 = 0
+
+    op1, op2, result = asked_question(usage)
+    question = training_question(op1, op2, session_data, locale)
     apl_data = {
         'data': {
             'type': 'object',
             'properties': {
                 'op1': op1,
                 'op2': op2,
-                'operand': usage.session_data.operation.as_symbol()
+                'operand': session_data.operation.as_symbol()
             }
         }
     }
-
-    apl = RenderDocumentDirective(document=apl_document(),
-                                  datasources=apl_data)
-
-    return question, result, apl
-
-def training_question(op1, op2, session_data, _locale):
-    if session_data.questions_count == 0:
-        lead = 'What is'
+    return question, result, apl_data
+
+def asked_question(usage):
+    """
+    (op1, op2, result) of the question the user was asked last, which is
+    the questions_count-th of the session. Sessions started before the
+    seed have the result stored instead, and maybe the operands (else
+    they are 0).
+    """
+    session_data = usage.session_data
+    if session_data.seed is None:
+        return session_data.op1, session_data.op2, \
+            session_data.correct_result
+    return generate_ops(session_data.operation, session_data.difficulty,
+                        session_data.mastery, session_data.seed,
+                        session_data.questions_count)
+
+def apl_directive(apl_data):
+    # a serialized RenderDocumentDirective, for utils.response_dict
+    return utils.FrozenDict(type='Alexa.Presentation.APL.RenderDocument',
+                            document=apl_document(),
+                            datasources=apl_data)
+
+def training_question(op1, op2, session_data, locale):
+    key = 'first_question' if session_data.questions_count == 0 \
+        else 'question'
+    return catalog.message(key, locale, op1=op1, op2=op2,
+                           verb=session_data.operation.as_verb(locale))
+
+def generate_ops(operation, difficulty, mastery=None, seed=None, index=0):
+    # with the user's mastery, missed facts come up more often; with a
+    # seed, it's the index-th question of the session
+    if seed is None:
+        op1, op2 = exercises.draw(operation, difficulty, mastery=mastery)
     else:
-        lead = random.choice(['What is', '', 'How about', 'And'])
-
-    return f'{lead} {op1} {session_data.operation.as_verb(_locale)} {op2}?'
-
-def generate_ops(operation, difficulty):
-    # pylint: disable=invalid-name
-    add_sub_limits = {
-        1: (10, 10),
-        2: (50, 50),
-        3: (100, 100),
-        4: (1000, 100),
-        5: (1000, 1000)
-    }
-    mul_div_limits = {
-        1: (10, 10),
-        2: (30, 30),
-        3: (50, 50),
-        4: (100, 50),
-        5: (1000, 100)
-    }
-
-    # using "is" to compare the enums does not work when running tests (??)
-
-    if operation.value in [Operation.ADD.value, Operation.SUB.value]:
-        op1_max, op2_max = add_sub_limits[difficulty]
-    else:
-        op1_max, op2_max = mul_div_limits[difficulty]
-
-    op1 = random.randint(1, op1_max)
-    op2 = random.randint(1, op2_max)
-
-    if (operation.value in [Operation.SUB.value, Operation.DIV.value] and
-        op1 < op2): # pylint: disable=bad-continuation
-        # prevent "unwanted" results
-        op1, op2 = op2, op1
-
-    if operation.value == Operation.DIV.value and op1 % op2 != 0:
-        # assure round results of division
-        op1 = math.ceil(op1 / op2) * op2
-
+        op1, op2 = exercises.question(operation, difficulty, seed, index,
+                                      mastery)
     return op1, op2, operation(op1, op2)
 
+def generate_ops_batch(operation, difficulty, count):
+    # for quiz rounds and worksheets, see exercises.draw_batch
+    return exercises.draw_batch(operation, difficulty, count)
+
 def difficulty_to_value(spoken_difficulty, _locale):
     # pylint: disable=no-else-return
     if spoken_difficulty == 'easy':
@@ -142,23 +142,11 @@ def difficulty_to_value(spoken_difficulty, _locale):
     else:
         return 2
 
+@functools.lru_cache(maxsize=None)
 def apl_document():
-    # py version of apl_document.json
-    return \
-    {'type': 'APL',
-     'version': '1.0',
-     'import': [{'name': 'alexa-styles', 'version': '1.0.0'},
-                {'name': 'alexa-viewport-profiles', 'version': '1.0.0'}],
-     'mainTemplate': {
-         'parameters': ['payload'],
-         'item':
-             {'type': 'Container',
-              'alignItems': 'center',
-              'justifyContent': 'center',
-              'height': '100vh',
-              'width': '100vw',
-              'items': [
-                  {'type': 'Text',
-                   'fontSize': '${@viewportProfile == @hubRoundSmall ? @fontSizeLarge : @fontSizeXXLarge}',
-                   'fontWeight': '@fontWeightLight',
-                   'text': '${payload.data.properties.op1} ${payload.data.properties.operand} ${payload.data.properties.op2}'}]}}}
+    # loaded once per container; frozen, because the same object
+    # ends up in every RenderDocumentDirective
+    here = os.path.abspath(os.path.dirname(__file__))
+    with open(os.path.join(here, 'apl_document.json'),
+              encoding='utf-8') as f:
+        return utils.freeze(json.load(f))
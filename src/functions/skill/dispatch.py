@@ -0,0 +1,114 @@
+import collections
+
+from ask_sdk_model import IntentRequest
+from ask_sdk_runtime.dispatch_components.request_components import (
+    AbstractRequestHandler, AbstractRequestMapper)
+from ask_sdk_runtime.skill import RuntimeConfigurationBuilder
+
+from core import timed # pylint: disable=no-name-in-module
+import models
+
+
+def request_key(handler_input):
+    # what handlers are indexed by: (request type, intent name or None)
+    request = handler_input.request_envelope.request
+    if isinstance(request, IntentRequest):
+        return request.object_type, request.intent.name
+    return request.object_type, None
+
+def has_session_data(handler_input, names):
+    attributes = handler_input.attributes_manager.session_attributes or {}
+    return all(models.session_data_value(attributes, name) is not None
+               for name in names)
+
+
+class IndexedRequestHandler(AbstractRequestHandler):
+    """
+    A request handler that declares what it handles instead of deciding
+    it in can_handle: the request keys (see request_key) and the
+    session_data fields that have to be set.
+    """
+
+    def __init__(self, handle_func, keys, requires=()):
+        self.handle_func = handle_func
+        self.keys = tuple(keys)
+        self.requires = tuple(requires)
+
+    def can_handle(self, handler_input):
+        return request_key(handler_input) in self.keys and \
+            has_session_data(handler_input, self.requires)
+
+    def handle(self, handler_input):
+        return self.handle_func(handler_input)
+
+
+class IndexedRequestMapper(AbstractRequestMapper):
+    """
+    Finds the handler chain for a request with a dict lookup instead of
+    calling can_handle of every registered handler in turn.
+
+    Handlers other than IndexedRequestHandler can't be indexed, so they
+    are considered for every request. Either way, candidates are tried in
+    the order they were registered, like GenericRequestMapper does.
+    """
+
+    def __init__(self, request_handler_chains):
+        # pylint: disable=super-init-not-called
+        self.unindexed = []
+        self.index = collections.defaultdict(list)
+
+        for position, chain in enumerate(request_handler_chains):
+            handler = chain.request_handler
+            if isinstance(handler, IndexedRequestHandler):
+                for key in handler.keys:
+                    self.index[key].append((position, chain))
+            else:
+                self.unindexed.append((position, chain))
+
+        for key, chains in self.index.items():
+            merged = sorted(chains + self.unindexed, key=lambda pc: pc[0])
+            self.index[key] = [chain for _, chain in merged]
+        self.index = dict(self.index)
+        self.unindexed = [chain for _, chain in self.unindexed]
+
+    def get_request_handler_chain(self, handler_input):
+        key = request_key(handler_input)
+        # the intent dimension, even if no handler turns up
+        with timed('dispatch', intent=key[1] or key[0]):
+            return self.find_chain(handler_input, key)
+
+    def find_chain(self, handler_input, key=None):
+        key = key or request_key(handler_input)
+        for chain in self.index.get(key, self.unindexed):
+            handler = chain.request_handler
+            if isinstance(handler, IndexedRequestHandler):
+                # the key matches already, only the session guard is left
+                if has_session_data(handler_input, handler.requires):
+                    return chain
+            elif handler.can_handle(handler_input):
+                return chain
+        return None
+
+
+class IndexedRuntimeConfigurationBuilder(RuntimeConfigurationBuilder):
+    """
+    Builds the runtime configuration with an IndexedRequestMapper. The
+    index is built once, not every time a skill is created.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._request_mapper = None
+
+    def add_request_handler(self, request_handler):
+        super().add_request_handler(request_handler)
+        self._request_mapper = None
+
+    def get_runtime_configuration(self):
+        if self._request_mapper is None:
+            self._request_mapper = IndexedRequestMapper(
+                self.request_handler_chains)
+
+        configuration = super().get_runtime_configuration()
+        configuration.request_mappers = [self._request_mapper]
+        return configuration
@@ -0,0 +1,105 @@
+import enum
+import functools
+import importlib
+import json
+import re
+
+from ask_sdk_core.exceptions import SerializationException
+from ask_sdk_core.serialize import DefaultSerializer
+
+
+LIST_TYPE = re.compile(r'list\[(.*)\]')
+DICT_TYPE = re.compile(r'dict\(([^,]*), (.*)\)')
+
+# decodes what isn't a model (datetimes mostly), the way the SDK does
+_serializer = DefaultSerializer()
+
+
+@functools.lru_cache(maxsize=None)
+def load_class(class_name):
+    module_name, _, name = class_name.rpartition('.')
+    return getattr(importlib.import_module(module_name), name)
+
+@functools.lru_cache(maxsize=None)
+def lazy_class(model_class):
+    """
+    A subclass of model_class whose instances don't go through the
+    model's __init__; each attribute is decoded from the data the first
+    time it's read and then kept like a normal attribute. Being an
+    instance of the model class, isinstance checks work as usual.
+    """
+    return type(f'Lazy{model_class.__name__}', (model_class,),
+                {'__getattr__': lazy_attribute})
+
+def lazy_attribute(model, name):
+    # __getattr__ of lazy classes, only called for attributes that
+    # aren't set (yet)
+    data = model.__dict__['_data']
+    types = model.deserialized_types
+    if name in types:
+        key = model.attribute_map.get(name, name)
+        value = decode(data.get(key), types[name])
+    elif name in data and name not in model.attribute_map.values():
+        # fields the models don't know, kept as they are like the
+        # SDK's serializer does
+        value = data[name]
+    else:
+        raise AttributeError(name)
+
+    model.__dict__[name] = value
+    return value
+
+def lazy(data, model_class):
+    """
+    The model_class instance (e.g. a RequestEnvelope) of the JSON-like
+    data, decoded only as far as its attributes are read.
+    """
+    if hasattr(model_class, 'get_real_child_model'):
+        # an abstract model, the actual class depends on a "type" field
+        class_name = model_class.get_real_child_model(data)
+        if not class_name:
+            raise SerializationException(
+                f"Couldn't resolve object by discriminator type "
+                f"for {model_class}")
+        model_class = load_class(class_name)
+
+    model = object.__new__(lazy_class(model_class))
+    model.__dict__['_data'] = data
+    return model
+
+def decode(value, obj_type):
+    # value as an obj_type, obj_type as in the models' deserialized_types
+    if value is None:
+        return None
+    # by the type, or the start of it for lists and dicts
+    decoder = DECODERS.get(obj_type) or \
+        DECODERS.get(obj_type[:len('list[')], decode_class)
+    return decoder(value, obj_type)
+
+def decode_list(value, obj_type):
+    item_type = LIST_TYPE.match(obj_type).group(1).strip()
+    return [decode(item, item_type) for item in value]
+
+def decode_dict(value, obj_type):
+    value_type = DICT_TYPE.match(obj_type).group(2)
+    return {key: decode(item, value_type) for key, item in value.items()}
+
+def decode_as_is(value, _obj_type):
+    return value
+
+def decode_native(value, obj_type):
+    # dates and datetimes
+    return _serializer.deserialize(json.dumps(value), obj_type)
+
+def decode_class(value, obj_type):
+    model_class = load_class(obj_type)
+    if issubclass(model_class, enum.Enum):
+        return model_class(value)
+    if hasattr(model_class, 'deserialized_types'):
+        return lazy(value, model_class)
+    return value
+
+DECODERS = dict(
+    dict.fromkeys(DefaultSerializer.NATIVE_TYPES_MAPPING, decode_native),
+    **dict.fromkeys(['str', 'bool', 'int', 'float', 'object'], decode_as_is),
+    **{'list[': decode_list, 'dict(': decode_dict})
@@ -0,0 +1,350 @@
+import array
+import collections
+import functools
+import itertools
+import math
+import operator
+import random
+
+from models import Operation
+
+
+# (op1_max, op2_max) per difficulty level
+ADD_SUB_LIMITS = {
+    1: (10, 10),
+    2: (50, 50),
+    3: (100, 100),
+    4: (1000, 100),
+    5: (1000, 1000)
+}
+MUL_DIV_LIMITS = {
+    1: (10, 10),
+    2: (30, 30),
+    3: (50, 50),
+    4: (100, 50),
+    5: (1000, 100)
+}
+
+# Facts answered wrong are drawn MISSED_WEIGHT times as often as the
+# others, until answered right. Tracked only at the difficulties in
+# MASTERY_DIFFICULTIES, where the fact spaces are small enough.
+MASTERY_DIFFICULTIES = (1, 2)
+MISSED_WEIGHT = 16
+_MAX_DRAWS = 4 * MISSED_WEIGHT
+
+# questions of a session are derived from a seed of SEED_BITS and their
+# index, see question()
+SEED_BITS = 32
+_MASK64 = (1 << 64) - 1
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+
+# columns of a batch of exercises; each is an array.array('i'), which
+# supports the buffer protocol, so numpy.frombuffer(batch.op1, 'int32')
+# gives a zero-copy ndarray when numpy is around
+Batch = collections.namedtuple('Batch', ['op1', 'op2', 'result'])
+
+# Every pool below is an indexable sequence of the *valid* (op1, op2)
+# pairs for one operation and difficulty, so drawing an exercise is
+# just a random index into it, uniform but for division (see
+# DivisionPool). Dense spaces (every pair in a rectangle or a
+# "op1 >= op2" trapezoid) map an index to a pair arithmetically and
+# store nothing. Division is sparse, so its pairs are enumerated once
+# into packed arrays.
+
+def locate(fraction, size):
+    """
+    The index of range(size) a uniform fraction (of [0, 1)) falls on,
+    and where it falls within that index's share, again a fraction.
+    """
+    position = fraction * size
+    index = min(int(position), size - 1)
+    return index, position - index
+
+
+class GridPool:
+    """All pairs with 1 <= op1 <= op1_max and 1 <= op2 <= op2_max."""
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ('op1_max', 'op2_max', 'size')
+
+    def __init__(self, op1_max, op2_max):
+        self.op1_max = op1_max
+        self.op2_max = op2_max
+        self.size = op1_max * op2_max
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        op1, op2 = divmod(index, self.op2_max)
+        return op1 + 1, op2 + 1
+
+    def index_of(self, op1, op2):
+        if not (1 <= op1 <= self.op1_max and 1 <= op2 <= self.op2_max):
+            raise ValueError((op1, op2))
+        return (op1 - 1) * self.op2_max + op2 - 1
+
+    def locate(self, fraction):
+        return locate(fraction, self.size)
+
+    def sample(self, rng=random):
+        return self[rng.randrange(self.size)]
+
+    def sample_columns(self, count, rng=random):
+        # both operands are independent and uniform within a grid
+        op1s = rng.choices(range(1, self.op1_max + 1), k=count)
+        op2s = rng.choices(range(1, self.op2_max + 1), k=count)
+        return array.array('i', op1s), array.array('i', op2s)
+
+
+class TrapezoidPool:
+    """
+    All pairs with op2 <= op1 <= op1_max and 1 <= op2 <= op2_max, i.e.
+    the ones without a negative result. Ordered by op1, the first
+    op2_max rows form a triangle (row i has i pairs), the rest are
+    full rows of op2_max pairs.
+    """
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ('op1_max', 'op2_max', 'triangle', 'size')
+
+    def __init__(self, op1_max, op2_max):
+        assert op1_max >= op2_max
+        self.op1_max = op1_max
+        self.op2_max = op2_max
+        self.triangle = op2_max * (op2_max + 1) // 2
+        self.size = self.triangle + (op1_max - op2_max) * op2_max
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+
+        if index >= self.triangle:
+            row, column = divmod(index - self.triangle, self.op2_max)
+            return self.op2_max + row + 1, column + 1
+
+        # row i (1-based) starts at index i * (i - 1) / 2; the float
+        # estimate can be off by one for large indices, hence the fixups
+        row = int((1 + math.sqrt(1 + 8 * index)) / 2)
+        while row * (row - 1) // 2 > index:
+            row -= 1
+        while row * (row + 1) // 2 <= index:
+            row += 1
+        return row, index - row * (row - 1) // 2 + 1
+
+    def index_of(self, op1, op2):
+        if not (1 <= op2 <= min(op1, self.op2_max) and op1 <= self.op1_max):
+            raise ValueError((op1, op2))
+        if op1 > self.op2_max:
+            return self.triangle + (op1 - self.op2_max - 1) * self.op2_max + \
+                op2 - 1
+        return op1 * (op1 - 1) // 2 + op2 - 1
+
+    def locate(self, fraction):
+        return locate(fraction, self.size)
+
+    def sample(self, rng=random):
+        return self[rng.randrange(self.size)]
+
+    def sample_columns(self, count, rng=random):
+        indices = rng.choices(range(self.size), k=count)
+        pairs = map(self.__getitem__, indices)
+        op1s, op2s = zip(*pairs) if count else ((), ())
+        return array.array('i', op1s), array.array('i', op2s)
+
+
+class ArrayPool:
+    """Explicitly enumerated pairs, stored column-wise in packed arrays."""
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ('op1s', 'op2s', 'size', '_indices')
+
+    def __init__(self, op1s, op2s):
+        assert len(op1s) == len(op2s)
+        self.op1s = op1s
+        self.op2s = op2s
+        self.size = len(op1s)
+        self._indices = None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.op1s[index], self.op2s[index]
+
+    def index_of(self, op1, op2):
+        if self._indices is None:
+            # built on first use, it's the only pool with one
+            self._indices = {pair: index for index, pair
+                             in enumerate(zip(self.op1s, self.op2s))}
+        try:
+            return self._indices[op1, op2]
+        except KeyError:
+            raise ValueError((op1, op2)) from None
+
+    def locate(self, fraction):
+        return locate(fraction, self.size)
+
+    def sample(self, rng=random):
+        return self[rng.randrange(self.size)]
+
+    def sample_columns(self, count, rng=random):
+        indices = rng.choices(range(self.size), k=count)
+        return (array.array('i', map(self.op1s.__getitem__, indices)),
+                array.array('i', map(self.op2s.__getitem__, indices)))
+
+
+class DivisionPool(ArrayPool):
+    """
+    The pairs of whole-number divisions, by divisor, drawn divisor first
+    and then one of its multiples, so that every divisor is as likely.
+    Drawn uniformly, "x ÷ 1" (with the most multiples) would be over a
+    third of the questions at difficulty 1 and a fifth at 5.
+    """
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ('starts',)
+
+    def __init__(self, op1s, op2s, starts):
+        # starts: index of the first pair of each divisor, then the size
+        super().__init__(op1s, op2s)
+        self.starts = starts
+
+    def locate(self, fraction):
+        divisor, fraction = locate(fraction, len(self.starts) - 1)
+        start = self.starts[divisor]
+        index, fraction = locate(fraction, self.starts[divisor + 1] - start)
+        return start + index, fraction
+
+    def sample(self, rng=random):
+        return self[self.locate(rng.random())[0]]
+
+    def sample_columns(self, count, rng=random):
+        indices = [self.locate(rng.random())[0] for _ in range(count)]
+        return (array.array('i', map(self.op1s.__getitem__, indices)),
+                array.array('i', map(self.op2s.__getitem__, indices)))
+
+
+def division_pairs(op1_max, op2_max):
+    # every multiple of op2 up to op1_max is a whole-number division
+    op1s = array.array('H')
+    op2s = array.array('H')
+    starts = array.array('I', [0])
+    for op2 in range(1, op2_max + 1):
+        multiples = range(op2, op1_max + 1, op2)
+        op1s.extend(multiples)
+        op2s.extend(itertools.repeat(op2, len(multiples)))
+        starts.append(len(op1s))
+    return DivisionPool(op1s, op2s, starts)
+
+_OPERATORS = {
+    Operation.ADD.value: operator.add,
+    Operation.SUB.value: operator.sub,
+    Operation.MUL.value: operator.mul,
+    Operation.DIV.value: operator.floordiv
+}
+
+def limits(operation, difficulty):
+    # using "is" to compare the enums does not work when running tests (??)
+    if operation.value in [Operation.ADD.value, Operation.SUB.value]:
+        return ADD_SUB_LIMITS[difficulty]
+    return MUL_DIV_LIMITS[difficulty]
+
+@functools.lru_cache(maxsize=None)
+def _build_pool(operation_value, difficulty):
+    op1_max, op2_max = limits(Operation(operation_value), difficulty)
+
+    if operation_value == Operation.SUB.value:
+        # prevent "unwanted" results
+        return TrapezoidPool(op1_max, op2_max)
+    if operation_value == Operation.DIV.value:
+        # assure round results of division
+        return division_pairs(op1_max, op2_max)
+    return GridPool(op1_max, op2_max)
+
+def pool(operation, difficulty):
+    """
+    Returns the pool of valid operand pairs for the given operation and
+    difficulty. Pools are built on first use and then kept for the
+    lifetime of the container.
+    """
+    return _build_pool(operation.value, difficulty)
+
+def mastery_key(operation, difficulty):
+    return f'{operation.value}{difficulty}'
+
+class QuestionRandom:
+    """
+    The random numbers of one question: a SplitMix64 stream starting at
+    the session's seed and the question's index. Unlike seeding a
+    random.Random, starting one costs next to nothing, and the numbers
+    don't depend on the Python version. Has what draw() needs only.
+    """
+    __slots__ = ('state',)
+
+    def __init__(self, seed, index):
+        self.state = (seed << 32 | index) & _MASK64
+
+    def random(self):
+        self.state = z = (self.state + _GOLDEN_GAMMA) & _MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        return ((z ^ (z >> 31)) >> 11) / (1 << 53)
+
+    def randrange(self, stop):
+        return int(self.random() * stop)
+
+
+def draw(operation, difficulty, rng=random, mastery=None):
+    """
+    Draws an exercise. With the user's mastery (models.Bitsets), facts
+    they missed are weighted up: a draw of any other fact is rejected
+    with a probability of 1 - 1 / MISSED_WEIGHT and drawn again.
+    """
+    exercises = pool(operation, difficulty)
+    key = mastery_key(operation, difficulty)
+    if mastery is None or difficulty not in MASTERY_DIFFICULTIES or \
+       not mastery.count(key):
+        return exercises.sample(rng)
+
+    for _ in range(_MAX_DRAWS):
+        # one random number for both the index and the rejection
+        index, fraction = exercises.locate(rng.random())
+        if int(fraction * MISSED_WEIGHT) == 0 or mastery.test(key, index):
+            break
+    return exercises[index]
+
+def question(operation, difficulty, seed, index, mastery=None):
+    """
+    The index-th exercise of a session with the given seed. It's drawn
+    again the same every time, as long as the mastery is the same as
+    when it was first drawn.
+    """
+    return draw(operation, difficulty, QuestionRandom(seed, index), mastery)
+
+def new_seed():
+    return random.getrandbits(SEED_BITS)
+
+def record_answer(mastery, operation, difficulty, op1, op2, correct):
+    # marks the fact as missed, or clears the mark when it's answered right
+    if difficulty not in MASTERY_DIFFICULTIES:
+        return
+    exercises = pool(operation, difficulty)
+    mastery.set(mastery_key(operation, difficulty),
+                exercises.index_of(op1, op2), exercises.size,
+                not correct)
+
+def draw_batch(operation, difficulty, count, rng=random):
+    """
+    Draws count exercises at once and returns them as a Batch of
+    columns. The same rules as for single exercises apply (no negative
+    results, whole-number division), they are baked into the pools.
+    """
+    op1s, op2s = pool(operation, difficulty).sample_columns(count, rng)
+    results = array.array('i', map(_OPERATORS[operation.value], op1s, op2s))
+    return Batch(op1s, op2s, results)
@@ -0,0 +1,223 @@
+"""
+Skill-wide statistics, kept in the SkillTable next to the users' items:
+questions answered per day and a leaderboard of the best answer streaks.
+
+One item counting every answer would be a hot partition at peak, all
+writes of all containers going to the same key, which DynamoDB throttles
+at 1000 write units a second. So counters are written to SHARDS items,
+a random one per write, and the leaderboard to SHARDS items too, each
+player always to the same one. roll_up (run by a scheduled event) sums
+and merges the shards into one aggregate item per statistic, which is
+what's read; reads are cached in the container for cache_ttl seconds.
+The numbers are then as fresh as the last roll-up, plus cache_ttl.
+"""
+import hashlib
+import random
+import time
+
+import persistence
+from core import logger # pylint: disable=no-name-in-module
+
+
+# ids of the statistics' items; no user id starts with it
+PREFIX = 'stats#'
+SHARDS = 10
+LEADERBOARD_SIZE = 10
+CACHE_TTL = 60 # seconds
+DAY = 24 * 60 * 60
+
+QUESTIONS = 'questions'
+STREAKS = 'streaks'
+
+
+def day(timestamp):
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+def shard_id(name, shard):
+    return f'{PREFIX}{name}#{shard}'
+
+def aggregate_id(name):
+    return f'{PREFIX}{name}'
+
+def player(user_id):
+    # the leaderboard doesn't keep user ids
+    return hashlib.sha256(user_id.encode('utf-8')).hexdigest()[:16]
+
+def top(entries, size):
+    # the best (player, score) pairs, ties in player order
+    return sorted(entries, key=lambda entry: (-entry[1], entry[0]))[:size]
+
+
+class GlobalStats:
+    """
+    table is a function returning the table, e.g. main.skill_table,
+    as the skill's table is only made when it's first needed.
+    """
+
+    def __init__(self, table, *, shards=SHARDS,
+                 leaderboard_size=LEADERBOARD_SIZE, cache_ttl=CACHE_TTL,
+                 clock=time.time, rng=None):
+        # pylint: disable=too-many-arguments
+        self.table = table
+        self.shards = shards
+        self.leaderboard_size = leaderboard_size
+        self.cache_ttl = cache_ttl
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._cache = {} # item id -> (item, when)
+
+    #
+    # writes
+    #
+
+    def record_session(self, user_id, session_data, timestamp):
+        """Counts the session's questions, submits its best streak."""
+        if session_data.questions_count:
+            self.count(f'{QUESTIONS}#{day(timestamp)}',
+                       session_data.questions_count)
+        if session_data.best_streak:
+            self.submit(STREAKS, player(user_id), session_data.best_streak)
+
+    def count(self, name, amount):
+        shard = self.rng.randrange(self.shards)
+        self.table().update_item(
+            Key={'id': shard_id(name, shard)},
+            UpdateExpression='ADD #count :amount',
+            ExpressionAttributeNames={'#count': 'count'},
+            ExpressionAttributeValues={':amount': amount})
+
+    def submit(self, name, player_id, score):
+        # the player's entry in their shard, if it's better than what it
+        # was and may make it to the leaderboard
+        leaderboard = self.leaderboard(name)
+        if len(leaderboard) >= self.leaderboard_size and \
+                score <= leaderboard[-1][1]:
+            return
+
+        shard = int(player_id, 16) % self.shards
+        item_id = shard_id(name, shard)
+        table = self.table()
+        for _ in range(2):
+            try:
+                table.update_item(
+                    Key={'id': item_id},
+                    UpdateExpression='SET #top.#player = :score',
+                    ConditionExpression='attribute_not_exists(#top.#player) '
+                                        'OR #top.#player < :score',
+                    ExpressionAttributeNames={'#top': 'top',
+                                              '#player': player_id},
+                    ExpressionAttributeValues={':score': score})
+                return
+            except Exception as e: # pylint: disable=broad-except,invalid-name
+                code = persistence.error_code(e)
+                if code == 'ConditionalCheckFailedException':
+                    return # the entry is as good already
+                if code != 'ValidationException':
+                    raise
+            # no shard item yet
+            try:
+                table.put_item(Item={'id': item_id,
+                                     'top': {player_id: score}},
+                               ConditionExpression='attribute_not_exists(id)')
+                return
+            except Exception as e: # pylint: disable=broad-except,invalid-name
+                # created in the meantime, update it
+                if persistence.error_code(e) != \
+                        'ConditionalCheckFailedException':
+                    raise
+
+    #
+    # reads, of the aggregates
+    #
+
+    def questions(self, timestamp=None):
+        """Questions answered on the day (UTC) of timestamp, now by default."""
+        timestamp = self.clock() if timestamp is None else timestamp
+        item = self.aggregate(f'{QUESTIONS}#{day(timestamp)}')
+        return int(item.get('count', 0))
+
+    def leaderboard(self, name=STREAKS):
+        """The best [player, score] entries, best first."""
+        return [(entry[0], int(entry[1]))
+                for entry in self.aggregate(name).get('top', [])]
+
+    def aggregate(self, name):
+        item_id = aggregate_id(name)
+        entry = self._cache.get(item_id)
+        now = self.clock()
+        if entry is not None and now - entry[1] <= self.cache_ttl:
+            return entry[0]
+        item = self.table().get_item(Key={'id': item_id}).get('Item') or {}
+        self._cache[item_id] = (item, now)
+        return item
+
+    #
+    # roll-up
+    #
+
+    def roll_up(self, timestamp=None):
+        """
+        Sums and merges the shards into the aggregates: questions of the
+        day (and of the day before, to finish it after midnight) and the
+        leaderboard, whose shards are trimmed to the leaderboard's
+        entries. Returns the aggregates.
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        table = self.table()
+        aggregates = {}
+        for name in [f'{QUESTIONS}#{day(timestamp - DAY)}',
+                     f'{QUESTIONS}#{day(timestamp)}']:
+            total = sum(int(shard.get('count', 0))
+                        for shard in self.read_shards(name))
+            aggregates[name] = {'id': aggregate_id(name), 'count': total,
+                                'rolled_up': int(timestamp)}
+
+        shards = self.read_shards(STREAKS)
+        entries = [(player_id, int(score)) for shard in shards
+                   for player_id, score in shard.get('top', {}).items()]
+        leaderboard = top(entries, self.leaderboard_size)
+        aggregates[STREAKS] = {'id': aggregate_id(STREAKS),
+                               'top': [list(entry) for entry in leaderboard],
+                               'rolled_up': int(timestamp)}
+
+        for item in aggregates.values():
+            table.put_item(Item=item)
+            self._cache[item['id']] = (item, self.clock())
+        kept = {player_id for player_id, _ in leaderboard}
+        for shard in shards:
+            self.trim(shard, kept)
+        return aggregates
+
+    def read_shards(self, name):
+        table = self.table()
+        items = (table.get_item(Key={'id': shard_id(name, shard)},
+                                ConsistentRead=True).get('Item')
+                 for shard in range(self.shards))
+        return [item for item in items if item]
+
+    def trim(self, shard, kept):
+        # removes the entries that didn't make it to the leaderboard, if
+        # they didn't change since they were read
+        dropped = {player_id: score
+                   for player_id, score in shard.get('top', {}).items()
+                   if player_id not in kept}
+        if not dropped:
+            return
+        names, values, paths, conditions = {'#top': 'top'}, {}, [], []
+        for number, (player_id, score) in enumerate(sorted(dropped.items())):
+            names[f'#p{number}'] = player_id
+            values[f':s{number}'] = score
+            paths.append(f'#top.#p{number}')
+            conditions.append(f'#top.#p{number} = :s{number}')
+        try:
+            self.table().update_item(
+                Key={'id': shard['id']},
+                UpdateExpression='REMOVE ' + ', '.join(paths),
+                ConditionExpression=' AND '.join(conditions),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values)
+        except Exception as e: # pylint: disable=broad-except,invalid-name
+            if persistence.error_code(e) != 'ConditionalCheckFailedException':
+                raise
+            # a player improved meanwhile, trimmed by the next roll-up
+            logger.info('leaderboard shard changed', shard=shard['id'])
@@ -1,13 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import json
 import os
 import time
 
-from ask_sdk.standard import StandardSkillBuilder
-from ask_sdk_core.utils import is_request_type, is_intent_name
-import jmespath
+from ask_sdk_core.skill_builder import CustomSkillBuilder
+from ask_sdk_model import RequestEnvelope
 
-from core import logger, log_invocation # pylint: disable=no-name-in-module
+from core import annotate, is_warmup, logger, log_invocation, timed # pylint: disable=no-name-in-module
+import catalog
 import content
+import dispatch
+import envelope
+import exercises
+import global_stats
 import models
+import persistence
 import utils
 
 
@@ -15,32 +23,124 @@ import utils
 # TODO: support "make it harder/easier" and "change operation" intents
 # TODO: prompt for a 5-star review
 
-sb = StandardSkillBuilder(table_name=os.environ['SKILL_TABLE_NAME'])
+# In lazy init mode, boto3 is imported and the DynamoDB resource created
+# only when a request first reads or writes persistent attributes and
+# the skill object is built once per container instead of per request.
+LAZY_INIT = os.environ.get('LAZY_INIT', '').lower() in ['1', 'true', 'yes']
+
+# In lazy envelope mode, the request envelope's objects are decoded from
+# the event when a handler first reads them, not all upfront.
+LAZY_ENVELOPE = os.environ.get('LAZY_ENVELOPE', '').lower() in \
+    ['1', 'true', 'yes']
+
+# How many seconds can persistent attributes be served from the container's
+# cache instead of DynamoDB? 0 turns the cache off. Lazy init mode only.
+PERSISTENCE_CACHE_TTL = int(os.environ.get('PERSISTENCE_CACHE_TTL', 0))
+
+# In async I/O mode, DynamoDB calls run on a small thread pool: a launch
+# starts reading the user's attributes as soon as the event comes in and
+# a handler's writes are waited for only when its response is built.
+# Lazy init mode only.
+ASYNC_IO = LAZY_INIT and \
+    os.environ.get('ASYNC_IO', '').lower() in ['1', 'true', 'yes']
+IO_THREADS = 2
+# requests that read persistent attributes, their reads are prefetched,
+# and so are those of the intents when they load a mastery (see
+# reads_persistent_attributes)
+PREFETCHED_REQUESTS = ['LaunchRequest', 'SessionEndedRequest']
+PREFETCHED_INTENTS = ['AMAZON.StopIntent', 'AMAZON.CancelIntent']
+
+# Record skill-wide stats (see global_stats) at the end of each session.
+# Their roll-up runs on {"rollup": true} events, scheduled in functions.yml.
+GLOBAL_STATS = os.environ.get('GLOBAL_STATS', '').lower() in \
+    ['1', 'true', 'yes']
+
+
+class LazySkillBuilder(CustomSkillBuilder):
+    """
+    Drop-in replacement for StandardSkillBuilder, minus the API client
+    (the skill doesn't use any Alexa service APIs) and with a persistence
+    adapter that doesn't connect to DynamoDB until it's needed.
+    """
+
+    def __init__(self, table_name, cache_ttl=0, io_threads=0):
+        executor = ThreadPoolExecutor(max_workers=io_threads) \
+            if io_threads else None
+        adapter = persistence.SkillTableAdapter(table_name,
+                                                cache_ttl=cache_ttl,
+                                                executor=executor,
+                                                rebase=models.rebase)
+        super().__init__(persistence_adapter=adapter)
+
+    @property
+    def dynamodb_client(self):
+        return self.persistence_adapter.dynamodb_resource
+
+    @dynamodb_client.setter
+    def dynamodb_client(self, dynamodb_resource):
+        self.persistence_adapter.dynamodb = dynamodb_resource
+
+
+if LAZY_INIT:
+    sb = LazySkillBuilder(table_name=os.environ['SKILL_TABLE_NAME'],
+                          cache_ttl=PERSISTENCE_CACHE_TTL,
+                          io_threads=IO_THREADS if ASYNC_IO else 0)
+else:
+    # pylint: disable=wrong-import-position,wrong-import-order
+    from ask_sdk.standard import StandardSkillBuilder
+    sb = StandardSkillBuilder(table_name=os.environ['SKILL_TABLE_NAME'])
+# handlers are looked up by request type and intent name, see dispatch.py
+sb.runtime_configuration_builder = dispatch.IndexedRuntimeConfigurationBuilder()
 sb.skill_id = 'amzn1.ask.skill.d455ad8c-dde9-4ee8-a492-4e3985b5ff79'
 sb.custom_user_agent = 'alexa-math-practice-skill/1.0.0'
 
+# session attribute marking that persist_skill_data already ran
+PERSISTED_ATTRIBUTE = 'persisted'
+
+# SkillTable key read by warm_up
+WARMUP_ITEM_ID = 'warmup'
+
+# knows how to pass frozen structures (like the APL document) through as is
+serializer = utils.Serializer()
+_skill = None
+
 #
 # helpers
 #
 
+def timed_handler(fn):
+    # times the handler body, with the intent (or request type) as dimension
+    @functools.wraps(fn)
+    def wrapper(handler_input):
+        request_type, intent_name = dispatch.request_key(handler_input)
+        with timed('handler', intent=intent_name or request_type):
+            response = fn(handler_input)
+            if ASYNC_IO:
+                # a failed write fails the handler, so that it's handled
+                # like any other error
+                with timed('persistence_wait'):
+                    sb.persistence_adapter.wait()
+            return response
+    return wrapper
+
 def request_handler(request_type):
     def wrapper(fn):
-        return sb.request_handler(is_request_type(request_type))(fn)
+        indexed = dispatch.IndexedRequestHandler(timed_handler(fn),
+                                                 [(request_type, None)])
+        sb.add_request_handler(indexed)
+        return fn
     return wrapper
 
-def intent_handler(*intent_names):
+def intent_handler(*intent_names, requires=()):
+    # requires: session_data fields that have to be set
     def wrapper(fn):
-        has_intent = lambda handler_input: \
-            any([is_intent_name(name)(handler_input)
-                 for name in intent_names])
-        return sb.request_handler(has_intent)(fn)
+        keys = [('IntentRequest', name) for name in intent_names]
+        indexed = dispatch.IndexedRequestHandler(timed_handler(fn),
+                                                 keys, requires)
+        sb.add_request_handler(indexed)
+        return fn
     return wrapper
 
-def has_session_attribute(handler_input, attr_name):
-    skill_attributes = handler_input.attributes_manager.session_attributes
-    value = jmespath.search(f'session_data.{attr_name}', skill_attributes)
-    return value is not None
-
 #
 # handlers
 #
@@ -51,14 +151,17 @@ def launch_request_handler(handler_input):
     # TODO: manage late answers (i.e. launch when the answer to an exercise question didn't come in time - do you want to continue or start a new session?)
 
     am = handler_input.attributes_manager
-    usage = models.SkillUsage.from_attributes(am.persistent_attributes)
     locale = handler_input.request_envelope.request.locale
+    # before the read, which may be in flight already (see prefetch)
+    prompt = content.prompt_for_operation(locale)
+    with timed('persistence_read'):
+        persistent_attributes = am.persistent_attributes
+    usage = models.SkillUsage.from_attributes(persistent_attributes)
 
     intro = content.intro_message(usage.launch_count, locale)
     # TODO: maybe ask if they want to continue? if so then I'd need to remember the question as well /o\
     usage.session_data = models.SessionData()
-    am.session_attributes = models.asdict(usage)
-    prompt = content.prompt_for_operation(locale)
+    am.session_attributes = usage.to_session_attributes()
     message = utils.combine_messages(intro, prompt)
 
     return utils.build_response(handler_input, message)
@@ -69,8 +172,6 @@ def session_ended_request_handler(handler_input):
 
 @intent_handler('DidSelectOperation')
 def did_select_operation_handler(handler_input):
-    # TODO: what if I already have the difficulty level? i.e. I can directly ask a question
-
     am = handler_input.attributes_manager
     usage = models.SkillUsage.from_attributes(am.session_attributes)
     locale = handler_input.request_envelope.request.locale
@@ -79,17 +180,21 @@ def did_select_operation_handler(handler_input):
     spoken_operation = slots['operation'].value
     operation = models.Operation.from_word(spoken_operation, locale)
     usage.session_data.operation = operation
-    am.session_attributes = models.asdict(usage)
+    load_mastery(handler_input, usage)
 
     ack = content.confirmation(locale)
+    if usage.session_data.difficulty is not None:
+        # a question was asked already, answers are checked against the
+        # question of the current operation, so that's the one to ask
+        return ask_question(handler_input, usage, ack)
+
+    am.session_attributes = usage.to_session_attributes()
     question = content.prompt_for_difficulty(locale)
     message = utils.combine_messages(ack, question)
 
     return utils.build_response(handler_input, message, question)
 
-@sb.request_handler(can_handle_func=lambda hi: \
-                    is_intent_name('DidSelectDifficulty')(hi) and \
-                    has_session_attribute(hi, 'operation'))
+@intent_handler('DidSelectDifficulty', requires=['operation'])
 def did_select_difficulty_handler(handler_input):
     # TODO: handle also if they say "easier" or "harder" during
 
@@ -101,24 +206,13 @@ def did_select_difficulty_handler(handler_input):
     spoken_difficulty = slots['difficulty'].value
     difficulty = content.difficulty_to_value(spoken_difficulty, locale)
     usage.session_data.difficulty = difficulty
+    load_mastery(handler_input, usage)
 
     ack = content.confirmation(locale)
     start_message = content.start_message(locale)
-    question, result, apl = content.build_question(usage, locale)
-    usage.session_data.correct_result = result
-    message = utils.combine_messages(ack, start_message, question)
-    am.session_attributes = models.asdict(usage)
+    return ask_question(handler_input, usage, ack, start_message)
 
-    rb = handler_input.response_builder
-    rb.speak(message).ask(question)
-    if utils.has_apl_support(handler_input):
-        rb.add_directive(apl)
-    return rb.response
-
-@sb.request_handler(can_handle_func=lambda hi: \
-                    is_intent_name('DidAnswer')(hi) and \
-                    has_session_attribute(hi, 'operation') and \
-                    has_session_attribute(hi, 'difficulty'))
+@intent_handler('DidAnswer', requires=['operation', 'difficulty'])
 def did_answer_handler(handler_input):
     am = handler_input.attributes_manager
     usage = models.SkillUsage.from_attributes(am.session_attributes)
@@ -126,14 +220,19 @@ def did_answer_handler(handler_input):
     slots = handler_input.request_envelope.request.intent.slots
 
     answer = int(slots['answer'].value)
-    is_correct = answer == usage.session_data.correct_result
+    # a no-op but for sessions from before SessionData.mastery
+    load_mastery(handler_input, usage)
+    op1, op2, correct_result = content.asked_question(usage)
+    is_correct = answer == correct_result
 
     if is_correct:
         usage.session_data.correct_answers_count += 1
         usage.session_data.streak_count += 1
+        streak_count = usage.session_data.streak_count
+        usage.session_data.best_streak = max(usage.session_data.best_streak,
+                                             streak_count)
 
         outcome = content.correct(locale)
-        streak_count = usage.session_data.streak_count
         # pylint: disable=bad-continuation
         if (streak_count == 5 or
             (streak_count >= 10 and streak_count % 10 == 0)):
@@ -141,21 +240,30 @@ def did_answer_handler(handler_input):
             outcome = content.streak_encouragement(streak_count, locale)
     else:
         usage.session_data.streak_count = 0
-
-        correct_result = usage.session_data.correct_result
         outcome = content.incorrect(correct_result, locale)
+    annotate(operation=usage.session_data.operation.value,
+             difficulty=usage.session_data.difficulty,
+             correct=is_correct)
+    if op1:
+        # not known for sessions started before they were kept
+        usage.session_data.answers.append(usage.session_data.operation,
+                                          op1, op2, is_correct,
+                                          int(time.time()))
+        exercises.record_answer(usage.session_data.mastery,
+                                usage.session_data.operation,
+                                usage.session_data.difficulty,
+                                op1, op2, is_correct)
     usage.session_data.questions_count += 1
 
-    question, result, apl = content.build_question(usage, locale)
-    usage.session_data.correct_result = result
+    question, _, apl_data = content.next_question(usage, locale)
     message = utils.combine_messages(outcome, question)
-    am.session_attributes = models.asdict(usage)
+    am.session_attributes = usage.to_session_attributes()
 
-    rb = handler_input.response_builder
-    rb.speak(message).ask(question)
+    directives = []
     if utils.has_apl_support(handler_input):
-        rb.add_directive(apl)
-    return rb.response
+        directives.append(content.apl_directive(apl_data))
+    # the most frequent request, its response skips the SDK's models
+    return utils.response_dict(message, question, directives)
 
 @intent_handler('AMAZON.StopIntent', 'AMAZON.CancelIntent')
 def stop_or_cancel_intent_handler(handler_input):
@@ -175,39 +283,221 @@ def stop_or_cancel_intent_handler(handler_input):
                                          .set_should_end_session(True)\
                                          .response
 
+def ask_question(handler_input, usage, *messages):
+    # the messages and the current question of the session, with its APL
+    locale = handler_input.request_envelope.request.locale
+    question, _, apl = content.build_question(usage, locale)
+    message = utils.combine_messages(*messages, question)
+    handler_input.attributes_manager.session_attributes = \
+        usage.to_session_attributes()
+
+    rb = handler_input.response_builder
+    rb.speak(message).ask(question)
+    if utils.has_apl_support(handler_input):
+        rb.add_directive(apl)
+    return rb.response
+
 def persist_skill_data(handler_input, user_initiated_shutdown=False):
     am = handler_input.attributes_manager
+    if am.session_attributes.get(PERSISTED_ATTRIBUTE):
+        # already done in this session, e.g. by a StopIntent followed by
+        # a SessionEndedRequest; doing it again would count another launch
+        return
 
     usage = models.SkillUsage.from_attributes(am.session_attributes)
     usage.launch_count += 1
     usage.previous_session_end = int(time.time())
+    session_data = usage.session_data
+    # the history and mastery the session's answers are added to
+    with timed('persistence_read'):
+        persistent_attributes = am.persistent_attributes
+    usage.end_session(models.SkillUsage.from_attributes(persistent_attributes))
+    if session_data is not None:
+        annotate(session_questions=session_data.questions_count,
+                 session_correct=session_data.correct_answers_count)
 
     if user_initiated_shutdown:
         # we assume they won't want to resume a session on the next
         # launch, hence we persist empty session_data
         usage.session_data = models.SessionData()
 
-    if usage.session_data.operation:
-        # TODO FIXIT HACK :(
-        operation = usage.session_data.operation
-        usage.session_data.operation = operation.value
-
     am.persistent_attributes = models.asdict(usage)
-    am.save_persistent_attributes()
+    with timed('persistence_write'):
+        am.save_persistent_attributes()
+
+    if GLOBAL_STATS and session_data is not None:
+        args = (persistence.user_id(handler_input.request_envelope),
+                session_data, usage.previous_session_end)
+        if ASYNC_IO:
+            # off the response's path, waited for with the writes
+            sb.persistence_adapter.submit(record_global_stats, *args)
+        else:
+            record_global_stats(*args)
+
+    if user_initiated_shutdown:
+        am.session_attributes[PERSISTED_ATTRIBUTE] = True
+
+def load_mastery(handler_input, usage):
+    # the session carries only the mastery of the facts being asked (see
+    # SessionData.mastery), it's read once they are known
+    session_data = usage.session_data
+    key = mastery_to_load(session_data.operation, session_data.difficulty,
+                          session_data.mastery)
+    if key is None:
+        return
+    with timed('persistence_read'):
+        persistent_attributes = handler_input.attributes_manager\
+                                             .persistent_attributes
+    stored = models.SkillUsage.from_attributes(persistent_attributes)
+    session_data.mastery.load(stored.mastery, key)
+
+def mastery_to_load(operation, difficulty, mastery):
+    # the key of the mastery load_mastery reads, None if it doesn't
+    if operation is None or difficulty not in exercises.MASTERY_DIFFICULTIES:
+        return None
+    key = exercises.mastery_key(operation, difficulty)
+    return None if key in mastery else key
+
+def record_global_stats(user_id, session_data, timestamp):
+    # the user's own data is saved already, failing here shouldn't
+    # fail their request
+    try:
+        with timed('global_stats'):
+            stats.record_session(user_id, session_data, timestamp)
+    except Exception as e: # pylint: disable=broad-except,invalid-name
+        logger.warning('recording global stats failed', exc_info=e)
+
+@functools.lru_cache(maxsize=None)
+def constant_response(message_fn, locale):
+    # for messages that don't change, built once per locale
+    return utils.response_dict(message_fn(locale))
 
 @intent_handler('AMAZON.HelpIntent', 'AMAZON.FallbackIntent')
 def help_intent_handler(handler_input):
     locale = handler_input.request_envelope.request.locale
-    message = content.help_message(locale)
-    return utils.build_response(handler_input, message)
+    return constant_response(content.help_message, locale)
 
 @sb.exception_handler(can_handle_func=lambda _i, _e: True)
 def global_exception_handler(handler_input, exception):
     logger.warning('handler exception', exc_info=exception)
+    annotate(error=type(exception).__name__)
     locale = handler_input.request_envelope.request.locale
-    message = content.dead_end_message(locale)
-    return utils.build_response(handler_input, message)
+    return constant_response(content.dead_end_message, locale)
+
+def get_skill():
+    global _skill # pylint: disable=global-statement,invalid-name
+    if _skill is not None:
+        return _skill
+
+    skill = sb.create()
+    skill.serializer = serializer
+    if LAZY_INIT:
+        _skill = skill
+    return skill
+
+def skill_table():
+    if LAZY_INIT:
+        return sb.persistence_adapter.table
+    return sb.dynamodb_client.Table(os.environ['SKILL_TABLE_NAME'])
+
+stats = global_stats.GlobalStats(skill_table)
+
+def roll_up():
+    # run on {"rollup": true} events, see global_stats
+    with timed('roll_up'):
+        aggregates = stats.roll_up()
+    logger.info('global stats rolled up', aggregates=list(aggregates.values()))
+    return {'rollup': True}
+
+def warm_up():
+    """
+    The pre-init hook, run on warm-up events: does what the first request
+    on a new container would have to do otherwise, so that no user waits
+    for it. That's importing boto3 and connecting to DynamoDB (in lazy
+    init mode), building the skill and loading the default catalog and
+    the APL document.
+    """
+    get_skill()
+    catalog.catalog(catalog.DEFAULT_LOCALE)
+    content.apl_document()
+    try:
+        # any request opens the connection; no user has this id
+        skill_table().get_item(Key={'id': WARMUP_ITEM_ID})
+    except Exception as e: # pylint: disable=broad-except,invalid-name
+        logger.warning('warm up failed', exc_info=e)
+    return {'warmup': True}
+
+def prefetch(event):
+    # a launch reads the user's persistent attributes first thing, and
+    # so do the requests loading the mastery or ending the session; that
+    # read can start before the event is even deserialized
+    if not reads_persistent_attributes(event):
+        return
+    system = (event.get('context') or {}).get('System') or {}
+    user_id = (system.get('user') or {}).get('userId')
+    if user_id:
+        # same key as persistence.user_id
+        sb.persistence_adapter.prefetch(user_id)
+
+def reads_persistent_attributes(event):
+    request = event.get('request') or {}
+    intent = request.get('intent') or {}
+    if request.get('type') in PREFETCHED_REQUESTS or \
+            intent.get('name') in PREFETCHED_INTENTS:
+        return True
+    if intent.get('name') not in ['DidSelectOperation', 'DidSelectDifficulty']:
+        return False
+
+    # the operation and difficulty the handler will load the mastery of
+    attributes = (event.get('session') or {}).get('attributes') or {}
+    session_data = models.SkillUsage.from_attributes(attributes)\
+                         .session_data or models.SessionData()
+    operation, difficulty = session_data.operation, session_data.difficulty
+    slots = intent.get('slots') or {}
+    if intent['name'] == 'DidSelectOperation':
+        spoken_operation = (slots.get('operation') or {}).get('value')
+        try:
+            operation = models.Operation.from_word(spoken_operation)
+        except KeyError:
+            return False # the handler fails on it too
+    else:
+        spoken_difficulty = (slots.get('difficulty') or {}).get('value')
+        difficulty = content.difficulty_to_value(spoken_difficulty,
+                                                 request.get('locale'))
+    return mastery_to_load(operation, difficulty,
+                           session_data.mastery) is not None
 
 @log_invocation
 def handler(event, context):
-    return sb.lambda_handler()(event, context)
+    # same as sb.lambda_handler(), only with a custom serializer
+    # phases of the invocation are timed, see core.Metrics
+    if is_warmup(event):
+        return warm_up()
+    if event.get('rollup') is True:
+        return roll_up()
+
+    if ASYNC_IO:
+        prefetch(event)
+    try:
+        skill = get_skill()
+        with timed('deserialize'):
+            if LAZY_ENVELOPE:
+                request_envelope = envelope.lazy(event, RequestEnvelope)
+            else:
+                request_envelope = serializer.deserialize(
+                    payload=json.dumps(event), obj_type=RequestEnvelope)
+        response_envelope = skill.invoke(request_envelope=request_envelope,
+                                         context=context)
+    finally:
+        if ASYNC_IO:
+            drain_io()
+    with timed('serialize'):
+        return serializer.serialize(response_envelope)
+
+def drain_io():
+    # nothing may run on after the invocation; handlers wait for their
+    # writes, this is for a handler (or the dispatch) that failed first
+    try:
+        sb.persistence_adapter.wait()
+    except Exception as e: # pylint: disable=broad-except,invalid-name
+        logger.warning('persistence failed', exc_info=e)
@@ -1,17 +1,28 @@
+import base64
+import collections
 import enum
+import operator
+import struct
 import time
 from typing import Optional
 
 import attr
 
+import catalog
 
-asdict = attr.asdict # for a cleaner interface
 
 # How many seconds in between launch requests should a session be kept?
 # If the period is greater, a new clean session should be launched,
 # ignoring any old choices the user made.
 STALE_SESSION_THRESHOLD = 15 * 60
 
+# Session attributes travel to Alexa and back on every request, so they
+# use a compact encoding: a flat dict with one or two letter keys, where
+# zeros and Nones are left out. "v" is the version of the encoding;
+# attributes without it are in the verbose asdict() shape.
+# The keys are in the field metadata of the models.
+SESSION_FORMAT_VERSION = 1
+
 
 class Operation(enum.Enum):
     ADD = 'add'
@@ -22,81 +33,431 @@ class Operation(enum.Enum):
     @classmethod
     def from_word(cls, word, _locale=None):
         # no locale is used when building SessionData
-        mapping = {'addition': cls.ADD,
-                   'subtraction': cls.SUB,
-                   'multiplication': cls.MUL,
-                   'division': cls.DIV}
-        return mapping[word]
+        return _OPERATION_WORDS[word]
 
     def __call__(self, op1, op2):
-        cls = self.__class__
-        mapping = {cls.ADD: op1 + op2,
-                   cls.SUB: op1 - op2,
-                   cls.MUL: op1 * op2,
-                   cls.DIV: int(op1 / op2)}
-        return mapping[self]
-
-    def as_verb(self, _locale):
-        cls = self.__class__
-        mapping = {cls.ADD: 'plus',
-                   cls.SUB: 'minus',
-                   cls.MUL: 'times',
-                   cls.DIV: 'divided by'}
-        return mapping[self]
+        return _OPERATION_FUNCTIONS[self](op1, op2)
+
+    def as_verb(self, locale):
+        return catalog.message(_OPERATION_VERBS[self], locale)
 
     def as_symbol(self):
-        cls = self.__class__
-        mapping = {cls.ADD: '+',
-                   cls.SUB: '-',
-                   cls.MUL: '×',
-                   cls.DIV: '÷'}
-        return mapping[self]
+        return _OPERATION_SYMBOLS[self]
+
+
+# static dispatch tables of Operation, built once at import
+_OPERATION_VALUES = {operation.value: operation for operation in Operation}
+_OPERATION_WORDS = {'addition': Operation.ADD,
+                    'subtraction': Operation.SUB,
+                    'multiplication': Operation.MUL,
+                    'division': Operation.DIV}
+_OPERATION_FUNCTIONS = {Operation.ADD: operator.add,
+                        Operation.SUB: operator.sub,
+                        Operation.MUL: operator.mul,
+                        Operation.DIV: lambda op1, op2: int(op1 / op2)}
+# message ids in the catalog
+_OPERATION_VERBS = {Operation.ADD: 'verb_add',
+                    Operation.SUB: 'verb_sub',
+                    Operation.MUL: 'verb_mul',
+                    Operation.DIV: 'verb_div'}
+_OPERATION_SYMBOLS = {Operation.ADD: '+',
+                      Operation.SUB: '-',
+                      Operation.MUL: '×',
+                      Operation.DIV: '÷'}
+
+def to_operation(value):
+    # converter of Operation fields, takes an Operation, its value or None
+    if not value or isinstance(value, Operation):
+        return value or None
+    return _OPERATION_VALUES[value]
+
+
+# A record of History: operation (low bits) and correctness (top bit),
+# the two operands and when it was answered (seconds since epoch).
+HISTORY_RECORD = struct.Struct('<BHHI')
+# format version, slot of the next record, number of records
+HISTORY_HEADER = struct.Struct('<BBB')
+HISTORY_FORMAT_VERSION = 1
+HISTORY_SIZE = 32 # records
+_OPERATION_CODES = {operation: code for code, operation in enumerate(Operation)}
+_CORRECT_BIT = 0x80
+
+Exercise = collections.namedtuple(
+    'Exercise', ['operation', 'op1', 'op2', 'correct', 'timestamp'])
+
+
+class History:
+    """
+    The most recent exercises of a user, in a ring buffer of HISTORY_SIZE
+    packed records, stored as a base64 string. The buffer grows with the
+    records until it's full, so it's the same size (a bit over 400
+    characters) for a user who answered 32 questions and one who
+    answered thousands, and a dozen characters per record for fewer.
+
+    It's decoded only once something reads or appends records; if
+    nothing does, encode() returns the string it was created from.
+    """
+
+    __slots__ = ('_encoded', '_buffer')
+
+    def __init__(self, encoded=None):
+        self._encoded = encoded or None
+        self._buffer = None
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            if self._encoded:
+                self._buffer = bytearray(base64.b64decode(self._encoded))
+            else:
+                self._buffer = bytearray(HISTORY_HEADER.size)
+                HISTORY_HEADER.pack_into(self._buffer, 0,
+                                         HISTORY_FORMAT_VERSION, 0, 0)
+        return self._buffer
+
+    @property
+    def capacity(self):
+        records = (len(self.buffer) - HISTORY_HEADER.size) // \
+            HISTORY_RECORD.size
+        return max(HISTORY_SIZE, records)
+
+    def __bool__(self):
+        # without decoding
+        return bool(self._encoded) if self._buffer is None else len(self) > 0
+
+    def __len__(self):
+        return HISTORY_HEADER.unpack_from(self.buffer, 0)[2]
+
+    def __iter__(self):
+        # oldest first
+        _, next_slot, count = HISTORY_HEADER.unpack_from(self.buffer, 0)
+        capacity = self.capacity
+        first = (next_slot - count) % capacity
+        operations = list(Operation)
+        for i in range(count):
+            offset = HISTORY_HEADER.size + \
+                (first + i) % capacity * HISTORY_RECORD.size
+            code, op1, op2, timestamp = \
+                HISTORY_RECORD.unpack_from(self.buffer, offset)
+            yield Exercise(operations[code & ~_CORRECT_BIT], op1, op2,
+                           bool(code & _CORRECT_BIT), timestamp)
+
+    def append(self, operation, op1, op2, correct, timestamp):
+        buffer = self.buffer
+        version, next_slot, count = HISTORY_HEADER.unpack_from(buffer, 0)
+        capacity = self.capacity
+        code = _OPERATION_CODES[operation] | (_CORRECT_BIT if correct else 0)
+        offset = HISTORY_HEADER.size + next_slot * HISTORY_RECORD.size
+        if offset == len(buffer):
+            # not full yet
+            buffer.extend(bytes(HISTORY_RECORD.size))
+        HISTORY_RECORD.pack_into(buffer, offset, code, op1, op2, timestamp)
+        HISTORY_HEADER.pack_into(buffer, 0, version,
+                                 (next_slot + 1) % capacity,
+                                 min(count + 1, capacity))
+        self._encoded = None
+
+    def since(self, other):
+        # the records appended to other to make this history, oldest first
+        records, last = list(self), list(other)[-1:]
+        for i in range(len(records) - 1, -1, -1):
+            if records[i:i + 1] == last:
+                return records[i + 1:]
+        return records
+
+    def encode(self):
+        if self._encoded is None and self._buffer is not None:
+            self._encoded = base64.b64encode(self._buffer).decode('ascii')
+        return self._encoded
+
+    def __eq__(self, other):
+        return isinstance(other, History) and self.encode() == other.encode()
+
+    def __repr__(self):
+        return f'History({self.encode()!r})'
+
+def to_history(value):
+    # converter of History fields, takes a History, its encoding or None
+    return value if isinstance(value, History) else History(value)
+
+
+# the number of set bits, at the start of every bitset of Bitsets
+BITSET_COUNT = struct.Struct('<H')
+
+
+class Bitsets:
+    """
+    Named fixed-size bitsets, each stored as a base64 string (a count of
+    set bits and the bits), in a dict. A bitset is created with its first
+    set bit and decoded the first time it's used, so reading or changing
+    a bit and counting the set bits are all O(1).
+
+    An empty string stands for a bitset that's known to have no bits set
+    yet, see load().
+    """
+
+    __slots__ = ('_encoded', '_decoded')
+
+    def __init__(self, encoded=None):
+        self._encoded = dict(encoded or {})
+        self._decoded = {}
+
+    def _bitset(self, name):
+        bitset = self._decoded.get(name)
+        if bitset is None and self._encoded.get(name):
+            bitset = bytearray(base64.b64decode(self._encoded[name]))
+            self._decoded[name] = bitset
+        return bitset
 
+    def __bool__(self):
+        return bool(self._encoded) or bool(self._decoded)
 
-@attr.s(auto_attribs=True)
+    def __contains__(self, name):
+        return name in self._encoded or name in self._decoded
+
+    def count(self, name):
+        bitset = self._bitset(name)
+        return BITSET_COUNT.unpack_from(bitset)[0] if bitset else 0
+
+    def test(self, name, bit):
+        bitset = self._bitset(name)
+        if bitset is None:
+            return False
+        byte = BITSET_COUNT.size + bit // 8
+        return bool(bitset[byte] & (1 << bit % 8))
+
+    def set(self, name, bit, size, value=True):
+        # size (in bits) is used to create the bitset
+        bitset = self._bitset(name)
+        if bitset is None:
+            if not value:
+                return
+            bitset = bytearray(BITSET_COUNT.size + (size + 7) // 8)
+            self._decoded[name] = bitset
+
+        byte, mask = BITSET_COUNT.size + bit // 8, 1 << bit % 8
+        if bool(bitset[byte] & mask) == value:
+            return
+        bitset[byte] ^= mask
+        count = BITSET_COUNT.unpack_from(bitset)[0] + (1 if value else -1)
+        BITSET_COUNT.pack_into(bitset, 0, count)
+        self._encoded.pop(name, None)
+
+    def load(self, other, name):
+        # other's bitset of that name, an empty string if it has none
+        self._encoded[name] = (other.encode() or {}).get(name, '')
+        self._decoded.pop(name, None)
+
+    def update(self, other):
+        # other's bitsets replace these, but for the empty ones
+        for name, encoded in (other.encode() or {}).items():
+            if encoded:
+                self._encoded[name] = encoded
+                self._decoded.pop(name, None)
+
+    def encode(self):
+        for name, bitset in self._decoded.items():
+            if name not in self._encoded:
+                self._encoded[name] = base64.b64encode(bitset).decode('ascii')
+        return dict(self._encoded) if self._encoded else None
+
+    def __eq__(self, other):
+        return isinstance(other, Bitsets) and self.encode() == other.encode()
+
+    def __repr__(self):
+        return f'Bitsets({self.encode()!r})'
+
+def to_bitsets(value):
+    # converter of Bitsets fields, takes Bitsets, their encoding or None
+    return value if isinstance(value, Bitsets) else Bitsets(value)
+
+
+def _compile(name, lines, namespace):
+    exec('\n'.join(lines), namespace) # pylint: disable=exec-used
+    return namespace[name]
+
+def _encoder_lines(cls, obj, indent):
+    # lines adding the fields of obj to the compact session attributes
+    lines = []
+    for field in attr.fields(cls):
+        value = f'{obj}.{field.name}'
+        if 'nested' not in field.metadata and 'key' not in field.metadata:
+            continue # persisted only
+        if 'nested' in field.metadata:
+            lines += [f'{indent}{field.name} = {value}',
+                      f'{indent}if {field.name} is not None:']
+            lines += _encoder_lines(field.metadata['nested'], field.name,
+                                    indent + '    ')
+            continue
+        if 'enum' in field.metadata:
+            value += '.value'
+        if 'packed' in field.metadata:
+            value += '.encode()'
+        lines += [f'{indent}if {obj}.{field.name}:',
+                  f"{indent}    attributes['{field.metadata['key']}'] = {value}"]
+    return lines
+
+def _decoder_args(cls, namespace):
+    # cls(...) keyword arguments reading the compact session attributes
+    args = []
+    for field in attr.fields(cls):
+        if 'nested' not in field.metadata and 'key' not in field.metadata:
+            continue # persisted only, the default
+        if 'nested' in field.metadata:
+            nested = field.metadata['nested']
+            namespace[nested.__name__] = nested
+            value = f'{nested.__name__}({_decoder_args(nested, namespace)})'
+        else:
+            namespace[f'_{field.name}'] = field.default
+            value = f"get('{field.metadata['key']}', _{field.name})"
+        args.append(f'{field.name}={value}')
+    return ', '.join(args)
+
+def codecs(cls):
+    """
+    Class decorator compiling the (de)serializers of a model from its
+    fields, like attrs compiles __init__. Instead of attr.asdict and
+    hand-written from_attributes looking at every field on every call,
+    each model gets straight-line functions:
+
+    to_dict and from_dict for the verbose shape of persistent attributes,
+    to_session_attributes and from_session_attributes for the compact
+    one of session attributes (see SESSION_FORMAT_VERSION).
+
+    Field metadata says how to encode a field: "key" is its compact key,
+    "enum" fields are stored as their value, "packed" ones (like History
+    or Bitsets) as what their encode() returns and "nested" ones (holding
+    the nested model class) through the nested model's functions. Fields
+    without a key are left out of session attributes, they're only
+    persisted.
+    """
+    namespace = {'_EMPTY': {}}
+    to_dict = ['def to_dict(self):', '    return {']
+    from_dict = ['def from_dict(cls, attributes):',
+                 '    get = (attributes or _EMPTY).get',
+                 '    return cls(']
+
+    for field in attr.fields(cls):
+        name = field.name
+        value = f'self.{name}'
+        if 'nested' in field.metadata:
+            nested = field.metadata['nested']
+            namespace[nested.__name__] = nested
+            value = f'{value}.to_dict() if {value} is not None else None'
+            arg = f"{nested.__name__}.from_dict(get('{name}'))"
+        else:
+            if 'enum' in field.metadata:
+                value = f'{value}.value if {value} is not None else None'
+            if 'packed' in field.metadata:
+                value = f'{value}.encode() if {value} else None'
+            namespace[f'_{name}'] = field.default
+            arg = f"get('{name}', _{name})"
+        to_dict.append(f"        '{name}': {value},")
+        from_dict.append(f'        {name}={arg},')
+    to_dict.append('    }')
+    from_dict.append('    )')
+
+    encoder = ['def to_session_attributes(self):',
+               '    attributes = {"v": SESSION_FORMAT_VERSION}']
+    encoder += _encoder_lines(cls, 'self', '    ')
+    encoder.append('    return attributes')
+    namespace['SESSION_FORMAT_VERSION'] = SESSION_FORMAT_VERSION
+    decoder = ['def from_session_attributes(cls, attributes):',
+               '    get = attributes.get',
+               f'    return cls({_decoder_args(cls, namespace)})']
+
+    cls.to_dict = _compile('to_dict', to_dict, namespace)
+    cls.from_dict = classmethod(_compile('from_dict', from_dict, namespace))
+    cls.to_session_attributes = _compile(
+        'to_session_attributes', encoder, namespace)
+    cls.from_session_attributes = classmethod(
+        _compile('from_session_attributes', decoder, namespace))
+    return cls
+
+
+@codecs
+@attr.s(auto_attribs=True, slots=True)
 class SessionData:
-    # pylint: disable=too-few-public-methods,no-member
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes,no-member
 
     operation: Optional[Operation] = attr.ib(
         default=None,
-        converter=lambda a: Operation(a) if a else None)
-    difficulty: Optional[int] = attr.ib(default=None)
+        converter=to_operation,
+        metadata={'key': 'o', 'enum': True})
+    difficulty: Optional[int] = attr.ib(default=None, metadata={'key': 'd'})
+
+    # of sessions started before the seed, see content.asked_question
+    correct_result: int = attr.ib(default=0, metadata={'key': 'r'})
+    questions_count: int = attr.ib(default=0, metadata={'key': 'q'})
+    correct_answers_count: int = attr.ib(default=0, metadata={'key': 'c'})
+    streak_count: int = attr.ib(default=0, metadata={'key': 's'})
+    # the longest streak of the session, for the leaderboard
+    best_streak: int = attr.ib(default=0, metadata={'key': 't'})
+
+    # operands of the current question, before the seed too
+    op1: int = attr.ib(default=0, metadata={'key': 'a'})
+    op2: int = attr.ib(default=0, metadata={'key': 'b'})
 
-    correct_result: int = attr.ib(default=0)
-    questions_count: int = attr.ib(default=0)
-    correct_answers_count: int = attr.ib(default=0)
-    streak_count: int = attr.ib(default=0)
+    # questions are derived from it and questions_count, see
+    # exercises.question
+    seed: Optional[int] = attr.ib(default=None, metadata={'key': 'e'})
+
+    # the session's part of SkillUsage's history and mastery, which
+    # would make every request and response of the session 0.4-1.6 KB
+    # bigger: the exercises answered in it and the mastery of the facts
+    # being asked, see SkillUsage.end_session
+    answers: History = attr.ib(default=None, converter=to_history,
+                               metadata={'key': 'n', 'packed': True})
+    mastery: Bitsets = attr.ib(default=None, converter=to_bitsets,
+                               metadata={'key': 'k', 'packed': True})
 
     @classmethod
     def from_attributes(cls, attributes):
-        attributes = attributes or {}
-        return cls(operation=attributes.get('operation'),
-                   difficulty=attributes.get('difficulty'),
-                   correct_result=attributes.get('correct_result', 0),
-                   questions_count=attributes.get('questions_count', 0),
-                   correct_answers_count=attributes.get('correct_answers_count', 0),
-                   streak_count=attributes.get('streak_count', 0))
+        return cls.from_dict(attributes)
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@codecs
+@attr.s(auto_attribs=True, kw_only=True, slots=True)
 class SkillUsage:
     # pylint: disable=no-member
 
-    launch_count: int = attr.ib(default=0)
-    previous_session_end: int = attr.ib(default=0, converter=int) # seconds since epoch
-    session_data: Optional[SessionData] = attr.ib(default=None)
+    launch_count: int = attr.ib(default=0, metadata={'key': 'l'})
+    previous_session_end: int = attr.ib(default=0, converter=int, # seconds since epoch
+                                        metadata={'key': 'p'})
+    session_data: Optional[SessionData] = attr.ib(
+        default=None,
+        metadata={'nested': SessionData})
+    # persisted only, sessions carry their part in SessionData
+    history: History = attr.ib(default=None, converter=to_history,
+                               metadata={'packed': True})
+    # facts answered wrong and not right since, see exercises.record_answer
+    mastery: Bitsets = attr.ib(default=None, converter=to_bitsets,
+                               metadata={'packed': True})
 
     @classmethod
     def from_attributes(cls, attributes):
-        attributes = attributes or {}
-        session_data = SessionData.from_attributes(
-            attributes.get('session_data'))
+        # session attributes come in the compact encoding, persistent
+        # ones (and sessions started before it) in the verbose one
+        if attributes and 'v' in attributes:
+            return cls.from_session_attributes(attributes)
+        return cls.from_dict(attributes)
 
-        return cls(launch_count=attributes.get('launch_count', 0),
-                   previous_session_end=attributes.get('previous_session_end', 0),
-                   session_data=session_data)
+    def end_session(self, stored):
+        """
+        Takes the history and mastery of stored (the persisted usage)
+        with the session's answers and mastery added, for persisting.
+        """
+        self.history, self.mastery = stored.history, stored.mastery
+        session_data = self.session_data
+        if session_data is None:
+            return
+        for exercise in session_data.answers:
+            self.history.append(*exercise)
+        self.mastery.update(session_data.mastery)
+        session_data.answers, session_data.mastery = History(), Bitsets()
 
-    def is_new_session(self):
+    def is_new_session(self, now=None):
+        # now (seconds since epoch) defaults to the current time
         if self.previous_session_end == 0:
             return True
 
@@ -106,6 +467,49 @@ class SkillUsage:
             # resum previous session
             return True
 
-        now = int(time.time())
+        if now is None:
+            now = int(time.time())
         delta = now - self.previous_session_end
         return delta >= STALE_SESSION_THRESHOLD
+
+
+SESSION_DATA_KEYS = {field.name: field.metadata['key']
+                     for field in attr.fields(SessionData)}
+
+
+def asdict(model):
+    # for a cleaner interface; unlike attr.asdict, enums become values
+    return model.to_dict()
+
+def rebase(stored, attributes, current):
+    """
+    The persistent attributes (as asdict() makes them) of a session that
+    changed them from stored to attributes, changing current instead:
+    what another container saved in the meantime. Launches add up, the
+    session that ended last keeps its session data and the session's
+    answers and mastery are added to current's. See
+    persistence.SkillTableAdapter.
+    """
+    base, usage, latest = (SkillUsage.from_attributes(value)
+                           for value in (stored, attributes, current))
+    latest.launch_count += usage.launch_count - base.launch_count
+    if usage.previous_session_end >= latest.previous_session_end:
+        latest.previous_session_end = usage.previous_session_end
+        latest.session_data = usage.session_data
+    for exercise in usage.history.since(base.history):
+        latest.history.append(*exercise)
+    stored_mastery = base.mastery.encode() or {}
+    latest.mastery.update(Bitsets({
+        name: bitset
+        for name, bitset in (usage.mastery.encode() or {}).items()
+        if stored_mastery.get(name) != bitset}))
+    return asdict(latest)
+
+def session_data_value(attributes, name):
+    """
+    Reads a single SessionData field straight from session attributes
+    in either encoding, without building the models.
+    """
+    if 'v' in attributes:
+        return attributes.get(SESSION_DATA_KEYS[name])
+    return (attributes.get('session_data') or {}).get(name)
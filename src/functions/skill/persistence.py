@@ -0,0 +1,410 @@
+import collections
+import copy
+import functools
+import threading
+import time
+
+from ask_sdk_core.attributes_manager import AbstractPersistenceAdapter
+from ask_sdk_core.exceptions import PersistenceException
+
+from core import logger # pylint: disable=no-name-in-module
+
+
+# marks a key that's present in the stored attributes but not in the new ones
+REMOVED = object()
+# remembered for a user without an item, so that their first save is a put
+NO_ITEM = object()
+# errors of a write whose condition on the stored item didn't hold
+CONFLICTS = ['ConditionalCheckFailedException', 'ValidationException']
+# how many times a conflicting write is rebased on a fresh read
+CONFLICT_RETRIES = 3
+
+
+def user_id(request_envelope):
+    # same key as the SDK's default user_id_partition_keygen
+    return request_envelope.context.system.user.user_id
+
+def diff(old, new, path=()):
+    """
+    Yields (path, value) for every field of new that differs from old,
+    path being a tuple of keys. Nested dicts are compared field by field,
+    fields missing in new come with the REMOVED value.
+    """
+    for key, value in new.items():
+        if key not in old:
+            yield path + (key,), value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            yield from diff(old[key], value, path + (key,))
+        elif old[key] != value:
+            yield path + (key,), value
+
+    for key in old.keys() - new.keys():
+        yield path + (key,), REMOVED
+
+def lookup(attributes, path):
+    # the value at path, REMOVED if there's none
+    for key in path:
+        if not isinstance(attributes, dict) or key not in attributes:
+            return REMOVED
+        attributes = attributes[key]
+    return attributes
+
+def overlay(stored, attributes, current):
+    """
+    The default rebase of SkillTableAdapter: current with the fields
+    that differ between stored and attributes set (or removed) as they
+    are in attributes.
+    """
+    rebased = copy.deepcopy(current)
+    for path, value in diff(stored, attributes):
+        target = rebased
+        for key in path[:-1]:
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            target = target[key]
+        if value is REMOVED:
+            target.pop(path[-1], None)
+        else:
+            target[path[-1]] = copy.deepcopy(value)
+    return rebased
+
+def update_expression(changes, expected=()):
+    """
+    Builds the UpdateExpression setting (or removing) the given
+    (path, value) changes and the ConditionExpression requiring the
+    expected (path, value) pairs, REMOVED meaning the path doesn't
+    exist, with their attribute names and values.
+    """
+    placeholders, values = {}, {}
+    set_actions, remove_actions, conditions = [], [], []
+
+    def document_path(path):
+        for key in path:
+            placeholders.setdefault(key, f'#n{len(placeholders)}')
+        return '.'.join(placeholders[key] for key in path)
+
+    def value_placeholder(value):
+        placeholder = f':v{len(values)}'
+        values[placeholder] = value
+        return placeholder
+
+    for path, value in changes:
+        if value is REMOVED:
+            remove_actions.append(document_path(path))
+        else:
+            set_actions.append(
+                f'{document_path(path)} = {value_placeholder(value)}')
+
+    for path, value in expected:
+        if value is REMOVED:
+            conditions.append(f'attribute_not_exists({document_path(path)})')
+        else:
+            conditions.append(
+                f'{document_path(path)} = {value_placeholder(value)}')
+
+    expression = []
+    if set_actions:
+        expression.append('SET ' + ', '.join(set_actions))
+    if remove_actions:
+        expression.append('REMOVE ' + ', '.join(remove_actions))
+    names = {placeholder: key for key, placeholder in placeholders.items()}
+    return ' '.join(expression), ' AND '.join(conditions), names, values
+
+def error_code(exception):
+    # of botocore's ClientError, without importing botocore
+    response = getattr(exception, 'response', None) or {}
+    return response.get('Error', {}).get('Code')
+
+
+class SkillTableAdapter(AbstractPersistenceAdapter):
+    """
+    A persistence adapter for the SkillTable, compatible with the SDK's
+    DynamoDbAdapter (items keyed by "id", data under "attributes").
+
+    Unlike DynamoDbAdapter, it doesn't touch boto3 until the first
+    read or write. Importing boto3 and creating the DynamoDB resource
+    is a large chunk of a cold start and requests that never use
+    persistent attributes don't need to pay for it.
+
+    It also remembers the attributes it last read or wrote for the most
+    recent users. Saving attributes for one of them only updates the
+    fields that differ from what's stored and doesn't write at all when
+    nothing changed. For anyone else, including users who had no item,
+    the whole item is put.
+
+    Neither write overwrites what another container wrote in the
+    meantime: the update only applies if the changed fields still have
+    the remembered values and the put only if there's no item yet.
+    When that doesn't hold, the item is read again and the save's
+    changes are rebased on it with rebase(stored, attributes, current),
+    which returns the attributes to write instead, stored being what
+    was remembered (empty if nothing was) and current what was read.
+    The default, overlay, keeps the other container's fields but for
+    the changed ones; the skill's models.rebase merges them.
+
+    With a cache_ttl (in seconds), the remembered attributes are also
+    used as a read-through cache: a user relaunching the skill on the
+    same warm container within cache_ttl of the last read or write
+    doesn't cost a GetItem. Another container may have written the item
+    in the meantime, so cache_ttl is the upper bound on how stale a read
+    can be; keep it well below models.STALE_SESSION_THRESHOLD. Saves
+    based on a stale read conflict and are rebased as above, so nothing
+    the other container wrote is lost, it only costs a read and a write.
+
+    With an executor (a small ThreadPoolExecutor), DynamoDB calls can
+    run while the skill does other work: prefetch() starts reading a
+    user's attributes for get_attributes to pick up, and save_attributes
+    only starts the write. wait() waits for the writes (and reads) in
+    flight and raises what they raised; call it before returning from
+    the invocation, nothing should be left running in a frozen container.
+    submit() runs other work on the executor, waited for the same way.
+
+    boto3 resources aren't thread-safe, so each thread makes its own (in
+    its own boto3 session) and table is the calling thread's Table. A
+    dynamodb_resource given instead is shared by all the threads.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, table_name, dynamodb_resource=None, *,
+                 partition_keygen=user_id, remembered_items=1000,
+                 cache_ttl=0, clock=time.monotonic, executor=None,
+                 rebase=overlay):
+        # pylint: disable=too-many-arguments
+        self.table_name = table_name
+        self.partition_keygen = partition_keygen
+        self.dynamodb_resource = dynamodb_resource
+        self.remembered_items = remembered_items
+        self.cache_ttl = cache_ttl
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rebase = rebase
+        self._clock = clock
+        self._local = threading.local() # the thread's resource and Table
+        self._stored = collections.OrderedDict() # key -> (attributes, when)
+        self.executor = executor
+        self._reads = {} # key -> Future of a prefetched get_item
+        self._writes = [] # (key, attributes, Future) of saves in flight
+        self._tasks = [] # Futures of submit()
+
+    @property
+    def dynamodb(self):
+        if self.dynamodb_resource is not None:
+            return self.dynamodb_resource
+        resource = getattr(self._local, 'resource', None)
+        if resource is None:
+            import boto3 # pylint: disable=import-outside-toplevel
+            resource = boto3.session.Session().resource('dynamodb')
+            self._local.resource = resource
+        return resource
+
+    @dynamodb.setter
+    def dynamodb(self, dynamodb_resource):
+        self.dynamodb_resource = dynamodb_resource
+        # drops the tables of all the threads
+        self._local = threading.local()
+        self._stored.clear()
+        self._reads.clear()
+
+    @property
+    def table(self):
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            table = self._local.table = self.dynamodb.Table(self.table_name)
+        return table
+
+    def remember(self, key, attributes):
+        if attributes is not NO_ITEM:
+            attributes = copy.deepcopy(attributes)
+        self._stored[key] = (attributes, self._clock())
+        self._stored.move_to_end(key)
+        while len(self._stored) > self.remembered_items:
+            self._stored.popitem(last=False)
+
+    def forget(self, key):
+        self._stored.pop(key, None)
+
+    def remembered(self, key):
+        entry = self._stored.get(key)
+        return entry[0] if entry else None
+
+    def cached(self, key):
+        # remembered attributes, if they are fresh enough to be read
+        entry = self._stored.get(key)
+        if entry is None or self._clock() - entry[1] > self.cache_ttl:
+            return None
+        self._stored.move_to_end(key)
+        return {} if entry[0] is NO_ITEM else copy.deepcopy(entry[0])
+
+    def read(self, key):
+        return self.table.get_item(Key={'id': key}, ConsistentRead=True)
+
+    def prefetch(self, key):
+        # starts reading the attributes get_attributes will be asked for
+        if self.executor is None or key in self._reads:
+            return
+        if self.cache_ttl > 0:
+            entry = self._stored.get(key)
+            if entry is not None and \
+                    self._clock() - entry[1] <= self.cache_ttl:
+                return
+        self._reads[key] = self.executor.submit(self.read, key)
+
+    def get_attributes(self, request_envelope):
+        key = self.partition_keygen(request_envelope)
+
+        if self.cache_ttl > 0:
+            attributes = self.cached(key)
+            if attributes is None:
+                self.cache_misses += 1
+            else:
+                self.cache_hits += 1
+            logger.info('persistence cache',
+                        hit=attributes is not None,
+                        hits=self.cache_hits,
+                        misses=self.cache_misses,
+                        cached_items=len(self._stored))
+            if attributes is not None:
+                return attributes
+
+        prefetched = self._reads.pop(key, None)
+        try:
+            response = prefetched.result() if prefetched is not None \
+                else self.read(key)
+        except Exception as e: # pylint: disable=broad-except,invalid-name
+            raise PersistenceException(
+                f'Failed to retrieve attributes from {self.table_name}: '
+                f'{type(e).__name__} {e}') from e
+
+        if 'Item' not in response:
+            self.remember(key, NO_ITEM)
+            return {}
+        attributes = response['Item']['attributes']
+        self.remember(key, attributes)
+        return attributes
+
+    def save_attributes(self, request_envelope, attributes):
+        key = self.partition_keygen(request_envelope)
+        stored = self.remembered(key)
+        if stored is not None and stored is not NO_ITEM and \
+                not any(diff(stored, attributes)):
+            return
+        write = functools.partial(self.write, key, attributes, stored)
+
+        if self.executor is not None:
+            # forgotten again by wait() if the write fails, or replaced
+            # with what was written if it was rebased
+            self.remember(key, attributes)
+            self._writes.append((key, attributes,
+                                 self.executor.submit(write)))
+            return
+
+        try:
+            written = write()
+        except Exception as e: # pylint: disable=broad-except,invalid-name
+            self.forget(key)
+            raise self.save_error(e) from e
+        self.remember(key, written)
+
+    def write(self, key, attributes, stored):
+        """
+        Writes attributes over stored (as remembered, None or NO_ITEM if
+        there's no item), rebasing them on the item when it isn't stored
+        anymore. Returns the attributes written.
+        """
+        base = {} if stored is None or stored is NO_ITEM else stored
+        current = stored
+        attempt = 0
+        while True:
+            try:
+                if current is None or current is NO_ITEM:
+                    self.put(key, attributes)
+                else:
+                    changes = list(diff(current, attributes))
+                    if changes:
+                        self.update(key, current, changes)
+                return attributes
+            except Exception as e: # pylint: disable=broad-except,invalid-name
+                # the stored item isn't what we remember: written by
+                # another container, deleted, or changed so that a
+                # document path doesn't exist
+                code = error_code(e)
+                if code not in CONFLICTS or attempt == CONFLICT_RETRIES:
+                    raise
+                logger.warning('persistence conflict', error=code,
+                               attempt=attempt)
+
+            attempt += 1
+            item = self.read(key).get('Item')
+            if item is None:
+                # deleted, or yet to be created: put as they are
+                current = NO_ITEM
+                continue
+            current = item.get('attributes', {})
+            attributes = self.rebase(base, attributes, current)
+            base = current
+
+    def save_error(self, exception):
+        return PersistenceException(
+            f'Failed to save attributes to {self.table_name}: '
+            f'{type(exception).__name__} {exception}')
+
+    def wait(self):
+        """
+        Waits for the calls started in the executor. Reads nobody picked
+        up are dropped; the first failed write is raised as a
+        PersistenceException, after all of them finished.
+        """
+        reads, self._reads = self._reads, {}
+        writes, self._writes = self._writes, []
+        tasks, self._tasks = self._tasks, []
+        for future in list(reads.values()) + tasks:
+            future.exception() # waits, the result doesn't matter
+
+        error = None
+        for key, attributes, future in writes:
+            exception = future.exception()
+            if exception is not None:
+                self.forget(key)
+                error = error or exception
+            elif future.result() is not attributes:
+                self.remember(key, future.result())
+        if error is not None:
+            raise self.save_error(error) from error
+
+    def submit(self, fn, *args):
+        # runs fn on the executor; it's waited for, but its errors are
+        # fn's to handle
+        self._tasks.append(self.executor.submit(fn, *args))
+
+    def put(self, key, attributes):
+        self.table.put_item(Item={'id': key, 'attributes': attributes},
+                            ConditionExpression='attribute_not_exists(id)')
+
+    def update(self, key, stored, changes):
+        # of the changed fields, as they are remembered
+        expected = [(path, lookup(stored, path)) for path, _ in changes]
+        expression, condition, names, values = update_expression(
+            [(('attributes',) + path, value) for path, value in changes],
+            [(('attributes',) + path, value) for path, value in expected])
+        names['#attributes'] = 'attributes'
+        kwargs = {'Key': {'id': key},
+                  'UpdateExpression': expression,
+                  'ExpressionAttributeNames': names,
+                  # the item may have been deleted in the meantime
+                  'ConditionExpression': 'attribute_exists(#attributes) AND '
+                                         + condition}
+        if values:
+            # DynamoDB rejects an empty ExpressionAttributeValues
+            kwargs['ExpressionAttributeValues'] = values
+
+        self.table.update_item(**kwargs)
+
+    def delete_attributes(self, request_envelope):
+        key = self.partition_keygen(request_envelope)
+        self.forget(key)
+        try:
+            self.table.delete_item(Key={'id': key})
+        except Exception as e: # pylint: disable=broad-except,invalid-name
+            raise PersistenceException(
+                f'Failed to delete attributes from {self.table_name}: '
+                f'{type(e).__name__} {e}') from e
@@ -1,5 +1,4 @@
-import functools
-import random
+from ask_sdk_core.serialize import DefaultSerializer
 
 
 def build_response(handler_input, message, question=None):
@@ -9,6 +8,30 @@ def build_response(handler_input, message, question=None):
                                          .ask(question)\
                                          .response
 
+def output_speech(speech):
+    # what ResponseFactory.speak (and .ask) make of a message
+    speech = speech.strip()
+    if speech.startswith('<speak>') and speech.endswith('</speak>'):
+        speech = speech[7:-8].strip()
+    return FrozenDict(type='SSML', ssml=f'<speak>{speech}</speak>')
+
+def response_dict(message, question=None, directives=()):
+    """
+    The serialized form of build_response's Response (plus directives,
+    already serialized too), built directly. It's frozen, so Serializer
+    returns it as it is, without the model objects and the reflective
+    serialization of the SDK in between.
+    """
+    question = question or message
+    response = FrozenDict(outputSpeech=output_speech(message),
+                          reprompt=FrozenDict(
+                              outputSpeech=output_speech(question)))
+    if directives:
+        # same key order as the SDK's, it's what json.dumps follows
+        return FrozenDict(response, directives=list(directives),
+                          shouldEndSession=False)
+    return FrozenDict(response, shouldEndSession=False)
+
 def combine_messages(*messages):
     # pylint: disable=invalid-name
     punctuated = []
@@ -20,12 +43,6 @@ def combine_messages(*messages):
 
     return ' '.join(punctuated)
 
-def randomize(fn):
-    @functools.wraps(fn)
-    def wrapper(*args, **kwargs):
-        return random.choice(fn(*args, **kwargs))
-    return wrapper
-
 def speechcon(phrase):
     # https://developer.amazon.com/docs/custom-skills/speechcon-reference-interjections-english-us.html
     return f'<say-as interpret-as="interjection">{phrase}</say-as>'
@@ -41,3 +58,41 @@ def has_apl_support(handler_input):
         pass
 
     return False
+
+
+class FrozenDict(dict):
+    """
+    A dict that refuses to be modified. It's still a dict, so it
+    goes through anything expecting one (e.g. the SDK's serializer).
+    """
+
+    def _immutable(self, *_args, **_kwargs):
+        raise TypeError(f'{self.__class__.__name__} is immutable')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+def freeze(obj):
+    # recursively turns JSON-like data into FrozenDicts and tuples
+    if isinstance(obj, dict):
+        return FrozenDict((key, freeze(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(item) for item in obj)
+    return obj
+
+
+class Serializer(DefaultSerializer):
+    """
+    DefaultSerializer rebuilds every dict it comes across. Frozen data
+    are built once from JSON and can't change, so they already are
+    their serialized form and are returned as they are.
+    """
+
+    def serialize(self, obj):
+        if isinstance(obj, FrozenDict):
+            return obj
+        return super().serialize(obj)
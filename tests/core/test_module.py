@@ -1,4 +1,6 @@
 import collections
+import logging
+import random
 import uuid
 
 import pytest
@@ -7,6 +9,34 @@ from src import core
 from tests import test_utils
 
 
+Context = collections.namedtuple('Context',
+                                 ['function_name',
+                                  'function_version',
+                                  'aws_request_id'])
+
+@pytest.fixture(autouse=True)
+def capture_info(caplog):
+    caplog.set_level(logging.INFO)
+
+def load_log_events(caplog):
+    # without the metrics line log_invocation emits, see test_metrics_*
+    return [log for log in test_utils.load_log_events(caplog)
+            if log['event'] != 'metrics']
+
+def load_metrics(caplog):
+    return [log for log in test_utils.load_log_events(caplog)
+            if log['event'] == 'metrics']
+
+
+class Clock: # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
 @pytest.mark.parametrize('ret_val', [1, None])
 def test_log_invocation_decorator(caplog, ret_val):
     @core.log_invocation
@@ -15,15 +45,11 @@ def test_log_invocation_decorator(caplog, ret_val):
 
     assert handler({}, None) == ret_val
 
-    invocation_log, result_log = test_utils.load_log_events(caplog)
+    invocation_log, result_log = load_log_events(caplog)
     assert 'invocation' in invocation_log
     assert 'result' in result_log
 
 def test_log_invocation_decorator_throwing(caplog):
-    Context = collections.namedtuple('Context',
-                                     ['function_name',
-                                      'function_version',
-                                      'aws_request_id'])
     invocation_context = Context(function_name='tester',
                                  function_version='$LATEST',
                                  aws_request_id=str(uuid.uuid4))
@@ -35,10 +61,199 @@ def test_log_invocation_decorator_throwing(caplog):
     with pytest.raises(RuntimeError):
         handler({}, invocation_context)
 
-    invocation_log, error_log = test_utils.load_log_events(caplog)
+    invocation_log, error_log = load_log_events(caplog)
     assert 'invocation' in invocation_log
     assert 'invocation' in error_log
     assert 'exception' in error_log
     assert 'function_name' in error_log
     assert 'function_version' in error_log
     assert 'aws_request_id' in error_log
+
+def test_log_invocation_sampling(caplog):
+    @core.log_invocation(sample_rate=0.25, rng=random.Random(3))
+    def handler(*_args):
+        return 1
+
+    for _ in range(400):
+        handler({}, None)
+
+    logs = load_log_events(caplog)
+    invocations = [log for log in logs if 'invocation' in log]
+    results = [log for log in logs if 'result' in log]
+    assert len(invocations) == len(results)
+    assert 60 < len(invocations) < 140
+
+def test_log_invocation_errors_always_logged(caplog):
+    @core.log_invocation(sample_rate=0)
+    def handler(event, _context):
+        if event:
+            raise RuntimeError('No can do')
+        return 1
+
+    handler({}, None)
+    assert load_log_events(caplog) == []
+
+    with pytest.raises(RuntimeError):
+        handler({'boom': True}, Context('tester', '$LATEST', 'id'))
+    error_log, = load_log_events(caplog)
+    assert error_log['invocation'] == {'boom': True}
+    assert 'exception' in error_log
+
+@pytest.mark.parametrize('event, expected', [
+    ({'warmup': True}, True),
+    ({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, True),
+    ({'warmup': 'yes'}, False),
+    ({'version': '1.0', 'request': {'type': 'LaunchRequest'}}, False),
+    (None, False),
+])
+def test_is_warmup(event, expected):
+    assert core.is_warmup(event) is expected
+
+def test_log_invocation_skips_warmup(caplog):
+    @core.log_invocation(sample_rate=1)
+    def handler(event, _context):
+        return event
+
+    assert handler({'warmup': True}, None) == {'warmup': True}
+    assert test_utils.load_log_events(caplog) == []
+
+def test_log_invocation_allow_lists(caplog):
+    event = {'session': {'user': {'userId': 'amzn1.ask.account.XYZ'},
+                         'new': True},
+             'request': {'type': 'IntentRequest',
+                         'intent': {'name': 'DidAnswer'}}}
+
+    @core.log_invocation(invocation_fields=['request.type',
+                                            'request.intent.name',
+                                            'session.new',
+                                            'context.System'],
+                         result_fields=['response.shouldEndSession'])
+    def handler(*_args):
+        return {'sessionAttributes': {'v': 1},
+                'response': {'shouldEndSession': False}}
+
+    handler(event, None)
+
+    invocation_log, result_log = load_log_events(caplog)
+    assert invocation_log['invocation'] == {
+        'request': {'type': 'IntentRequest',
+                    'intent': {'name': 'DidAnswer'}},
+        'session': {'new': True}}
+    assert result_log['result'] == {'response': {'shouldEndSession': False}}
+
+def test_log_invocation_max_payload(caplog):
+    @core.log_invocation(max_payload=50)
+    def handler(*_args):
+        return {'small': 1}
+
+    handler({'large': 'x' * 100}, None)
+
+    invocation_log, result_log = load_log_events(caplog)
+    assert invocation_log['invocation'] == \
+        '{"large": "' + 'x' * 39 + '...'
+    assert result_log['result'] == {'small': 1}
+
+def test_select_fields():
+    data = {'a': {'b': 1, 'c': [1, 2]}, 'd': 2}
+    assert core.select_fields(data, None) is data
+    assert not core.select_fields(data, [])
+    assert core.select_fields(data, [('a', 'c'), ('a', 'x'), ('d', 'e')]) == \
+        {'a': {'c': [1, 2]}}
+
+def test_metrics_flush(caplog):
+    clock = Clock()
+    metrics = core.Metrics('test-service', clock=clock)
+    with metrics.timed('handler', intent='DidAnswer'):
+        clock.now += 0.004
+        with metrics.timed('persistence'):
+            clock.now += 0.0125
+    with metrics.timed('persistence'):
+        clock.now += 0.001
+    metrics.flush()
+
+    log, = load_metrics(caplog)
+    assert log['intent'] == 'DidAnswer'
+    assert log['handler'] == 16.5
+    assert log['persistence'] == [12.5, 1.0]
+    aws = log['_aws']
+    assert isinstance(aws['Timestamp'], int)
+    directive, = aws['CloudWatchMetrics']
+    assert directive['Namespace'] == 'test-service'
+    assert directive['Dimensions'] == [['stage', 'intent']]
+    assert directive['Metrics'] == [
+        {'Name': 'persistence', 'Unit': 'Milliseconds'},
+        {'Name': 'handler', 'Unit': 'Milliseconds'}]
+    assert log['stage'] == 'localtest'
+
+    metrics.flush()
+    assert len(load_metrics(caplog)) == 1
+
+def test_metrics_annotations(caplog):
+    metrics = core.Metrics('test-service', clock=Clock())
+    metrics.annotate(operation='mul', correct=True)
+    with metrics.timed('handler', intent='DidAnswer'):
+        pass
+    metrics.flush()
+    with metrics.timed('handler'):
+        pass
+    metrics.flush()
+
+    first, second = load_metrics(caplog)
+    assert (first['operation'], first['correct']) == ('mul', True)
+    directive, = first['_aws']['CloudWatchMetrics']
+    # neither metrics nor dimensions
+    assert directive['Dimensions'] == [['stage', 'intent']]
+    assert [metric['Name'] for metric in directive['Metrics']] == ['handler']
+    assert 'operation' not in second
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_metrics_flushed_once_per_invocation(caplog, fail):
+    @core.log_invocation(sample_rate=1)
+    def handler(*_args):
+        with core.timed('phase', intent='Test'):
+            pass
+        with core.timed('phase'):
+            pass
+        if fail:
+            raise RuntimeError('No can do')
+
+    for _ in range(2):
+        try:
+            handler({}, Context('tester', '$LATEST', 'id'))
+        except RuntimeError:
+            pass
+
+    first, second = load_metrics(caplog)
+    for log in [first, second]:
+        assert log['intent'] == 'Test'
+        assert len(log['phase']) == 2
+        assert log['total'] >= 0
+    assert 'sample_rate' not in first
+
+def test_metrics_sampling(caplog):
+    @core.log_invocation(sample_rate=0.25, rng=random.Random(3))
+    def handler(event, _context):
+        core.annotate(operation='mul')
+        with core.timed('phase', intent='Test'):
+            pass
+        if event:
+            raise RuntimeError('No can do')
+
+    for _ in range(400):
+        handler({}, None)
+    logs = load_metrics(caplog)
+    invocations = [log for log in load_log_events(caplog)
+                   if 'invocation' in log]
+    # along with the invocations' other logs
+    assert len(logs) == len(invocations)
+    assert 60 < len(logs) < 140
+    assert all(log['sample_rate'] == 0.25 for log in logs)
+    assert all(log['operation'] == 'mul' for log in logs)
+
+    # errors always, with nothing left over from the dropped ones
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            handler({'boom': True}, Context('tester', '$LATEST', 'id'))
+    logs = load_metrics(caplog)[-3:]
+    assert all('sample_rate' not in log for log in logs)
+    assert all(not isinstance(log['phase'], list) for log in logs)
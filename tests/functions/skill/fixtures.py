@@ -8,29 +8,27 @@ from ask_sdk_core.serialize import DefaultSerializer
 from ask_sdk_model import RequestEnvelope
 import pytest
 
+from . import local_dynamodb
+
 
 serializer = DefaultSerializer()
 
 
 @pytest.fixture
 def dynamodb_client():
-    # pylint: disable=invalid-name
-    item_storage = {}
-
-    def get_item(Key=None, **_kwargs):
-        item_key = Key['id']
-        if item_key in item_storage:
-            return {'Item': {'attributes': item_storage[item_key]}}
-        return {}
-
-    def put_item(Item=None):
-        item_key = Item['id']
-        item_value = Item['attributes']
-        item_storage[item_key] = item_value
-
-    table_mock = Mock(get_item=get_item, put_item=put_item)
+    return mock_dynamodb_client()
+
+def mock_dynamodb_client(**options):
+    # a SkillTable on the local_dynamodb stand-in, with no latency or
+    # throttling unless the options (of local_dynamodb.Resource) say so;
+    # a plain function so that it can be used outside of tests too, e.g.
+    # by benchmarks.loadtest
+    # The table is wrapped in a Mock, so that tests can check its calls
+    # or make them fail; local_table is the stand-in itself.
+    local_table = local_dynamodb.Resource(**options).Table('SkillTable')
     mock_client = Mock()
-    mock_client.Table.return_value = table_mock
+    mock_client.Table.return_value = Mock(wraps=local_table)
+    mock_client.local_table = local_table
 
     return mock_client
 
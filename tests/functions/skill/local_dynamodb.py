@@ -0,0 +1,455 @@
+"""
+A local stand-in for the DynamoDB resource (boto3.resource('dynamodb'))
+and its Table, for the table API the skill uses: get_item, put_item,
+update_item and delete_item, with condition expressions.
+
+Unlike an in-memory dict, it behaves like the service under load:
+  - each call takes a latency drawn from a distribution (see constant
+    and lognormal), per operation if needed
+  - calls are throttled with ProvisionedThroughputExceededException,
+    at random (throttle_rate) and by capacity: a table-wide and a per
+    item (partition) rate of read and write units per second, each a
+    token bucket holding a second's worth of units
+  - every call consumes capacity units computed from the item size the
+    way DynamoDB does it; the table keeps the totals (see Table.stats)
+    and ReturnConsumedCapacity is supported
+  - throttled calls are retried like botocore does for DynamoDB
+    (max_attempts, exponential backoff with jitter), so throttling shows
+    as latency first and as errors when the retries run out
+
+Errors are botocore ClientErrors with the service's error codes. Stored
+items are copies, so changing what was put or read doesn't change the
+table. Numbers come back as they were stored (boto3 would give Decimals).
+
+The clock and sleep are arguments, so tests can run on simulated time.
+"""
+import collections
+import copy
+import math
+import random
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+KEY = 'id'
+
+READ_UNIT_BYTES = 4 * 1024
+WRITE_UNIT_BYTES = 1024
+
+# botocore's legacy retry mode, which DynamoDB clients use by default
+MAX_ATTEMPTS = 10
+BACKOFF_BASE = 0.025 # seconds
+RETRIED_ERRORS = ['ProvisionedThroughputExceededException',
+                  'ThrottlingException']
+
+OPERATIONS = ['get_item', 'put_item', 'update_item', 'delete_item']
+READS = ['get_item']
+
+COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+CONDITION = re.compile(
+    r'\s*(?:(attribute_exists|attribute_not_exists)\(\s*([^)]+?)\s*\)'
+    r'|([#\w.]+)\s*(<>|<=|>=|=|<|>)\s*([:#\w.]+))\s*')
+UPDATE_ACTION = re.compile(r'\b(SET|REMOVE|ADD)\s')
+IF_NOT_EXISTS = re.compile(r'if_not_exists\(\s*([#\w.]+)\s*,\s*([:#\w.]+)\s*\)')
+
+# what a path to an attribute that doesn't exist resolves to, as
+# attributes can hold None
+MISSING = object()
+
+
+def constant(seconds):
+    return lambda rng: seconds
+
+def lognormal(median, p99):
+    # latencies of a service like DynamoDB: most calls close to the
+    # median, a long tail; in seconds
+    sigma = math.log(p99 / median) / 2.326
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+def client_error(code, operation_name, message=''):
+    error = {'Error': {'Code': code, 'Message': message or code}}
+    return ClientError(error, operation_name)
+
+def operation_name(operation):
+    # get_item -> GetItem, as in ClientErrors
+    return ''.join(part.title() for part in operation.split('_'))
+
+def value_size(value):
+    # bytes DynamoDB counts for a value, see "Item sizes and formats"
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        digits = len(str(abs(value)).replace('.', '').lstrip('0')) or 1
+        return 1 + (digits + 1) // 2
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return 3 + sum(len(key.encode('utf-8')) + value_size(item) + 1
+                       for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 3 + sum(value_size(item) + 1 for item in value)
+    raise TypeError(f'Unsupported type {type(value).__name__}')
+
+def item_size(item):
+    if not item:
+        return 0
+    return sum(len(key.encode('utf-8')) + value_size(value)
+               for key, value in item.items())
+
+def read_units(size, consistent):
+    units = max(1, math.ceil(size / READ_UNIT_BYTES))
+    return units if consistent else units / 2
+
+def write_units(size):
+    return max(1, math.ceil(size / WRITE_UNIT_BYTES))
+
+
+class TokenBucket:
+    """Units per second, holding at most a second's worth."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, rate, clock):
+        self.rate = rate
+        self.tokens = rate
+        self.clock = clock
+        self.updated = clock()
+
+    def take(self, units):
+        now = self.clock()
+        self.tokens = min(self.rate,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < units and self.tokens < self.rate:
+            # a request bigger than the rate passes on a full bucket,
+            # driving it negative, like DynamoDB's burst capacity
+            return False
+        self.tokens -= units
+        return True
+
+
+class Expression:
+    """Resolves the paths and values of an expression's placeholders."""
+
+    def __init__(self, operation, names=None, values=None):
+        self.operation = operation
+        self.names = names or {}
+        self.values = values or {}
+
+    def invalid(self, message):
+        return client_error('ValidationException',
+                            operation_name(self.operation), message)
+
+    def path(self, text):
+        try:
+            return [self.names[part] if part.startswith('#') else part
+                    for part in text.strip().split('.')]
+        except KeyError as e:
+            raise self.invalid(f'Undefined name {e}') from e
+
+    def get(self, item, text):
+        target = item
+        for key in self.path(text):
+            if not isinstance(target, dict) or key not in target:
+                return MISSING
+            target = target[key]
+        return target
+
+    def operand(self, item, text):
+        text = text.strip()
+        if text.startswith(':'):
+            if text not in self.values:
+                raise self.invalid(f'Undefined value {text}')
+            return self.values[text]
+        match = IF_NOT_EXISTS.fullmatch(text)
+        if match:
+            current = self.get(item, match.group(1))
+            return self.operand(item, match.group(2)) if current is MISSING \
+                else current
+        for sign in ['+', '-']:
+            left, found, right = text.rpartition(f' {sign} ')
+            if found:
+                left = self.operand(item, left)
+                right = self.operand(item, right)
+                if MISSING in (left, right):
+                    raise self.invalid('An operand in the update expression '
+                                       'has an incorrect data type')
+                return left + right if sign == '+' else left - right
+        return self.get(item, text)
+
+    def check(self, item, condition):
+        # only ORs of ANDs (no parentheses) of attribute_(not_)exists and
+        # comparisons
+        if not any(all(self.holds(item, clause)
+                       for clause in re.split(r'\s+AND\s+', alternative,
+                                              flags=re.IGNORECASE))
+                   for alternative in re.split(r'\s+OR\s+', condition,
+                                               flags=re.IGNORECASE)):
+            raise client_error('ConditionalCheckFailedException',
+                               operation_name(self.operation),
+                               'The conditional request failed')
+
+    def holds(self, item, clause):
+        match = CONDITION.fullmatch(clause)
+        if not match:
+            raise self.invalid(f'Unsupported condition {clause!r}')
+        function, path, left, comparison, right = match.groups()
+        if function == 'attribute_exists':
+            return self.get(item, path) is not MISSING
+        if function == 'attribute_not_exists':
+            return self.get(item, path) is MISSING
+        left = self.operand(item, left)
+        right = self.operand(item, right)
+        try:
+            return MISSING not in (left, right) and \
+                COMPARISONS[comparison](left, right)
+        except TypeError:
+            return False
+
+    def update(self, item, expression):
+        # SET (with +, - and if_not_exists), REMOVE and ADD of numbers
+        actions = UPDATE_ACTION.split(expression)[1:]
+        for action, clauses in zip(actions[::2], actions[1::2]):
+            # commas that aren't in if_not_exists(...)
+            for clause in re.split(r',(?![^(]*\))', clauses):
+                if action == 'SET':
+                    path, found, value = clause.partition('=')
+                    if not found:
+                        raise self.invalid(f'Invalid SET clause {clause!r}')
+                    self.set(item, path, self.operand(item, value))
+                elif action == 'REMOVE':
+                    *parents, leaf = self.path(clause)
+                    self.parent(item, parents).pop(leaf, None)
+                else:
+                    path, value = clause.split()
+                    current = self.get(item, path)
+                    if current is MISSING:
+                        current = 0
+                    self.set(item, path, current + self.operand(item, value))
+
+    def parent(self, item, parents):
+        for key in parents:
+            if not isinstance(item.get(key), dict):
+                raise self.invalid('The document path provided in the '
+                                   'update expression is invalid for update')
+            item = item[key]
+        return item
+
+    def set(self, item, text, value):
+        *parents, leaf = self.path(text)
+        self.parent(item, parents)[leaf] = copy.deepcopy(value)
+
+
+class Table:
+    # pylint: disable=invalid-name,too-many-instance-attributes
+    # like boto3's, the operations take keyword arguments only
+
+    def __init__(self, name, resource):
+        self.name = name
+        self.table_name = name
+        self.resource = resource
+        self.items = {}
+        self.calls = collections.Counter() # per operation, with retries
+        self.throttled = collections.Counter() # per operation
+        self.consumed = collections.Counter() # 'read', 'write' units
+        self._lock = threading.Lock()
+        self._key_buckets = {} # (key, 'read' or 'write') -> TokenBucket
+
+    def stats(self):
+        return {'items': len(self.items),
+                'calls': dict(self.calls),
+                'throttled': dict(self.throttled),
+                'consumed': dict(self.consumed)}
+
+    def get_item(self, *, Key, ConsistentRead=False,
+                 ReturnConsumedCapacity=None, **_kwargs):
+        def read(item):
+            size = item_size(item)
+            return (item, None, read_units(size, ConsistentRead))
+
+        item, _, units = self.resource.call(self, 'get_item', Key, read)
+        response = {'Item': item} if item is not None else {}
+        return self.with_capacity(response, units, ReturnConsumedCapacity)
+
+    def put_item(self, *, Item, ConditionExpression=None,
+                 ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                 ReturnConsumedCapacity=None, **_kwargs):
+        expression = Expression('put_item', ExpressionAttributeNames,
+                                ExpressionAttributeValues)
+
+        def write(item):
+            if ConditionExpression:
+                expression.check(item or {}, ConditionExpression)
+            size = max(item_size(item), item_size(Item))
+            return (item, copy.deepcopy(Item), write_units(size))
+
+        _, _, units = self.resource.call(self, 'put_item',
+                                         {KEY: Item[KEY]}, write)
+        return self.with_capacity({}, units, ReturnConsumedCapacity)
+
+    def update_item(self, *, Key, UpdateExpression, ConditionExpression=None,
+                    ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE',
+                    ReturnConsumedCapacity=None, **_kwargs):
+        # pylint: disable=too-many-arguments
+        expression = Expression('update_item', ExpressionAttributeNames,
+                                ExpressionAttributeValues)
+
+        def write(item):
+            if ConditionExpression:
+                expression.check(item or {}, ConditionExpression)
+            new = copy.deepcopy(item) if item is not None else dict(Key)
+            expression.update(new, UpdateExpression)
+            size = max(item_size(item), item_size(new))
+            return (item, new, write_units(size))
+
+        old, new, units = self.resource.call(self, 'update_item', Key, write)
+        new = copy.deepcopy(new) # the stored item
+        response = {}
+        if ReturnValues == 'ALL_NEW':
+            response['Attributes'] = new
+        elif ReturnValues == 'ALL_OLD' and old is not None:
+            response['Attributes'] = old
+        elif ReturnValues == 'UPDATED_NEW':
+            response['Attributes'] = {
+                key: value for key, value in new.items()
+                if key != KEY and (old or {}).get(key, MISSING) != value}
+        return self.with_capacity(response, units, ReturnConsumedCapacity)
+
+    def delete_item(self, *, Key, ConditionExpression=None,
+                    ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None,
+                    ReturnConsumedCapacity=None, **_kwargs):
+        expression = Expression('delete_item', ExpressionAttributeNames,
+                                ExpressionAttributeValues)
+
+        def delete(item):
+            if ConditionExpression:
+                expression.check(item or {}, ConditionExpression)
+            return (item, None, write_units(item_size(item)))
+
+        _, _, units = self.resource.call(self, 'delete_item', Key, delete,
+                                         deletes=True)
+        return self.with_capacity({}, units, ReturnConsumedCapacity)
+
+    def with_capacity(self, response, units, return_consumed_capacity):
+        if return_consumed_capacity in ['TOTAL', 'INDEXES']:
+            response['ConsumedCapacity'] = {'TableName': self.name,
+                                            'CapacityUnits': units}
+        return response
+
+    def apply(self, operation, key, change, deletes):
+        # runs change(item) -> (item, new item, units) on the stored item,
+        # raises ProvisionedThroughputExceededException when throttled
+        kind = 'read' if operation in READS else 'write'
+        with self._lock:
+            self.calls[operation] += 1
+            old = self.items.get(key)
+            result = change(copy.deepcopy(old) if old is not None else None)
+            units = result[2]
+            if not self.resource.admit(self, key, kind, units):
+                self.throttled[operation] += 1
+                raise client_error(
+                    'ProvisionedThroughputExceededException',
+                    operation_name(operation),
+                    'The level of configured provisioned throughput for the '
+                    'table was exceeded')
+            self.consumed[kind] += units
+            if kind == 'write':
+                if deletes:
+                    self.items.pop(key, None)
+                else:
+                    self.items[key] = result[1]
+            return result
+
+    def bucket(self, key, kind, rate):
+        bucket = self._key_buckets.get((key, kind))
+        if bucket is None:
+            bucket = self._key_buckets[key, kind] = \
+                TokenBucket(rate, self.resource.clock)
+        return bucket
+
+
+class Resource:
+    """
+    The stand-in for boto3.resource('dynamodb'); Table(name) returns the
+    same table, with its items, every time.
+
+    latency is a distribution (a function of a random.Random returning
+    seconds, see constant and lognormal), or a dict of them per
+    operation. Capacities are units per second, None for unlimited.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, latency=None, *, throttle_rate=0.0,
+                 read_capacity=None, write_capacity=None,
+                 key_read_capacity=None, key_write_capacity=None,
+                 max_attempts=MAX_ATTEMPTS, seed=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        # pylint: disable=too-many-arguments
+        if not isinstance(latency, dict):
+            latency = {operation: latency for operation in OPERATIONS}
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.capacity = {'read': read_capacity, 'write': write_capacity}
+        self.key_capacity = {'read': key_read_capacity,
+                             'write': key_write_capacity}
+        self.max_attempts = max_attempts
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.sleep = sleep
+        self.tables = {}
+        self._lock = threading.Lock()
+        self._buckets = {} # (table name, kind) -> TokenBucket
+
+    def Table(self, name): # pylint: disable=invalid-name
+        with self._lock:
+            if name not in self.tables:
+                self.tables[name] = Table(name, self)
+            return self.tables[name]
+
+    def admit(self, table, key, kind, units):
+        # called with the table's lock held
+        if self.throttle_rate and self.rng.random() < self.throttle_rate:
+            return False
+        key_rate = self.key_capacity[kind]
+        if key_rate is not None and \
+                not table.bucket(key, kind, key_rate).take(units):
+            return False
+        rate = self.capacity[kind]
+        if rate is not None:
+            with self._lock:
+                bucket = self._buckets.get((table.name, kind))
+                if bucket is None:
+                    bucket = self._buckets[table.name, kind] = \
+                        TokenBucket(rate, self.clock)
+                return bucket.take(units)
+        return True
+
+    def call(self, table, operation, key, change, deletes=False):
+        # one API call, with the client's retries
+        distribution = self.latency.get(operation)
+        attempt = 0
+        while True:
+            if distribution is not None:
+                self.sleep(distribution(self.rng))
+            try:
+                return table.apply(operation, key[KEY], change, deletes)
+            except ClientError as e:
+                attempt += 1
+                code = e.response['Error']['Code']
+                if code not in RETRIED_ERRORS or attempt >= self.max_attempts:
+                    raise
+                self.sleep(self.rng.random() * BACKOFF_BASE * 2 ** attempt)
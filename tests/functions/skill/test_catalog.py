@@ -0,0 +1,84 @@
+import json
+import os
+import string
+import sys
+
+import pytest
+
+from src.functions.skill import catalog
+
+
+def placeholders(template):
+    return {field for _, field, _, _ in string.Formatter().parse(template)
+            if field is not None}
+
+@pytest.fixture
+def locales_dir(tmp_path, monkeypatch):
+    # a catalog of a second locale, translating only some messages
+    with open(os.path.join(catalog.LOCALES_DIR, 'en-US.json'),
+              encoding='utf-8') as f:
+        (tmp_path / 'en-US.json').write_text(f.read(), encoding='utf-8')
+    (tmp_path / 'de-DE.json').write_text(json.dumps(
+        {'confirmation': ['OK.', 'Alles klar.'],
+         'incorrect': 'Das richtige Ergebnis ist {result}.'}),
+        encoding='utf-8')
+    monkeypatch.setattr(catalog, 'LOCALES_DIR', str(tmp_path))
+    catalog.load.cache_clear()
+    catalog.catalog.cache_clear()
+    yield tmp_path
+    catalog.load.cache_clear()
+    catalog.catalog.cache_clear()
+
+@pytest.mark.parametrize('locale, expected', [
+    ('en-US', 'en-US'),
+    ('en-GB', 'en-US'),
+    ('fr-FR', catalog.DEFAULT_LOCALE),
+    (None, catalog.DEFAULT_LOCALE),
+])
+def test_resolve(locale, expected):
+    assert catalog.resolve(locale) == expected
+
+def test_catalog_is_compiled_once():
+    messages = catalog.catalog('en-US')
+
+    assert messages is catalog.catalog('en-US')
+    assert messages is catalog.catalog('en-GB')
+    for variants in messages.values():
+        assert isinstance(variants, tuple)
+        assert all(variant is sys.intern(variant)
+                   for variant in variants)
+
+def test_locales_are_loaded_lazily(locales_dir): # pylint: disable=unused-argument,redefined-outer-name
+    catalog.message('start', 'en-US')
+    assert catalog.load.cache_info().currsize == 1
+
+    assert catalog.message('incorrect', 'de-DE', result=4) == \
+        'Das richtige Ergebnis ist 4.'
+    assert catalog.message('confirmation', 'de-AT') in ['OK.', 'Alles klar.']
+    assert catalog.load.cache_info().currsize == 2
+    # what isn't translated comes from the default locale
+    assert catalog.message('start', 'de-DE') == \
+        catalog.message('start', 'en-US')
+
+def test_message():
+    assert catalog.message('incorrect', 'en-US', result=12) == \
+        'The correct result is 12. Try another one.'
+    assert catalog.message('correct', 'en-US') in \
+        catalog.catalog('en-US')['correct']
+    with pytest.raises(KeyError):
+        catalog.message('no such message', 'en-US')
+
+@pytest.mark.parametrize('locale', catalog.available_locales())
+def test_translations_match_default(locale):
+    # a translation can leave messages out, but the ones it has take the
+    # same values as the default ones
+    default = catalog.load(catalog.DEFAULT_LOCALE)
+    with open(os.path.join(catalog.LOCALES_DIR, f'{locale}.json'),
+              encoding='utf-8') as f:
+        entries = json.load(f)
+
+    for key, entry in entries.items():
+        assert key in default
+        expected = set.union(*(placeholders(t) for t in default[key]))
+        for template in catalog.compile_entry(entry):
+            assert placeholders(template) <= expected
@@ -83,7 +83,31 @@ def test_build_question(questions_count, locale):
     assert isinstance(question, str)
     assert isinstance(result, int)
     assert isinstance(apl, RenderDocumentDirective)
-
+    op1, op2, asked_result = content.asked_question(usage)
+    assert asked_result == result
+    assert usage.session_data.operation(op1, op2) == result
+    assert str(op1) in question and str(op2) in question
+
+def test_asked_question_of_legacy_session():
+    usage = SkillUsage.from_attributes({
+        'session_data': {'operation': 'mul', 'difficulty': 2,
+                         'correct_result': 56, 'op1': 7, 'op2': 8}})
+    assert content.asked_question(usage) == (7, 8, 56)
+
+    content.next_question(usage, 'en-US')
+    assert usage.session_data.seed is not None
+    assert usage.session_data.correct_result == 0
+
+
+def test_apl_document_is_loaded_once():
+    document = content.apl_document()
+
+    assert document is content.apl_document()
+    assert document['type'] == 'APL'
+    with pytest.raises(TypeError):
+        document['type'] = 'HTML'
+    with pytest.raises(TypeError):
+        document['mainTemplate']['item'].update({'type': 'Frame'})
 
 def test_training_question(operation, difficulty, locale):
     session_data = QODSessionData(randint(0, 5),
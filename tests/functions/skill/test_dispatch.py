@@ -0,0 +1,99 @@
+import json
+
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.attributes_manager import AttributesManager
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_runtime.dispatch_components import GenericRequestHandlerChain
+import pytest
+
+from src.functions.skill import dispatch
+from .fixtures import build_intent_event, load_event, serializer
+
+
+class PlainHandler:
+    # a handler the mapper can't index
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, can_handle):
+        self.can_handle = can_handle
+
+def to_handler_input(event):
+    envelope = serializer.deserialize(json.dumps(event), RequestEnvelope)
+    return HandlerInput(envelope, AttributesManager(envelope))
+
+def chains(*handlers):
+    return [GenericRequestHandlerChain(request_handler=handler)
+            for handler in handlers]
+
+def handler(*keys, requires=()):
+    return dispatch.IndexedRequestHandler(lambda _hi: None, keys, requires)
+
+@pytest.fixture
+def launch():
+    return to_handler_input(load_event('launch_request'))
+
+@pytest.fixture
+def did_answer():
+    return to_handler_input(load_event('did_answer_correct'))
+
+def test_request_key(launch, did_answer):
+    assert dispatch.request_key(launch) == ('LaunchRequest', None)
+    assert dispatch.request_key(did_answer) == ('IntentRequest', 'DidAnswer')
+
+def test_has_session_data(launch, did_answer):
+    assert dispatch.has_session_data(did_answer, ['operation', 'difficulty'])
+    assert not dispatch.has_session_data(launch, ['operation'])
+    assert dispatch.has_session_data(launch, [])
+
+def test_lookup(launch, did_answer):
+    on_launch = handler(('LaunchRequest', None))
+    on_answer = handler(('IntentRequest', 'DidAnswer'),
+                        ('IntentRequest', 'DidGuess'))
+    mapper = dispatch.IndexedRequestMapper(chains(on_launch, on_answer))
+
+    assert mapper.get_request_handler_chain(launch).request_handler \
+        is on_launch
+    assert mapper.get_request_handler_chain(did_answer).request_handler \
+        is on_answer
+
+    help_intent = to_handler_input(build_intent_event('AMAZON.HelpIntent'))
+    assert mapper.get_request_handler_chain(help_intent) is None
+
+def test_session_guard(did_answer):
+    guarded = handler(('IntentRequest', 'DidAnswer'), requires=['streak'])
+    fallback = handler(('IntentRequest', 'DidAnswer'))
+    mapper = dispatch.IndexedRequestMapper(chains(guarded, fallback))
+
+    assert mapper.get_request_handler_chain(did_answer).request_handler \
+        is fallback
+
+def test_registration_order_is_kept(did_answer):
+    indexed_first = handler(('IntentRequest', 'DidAnswer'))
+    plain = PlainHandler(lambda _hi: True)
+    mapper = dispatch.IndexedRequestMapper(chains(indexed_first, plain))
+    assert mapper.get_request_handler_chain(did_answer).request_handler \
+        is indexed_first
+
+    mapper = dispatch.IndexedRequestMapper(chains(plain, indexed_first))
+    assert mapper.get_request_handler_chain(did_answer).request_handler \
+        is plain
+
+    launch = to_handler_input(load_event('launch_request'))
+    assert mapper.get_request_handler_chain(launch).request_handler is plain
+
+def test_can_handle_matches_the_index(launch, did_answer):
+    on_answer = handler(('IntentRequest', 'DidAnswer'),
+                        requires=['operation'])
+    assert on_answer.can_handle(did_answer)
+    assert not on_answer.can_handle(launch)
+
+def test_mapper_is_built_once():
+    builder = dispatch.IndexedRuntimeConfigurationBuilder()
+    builder.add_request_handler(handler(('LaunchRequest', None)))
+
+    first = builder.get_runtime_configuration().request_mappers[0]
+    assert builder.get_runtime_configuration().request_mappers[0] is first
+
+    builder.add_request_handler(handler(('SessionEndedRequest', None)))
+    assert builder.get_runtime_configuration().request_mappers[0] \
+        is not first
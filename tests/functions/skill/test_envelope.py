@@ -0,0 +1,61 @@
+import json
+
+from ask_sdk_core.exceptions import SerializationException
+from ask_sdk_model import IntentRequest, RequestEnvelope
+from ask_sdk_model.slot import Slot
+import pytest
+
+from src.functions.skill import envelope
+from .fixtures import load_event, serializer
+
+
+EVENTS = ['launch_request', 'did_select_operation', 'did_select_difficulty',
+          'did_answer_correct', 'did_answer_wrong', 'session_ended_request',
+          'unhandled_intent']
+
+@pytest.mark.parametrize('event_name', EVENTS)
+def test_same_as_full_deserialization(event_name):
+    event = load_event(event_name)
+    full = serializer.deserialize(json.dumps(event), RequestEnvelope)
+    lazy = envelope.lazy(event, RequestEnvelope)
+
+    assert isinstance(lazy, RequestEnvelope)
+    assert isinstance(lazy.request, type(full.request))
+    # to_dict reads (so decodes) every attribute, all the way down
+    assert lazy.to_dict() == full.to_dict()
+
+def test_decodes_only_what_is_read():
+    event = load_event('did_answer_correct')
+    lazy = envelope.lazy(event, RequestEnvelope)
+
+    assert lazy.request.locale == 'en-US'
+    assert 'request' in vars(lazy)
+    assert 'context' not in vars(lazy)
+    assert 'intent' not in vars(lazy.request)
+
+    request = lazy.request
+    assert isinstance(request, IntentRequest)
+    assert lazy.request is request
+    slot = request.intent.slots['answer']
+    assert isinstance(slot, Slot)
+    assert slot.value == event['request']['intent']['slots']['answer']['value']
+
+def test_missing_and_unknown_fields():
+    event = load_event('launch_request')
+    del event['request']['locale']
+    event['request']['somethingNew'] = 42
+    lazy = envelope.lazy(event, RequestEnvelope)
+
+    # like the SDK's models: None when missing, unknown ones as they are
+    assert lazy.request.locale is None
+    assert getattr(lazy.request, 'somethingNew') == 42
+    with pytest.raises(AttributeError):
+        lazy.request.no_such_field # pylint: disable=pointless-statement
+
+def test_unknown_request_type():
+    event = load_event('launch_request')
+    event['request']['type'] = 'NoSuchRequest'
+    lazy = envelope.lazy(event, RequestEnvelope)
+
+    with pytest.raises(SerializationException):
+        lazy.request # pylint: disable=pointless-statement
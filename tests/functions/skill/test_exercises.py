@@ -0,0 +1,190 @@
+import collections
+import random
+
+import pytest
+
+from src.functions.skill import exercises
+from src.functions.skill.models import Bitsets, Operation
+
+
+@pytest.fixture(params=[Operation.ADD,
+                        Operation.SUB,
+                        Operation.MUL,
+                        Operation.DIV])
+def operation(request):
+    return request.param
+
+@pytest.fixture(params=list(range(1, 6)))
+def difficulty(request):
+    return request.param
+
+def is_valid(operation, op1, op2):
+    if operation is Operation.SUB:
+        return op1 >= op2
+    if operation is Operation.DIV:
+        return op1 >= op2 and op1 % op2 == 0
+    return True
+
+def brute_force(operation, difficulty):
+    op1_max, op2_max = exercises.limits(operation, difficulty)
+    return {(op1, op2)
+            for op1 in range(1, op1_max + 1)
+            for op2 in range(1, op2_max + 1)
+            if is_valid(operation, op1, op2)}
+
+@pytest.mark.parametrize('difficulty', [1, 2, 3])
+def test_pool_contents(operation, difficulty):
+    pool = exercises.pool(operation, difficulty)
+    pairs = [pool[i] for i in range(len(pool))]
+
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == brute_force(operation, difficulty)
+
+def test_pool_bounds(operation, difficulty):
+    pool = exercises.pool(operation, difficulty)
+    op1_max, op2_max = exercises.limits(operation, difficulty)
+
+    for index in [0, 1, len(pool) // 2, len(pool) - 2, len(pool) - 1]:
+        op1, op2 = pool[index]
+        assert 1 <= op1 <= op1_max
+        assert 1 <= op2 <= op2_max
+        assert is_valid(operation, op1, op2)
+
+    with pytest.raises(IndexError):
+        _ = pool[len(pool)]
+
+def test_pool_is_built_once(operation, difficulty):
+    assert exercises.pool(operation, difficulty) is \
+        exercises.pool(operation, difficulty)
+
+@pytest.mark.parametrize('difficulty', [1, 2, 4])
+def test_pool_index_of(operation, difficulty):
+    pool = exercises.pool(operation, difficulty)
+    for index in range(0, len(pool), max(1, len(pool) // 500)):
+        assert pool.index_of(*pool[index]) == index
+
+    op1_max, op2_max = exercises.limits(operation, difficulty)
+    for op1, op2 in [(0, 1), (op1_max + 1, 1), (1, op2_max + 1)]:
+        with pytest.raises(ValueError):
+            pool.index_of(op1, op2)
+
+def test_trapezoid_pool_large_indices():
+    # the triangle part relies on a float sqrt estimate
+    pool = exercises.TrapezoidPool(1000, 1000)
+    previous = (0, 0)
+    for index in range(len(pool) - 5000, len(pool)):
+        op1, op2 = pool[index]
+        assert op1 >= op2
+        assert (op1, op2) > previous
+        previous = (op1, op2)
+    assert previous == (1000, 1000)
+
+def probability(operation, difficulty, pair):
+    if operation is not Operation.DIV:
+        return 1 / len(exercises.pool(operation, difficulty))
+    # every divisor is as likely, then every multiple of it
+    op1_max, op2_max = exercises.limits(operation, difficulty)
+    return 1 / (op2_max * (op1_max // pair[1]))
+
+def chi_squared(counts, operation, difficulty, draws):
+    expected = {pair: draws * probability(operation, difficulty, pair)
+                for pair in counts}
+    return sum((count - expected[pair]) ** 2 / expected[pair]
+               for pair, count in counts.items())
+
+def test_division_distribution():
+    # division used to be patched up with math.ceil, skewing towards
+    # some results; every divisor, then every multiple of it, should now
+    # be equally likely (not every pair, or "x ÷ 1" would be over a third)
+    pool = exercises.pool(Operation.DIV, 1)
+    rng = random.Random(42)
+    draws = 500 * len(pool)
+    counts = collections.Counter(pool.sample(rng) for _ in range(draws))
+
+    assert len(counts) == len(pool)
+    divisors = collections.Counter()
+    for (_, op2), count in counts.items():
+        divisors[op2] += count
+    assert all(0.9 * draws / 10 < divisors[op2] < 1.1 * draws / 10
+               for op2 in range(1, 11))
+    # 99.9th percentile of chi-squared with len(pool) - 1 = 26 dof is ~54
+    assert chi_squared(counts, Operation.DIV, 1, draws) < 54
+
+@pytest.mark.parametrize('count', [0, 1, 500])
+def test_draw_batch(operation, difficulty, count):
+    batch = exercises.draw_batch(operation, difficulty, count)
+    op1_max, op2_max = exercises.limits(operation, difficulty)
+
+    assert len(batch.op1) == len(batch.op2) == len(batch.result) == count
+    for op1, op2, result in zip(*batch):
+        assert 1 <= op1 <= op1_max
+        assert 1 <= op2 <= op2_max
+        assert is_valid(operation, op1, op2)
+        assert result == operation(op1, op2)
+
+def test_draw_batch_is_reproducible(operation):
+    first = exercises.draw_batch(operation, 3, 100, random.Random(7))
+    second = exercises.draw_batch(operation, 3, 100, random.Random(7))
+    assert first == second
+
+def test_record_answer():
+    mastery = Bitsets()
+    exercises.record_answer(mastery, Operation.MUL, 1, 7, 8, correct=True)
+    assert not mastery
+
+    exercises.record_answer(mastery, Operation.MUL, 1, 7, 8, correct=False)
+    exercises.record_answer(mastery, Operation.MUL, 1, 6, 8, correct=False)
+    exercises.record_answer(mastery, Operation.MUL, 3, 6, 8, correct=False)
+    pool = exercises.pool(Operation.MUL, 1)
+    assert mastery.count('mul1') == 2
+    assert mastery.test('mul1', pool.index_of(7, 8))
+    assert mastery.count('mul3') == 0
+
+    exercises.record_answer(mastery, Operation.MUL, 1, 7, 8, correct=True)
+    assert mastery.count('mul1') == 1
+    assert not mastery.test('mul1', pool.index_of(7, 8))
+
+def test_draw_weights_missed_facts(operation):
+    pool = exercises.pool(operation, 1)
+    mastery = Bitsets()
+    missed = pool[len(pool) // 2]
+    exercises.record_answer(mastery, operation, 1, *missed, correct=False)
+
+    rng = random.Random(5)
+    draws = 3000
+    hits = sum(exercises.draw(operation, 1, rng, mastery) == missed
+               for _ in range(draws))
+    # MISSED_WEIGHT times as likely as it would be otherwise
+    share = probability(operation, 1, missed) * exercises.MISSED_WEIGHT
+    expected = draws * share / (share + 1 - share / exercises.MISSED_WEIGHT)
+    assert 0.7 * expected < hits < 1.3 * expected
+
+    # without mastery, or with nothing missed, it's uniform
+    assert exercises.draw(operation, 1, random.Random(5)) == \
+        exercises.draw(operation, 1, random.Random(5), Bitsets())
+
+def test_question_is_reproducible(operation):
+    first = [exercises.question(operation, 2, 1234, index)
+             for index in range(50)]
+    assert first == [exercises.question(operation, 2, 1234, index)
+                     for index in range(50)]
+    # not the same sequence for another seed
+    assert first != [exercises.question(operation, 2, 1235, index)
+                     for index in range(50)]
+
+def test_question_random_is_stable():
+    # derived questions have to stay the same across deployments
+    rng = exercises.QuestionRandom(1234, 5)
+    assert [round(rng.random(), 6) for _ in range(3)] == \
+        [0.136618, 0.623442, 0.747763]
+
+def test_question_distribution():
+    pool = exercises.pool(Operation.DIV, 1)
+    draws = 300 * len(pool)
+    counts = collections.Counter(
+        exercises.question(Operation.DIV, 1, seed, index)
+        for seed in range(300) for index in range(len(pool)))
+
+    assert len(counts) == len(pool)
+    # see test_division_distribution
+    assert chi_squared(counts, Operation.DIV, 1, draws) < 54
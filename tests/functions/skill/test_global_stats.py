@@ -0,0 +1,104 @@
+import random
+
+import pytest
+
+from src.functions.skill import global_stats
+from src.functions.skill.models import SessionData
+from .fixtures import dynamodb_client # pylint: disable=unused-import
+
+
+NOW = 1539255600 # 2018-10-11 11:00 UTC
+
+class Clock: # pylint: disable=too-few-public-methods
+    now = NOW
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+@pytest.fixture
+def table(dynamodb_client): # pylint: disable=redefined-outer-name
+    return dynamodb_client.Table()
+
+@pytest.fixture
+def items(dynamodb_client): # pylint: disable=redefined-outer-name
+    return dynamodb_client.local_table.items
+
+@pytest.fixture
+def stats(table, clock): # pylint: disable=redefined-outer-name
+    return global_stats.GlobalStats(lambda: table, shards=4,
+                                    leaderboard_size=3, clock=clock,
+                                    rng=random.Random(1))
+
+def test_counts_are_sharded_and_rolled_up(stats, items): # pylint: disable=redefined-outer-name
+    for amount in range(1, 21):
+        stats.count('questions#2018-10-11', amount)
+    stats.count('questions#2018-10-10', 5) # finished after midnight
+
+    shards = [item for item_id, item in items.items()
+              if item_id.startswith('stats#questions#2018-10-11#')]
+    assert len(shards) == 4
+    assert sum(shard['count'] for shard in shards) == 210
+
+    # nothing rolled up yet
+    assert stats.questions() == 0
+    stats.roll_up()
+    assert stats.questions() == 210
+    assert stats.questions(NOW - global_stats.DAY) == 5
+
+def test_reads_are_cached(stats, table, clock): # pylint: disable=redefined-outer-name
+    stats.questions()
+    stats.questions()
+    assert table.get_item.call_count == 1
+
+    stats.count('questions#2018-10-11', 3)
+    other = global_stats.GlobalStats(lambda: table, shards=4)
+    other.roll_up(NOW)
+    assert stats.questions() == 0 # cached
+    clock.now += global_stats.CACHE_TTL + 1
+    assert stats.questions() == 3
+    assert table.get_item.call_count == 2 + 2 * 4 + 4 # and the roll-up's
+
+def test_leaderboard(stats, items): # pylint: disable=redefined-outer-name
+    scores = {'a1': 5, 'b2': 9, 'c3': 2, 'd4': 7}
+    for player_id, score in scores.items():
+        stats.submit('streaks', player_id, score)
+    stats.submit('streaks', 'a1', 3) # not better, kept at 5
+    stats.submit('streaks', 'c3', 6)
+
+    assert stats.roll_up()['streaks']['top'] == \
+        [['b2', 9], ['d4', 7], ['c3', 6]]
+    assert stats.leaderboard() == [('b2', 9), ('d4', 7), ('c3', 6)]
+    # the shards keep only the leaderboard's players
+    entries = {player_id for item_id, item in items.items()
+               if item_id.startswith('stats#streaks#')
+               for player_id in item['top']}
+    assert entries == {'b2', 'd4', 'c3'}
+
+def test_scores_below_a_full_leaderboard_are_not_written(stats, table): # pylint: disable=redefined-outer-name
+    for player_id, score in [('a1', 5), ('b2', 9), ('c3', 6)]:
+        stats.submit('streaks', player_id, score)
+    stats.roll_up()
+    table.update_item.reset_mock()
+    table.put_item.reset_mock()
+
+    stats.submit('streaks', 'd4', 5)
+    table.update_item.assert_not_called()
+    table.put_item.assert_not_called()
+    stats.submit('streaks', 'd4', 8)
+    table.update_item.assert_called_once()
+
+def test_record_session(stats, items): # pylint: disable=redefined-outer-name
+    session_data = SessionData(questions_count=12, streak_count=1,
+                               best_streak=8)
+    stats.record_session('amzn1.ask.account.testUser', session_data, NOW)
+    stats.record_session('amzn1.ask.account.other', SessionData(), NOW)
+
+    aggregates = stats.roll_up()
+    assert aggregates['questions#2018-10-11']['count'] == 12
+    player_id = global_stats.player('amzn1.ask.account.testUser')
+    assert aggregates['streaks']['top'] == [[player_id, 8]]
+    assert 'testUser' not in str(items)
@@ -0,0 +1,206 @@
+import threading
+
+from botocore.exceptions import ClientError
+import pytest
+
+from .local_dynamodb import Resource, constant, item_size, lognormal
+
+
+class FakeTime:
+    """A clock that only moves when slept on."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def fake_time():
+    return FakeTime()
+
+def error_code(excinfo):
+    return excinfo.value.response['Error']['Code']
+
+def test_round_trip_copies_items():
+    table = Resource().Table('test-table')
+    item = {'id': 'u1', 'attributes': {'launch_count': 1, 'history': None}}
+
+    assert table.get_item(Key={'id': 'u1'}) == {}
+    table.put_item(Item=item)
+    item['attributes']['launch_count'] = 2
+    stored = table.get_item(Key={'id': 'u1'})['Item']
+    assert stored == {'id': 'u1',
+                      'attributes': {'launch_count': 1, 'history': None}}
+    stored['attributes'].clear()
+    assert table.get_item(Key={'id': 'u1'})['Item']['attributes']
+
+    table.delete_item(Key={'id': 'u1'})
+    assert table.get_item(Key={'id': 'u1'}) == {}
+    assert Resource().Table('test-table') is not table
+
+def test_update_expressions():
+    table = Resource().Table('test-table')
+    table.put_item(Item={'id': 'u1', 'attributes': {'a': 1, 'b': {'c': 2}}})
+
+    response = table.update_item(
+        Key={'id': 'u1'},
+        UpdateExpression='SET #at.#a = #at.#a + :one, #at.#b.#c = :v, '
+                         '#at.#d = if_not_exists(#at.#d, :zero) '
+                         'REMOVE #at.#gone ADD #count :one',
+        ExpressionAttributeNames={'#at': 'attributes', '#a': 'a', '#b': 'b',
+                                  '#c': 'c', '#d': 'd', '#gone': 'gone',
+                                  '#count': 'count'},
+        ExpressionAttributeValues={':one': 1, ':v': 'x', ':zero': 0},
+        ReturnValues='ALL_NEW')
+
+    assert response['Attributes'] == {
+        'id': 'u1', 'count': 1,
+        'attributes': {'a': 2, 'b': {'c': 'x'}, 'd': 0}}
+    # updating an item that doesn't exist creates it
+    response = table.update_item(
+        Key={'id': 'u2'}, UpdateExpression='ADD #n :v',
+        ExpressionAttributeNames={'#n': 'n'},
+        ExpressionAttributeValues={':v': 5}, ReturnValues='UPDATED_NEW')
+    assert response['Attributes'] == {'n': 5}
+
+def test_invalid_document_path():
+    table = Resource().Table('test-table')
+    with pytest.raises(ClientError) as excinfo:
+        table.update_item(Key={'id': 'u1'},
+                          UpdateExpression='SET #a.#b = :v',
+                          ExpressionAttributeNames={'#a': 'a', '#b': 'b'},
+                          ExpressionAttributeValues={':v': 1})
+    assert error_code(excinfo) == 'ValidationException'
+
+@pytest.mark.parametrize('condition, values, passes', [
+    ('attribute_exists(#a)', {}, True),
+    ('attribute_not_exists(#a)', {}, False),
+    ('attribute_exists(#a.#n)', {}, True), # holds None
+    ('#a.#count < :v', {':v': 3}, True),
+    ('#a.#count < :v AND attribute_exists(#a)', {':v': 2}, False),
+    ('#a.#missing = :v', {':v': None}, False),
+    ('attribute_not_exists(#a.#missing) OR #a.#count > :v', {':v': 5}, True),
+    ('#a.#count > :v OR #a.#count = :w', {':v': 5, ':w': 3}, False),
+])
+def test_conditions(condition, values, passes):
+    table = Resource().Table('test-table')
+    table.put_item(Item={'id': 'u1', 'attributes': {'count': 2, 'n': None}})
+    kwargs = {'Item': {'id': 'u1', 'attributes': {}},
+              'ConditionExpression': condition,
+              'ExpressionAttributeNames': {'#a': 'attributes', '#n': 'n',
+                                           '#count': 'count',
+                                           '#missing': 'missing'},
+              'ExpressionAttributeValues': values}
+
+    if passes:
+        table.put_item(**kwargs)
+        assert table.get_item(Key={'id': 'u1'})['Item']['attributes'] == {}
+    else:
+        with pytest.raises(ClientError) as excinfo:
+            table.put_item(**kwargs)
+        assert error_code(excinfo) == 'ConditionalCheckFailedException'
+        assert table.get_item(Key={'id': 'u1'})['Item']['attributes']
+
+def test_latency(fake_time):
+    resource = Resource(latency={'get_item': constant(0.004),
+                                 'put_item': lognormal(0.006, 0.03)},
+                        seed=1, clock=fake_time.clock, sleep=fake_time.sleep)
+    table = resource.Table('test-table')
+
+    table.get_item(Key={'id': 'u1'})
+    table.delete_item(Key={'id': 'u1'}) # no latency given
+    assert fake_time.sleeps == [0.004]
+
+    for _ in range(2000):
+        table.put_item(Item={'id': 'u1'})
+    puts = sorted(fake_time.sleeps[1:])
+    assert 0.005 < puts[1000] < 0.007
+    assert 0.02 < puts[1980] < 0.045
+
+def test_random_throttling_is_retried(fake_time):
+    resource = Resource(throttle_rate=1.0, max_attempts=4,
+                        clock=fake_time.clock, sleep=fake_time.sleep)
+    table = resource.Table('test-table')
+
+    with pytest.raises(ClientError) as excinfo:
+        table.put_item(Item={'id': 'u1'})
+    assert error_code(excinfo) == 'ProvisionedThroughputExceededException'
+    assert table.stats()['calls'] == {'put_item': 4}
+    assert table.stats()['throttled'] == {'put_item': 4}
+    assert len(fake_time.sleeps) == 3 # backoffs between attempts
+    assert table.items == {}
+
+def test_key_capacity(fake_time):
+    resource = Resource(key_write_capacity=10, max_attempts=1,
+                        clock=fake_time.clock, sleep=fake_time.sleep)
+    table = resource.Table('test-table')
+
+    for _ in range(10):
+        table.put_item(Item={'id': 'hot'})
+    with pytest.raises(ClientError):
+        table.put_item(Item={'id': 'hot'})
+    # other keys have capacity of their own
+    table.put_item(Item={'id': 'cold'})
+
+    fake_time.now += 0.5
+    for _ in range(5):
+        table.put_item(Item={'id': 'hot'})
+    with pytest.raises(ClientError):
+        table.put_item(Item={'id': 'hot'})
+
+def test_throttling_retries_until_capacity(fake_time):
+    resource = Resource(write_capacity=5,
+                        clock=fake_time.clock, sleep=fake_time.sleep)
+    table = resource.Table('test-table')
+
+    for number in range(8):
+        table.put_item(Item={'id': f'u{number}'})
+    # the last puts waited for the bucket to refill
+    assert table.stats()['throttled']['put_item'] > 0
+    assert fake_time.now > 0.5
+    assert len(table.items) == 8
+
+def test_consumed_capacity():
+    table = Resource().Table('test-table')
+    big = {'id': 'u1', 'attributes': {'history': 'x' * 3000}}
+
+    response = table.put_item(Item=big, ReturnConsumedCapacity='TOTAL')
+    assert response['ConsumedCapacity'] == {'TableName': 'test-table',
+                                            'CapacityUnits': 3}
+    response = table.get_item(Key={'id': 'u1'}, ReturnConsumedCapacity='TOTAL')
+    assert response['ConsumedCapacity']['CapacityUnits'] == 0.5
+    response = table.get_item(Key={'id': 'u1'}, ConsistentRead=True,
+                              ReturnConsumedCapacity='TOTAL')
+    assert response['ConsumedCapacity']['CapacityUnits'] == 1
+    assert 'ConsumedCapacity' not in table.get_item(Key={'id': 'u1'})
+
+    assert table.stats()['consumed'] == {'write': 3, 'read': 2}
+
+def test_item_size():
+    assert item_size({'id': 'abc'}) == 5
+    assert item_size({'n': 12345}) == 1 + 4
+    assert item_size({'m': {'a': True, 'b': [1, None]}}) == \
+        1 + 3 + (1 + 1 + 1) + (1 + 3 + 2 + 1 + 1 + 1 + 1)
+
+def test_concurrent_updates():
+    table = Resource().Table('test-table')
+
+    def add():
+        for _ in range(200):
+            table.update_item(Key={'id': 'counter'},
+                              UpdateExpression='ADD #n :one',
+                              ExpressionAttributeNames={'#n': 'n'},
+                              ExpressionAttributeValues={':one': 1})
+
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert table.get_item(Key={'id': 'counter'})['Item']['n'] == 800
@@ -1,12 +1,24 @@
+import copy
+import importlib
+import json
+import logging
+import random
+import threading
+
+from ask_sdk_core.response_helper import ResponseFactory
+from ask_sdk_model import Directive
 import jmespath
 import pytest
 
+import core # the one main imports, unlike src.core
 from src.functions.skill import main
+from tests import test_utils
+from . import local_dynamodb
 from .fixtures import ( # pylint: disable=unused-import
     dynamodb_client, launch_request, session_ended_request,
     did_select_operation_intent, did_select_difficulty_intent,
     did_answer_intent_correct, did_answer_intent_wrong,
-    build_intent_event, unhandled_intent
+    build_intent_event, unhandled_intent, load_event, mock_dynamodb_client
 )
 
 
@@ -28,6 +40,18 @@ def assert_has_apl(result):
 def assert_keypath(path, data, value):
     assert jmespath.search(path, data) == value
 
+def assert_session(data, **fields):
+    # session attributes are compact on the wire, compare them decoded
+    usage = main.models.SkillUsage.from_attributes(data['sessionAttributes'])
+    for name, value in fields.items():
+        if name in main.models.SESSION_DATA_KEYS:
+            actual = getattr(usage.session_data, name)
+        else:
+            actual = getattr(usage, name)
+        if isinstance(actual, main.models.Operation):
+            actual = actual.value
+        assert actual == value, name
+
 #
 # tests
 #
@@ -37,14 +61,10 @@ def test_launch_request_handler(launch_request):
 
     assert isinstance(r, dict)
     # TODO: could this be wrapped in a with statement? is it worth it?
-    assert_keypath('sessionAttributes.launch_count', r, 0)
-    assert_keypath('sessionAttributes.previous_session_end', r, 0)
-    assert_keypath('sessionAttributes.session_data.operation', r, None)
-    assert_keypath('sessionAttributes.session_data.difficulty', r, None)
-    assert_keypath('sessionAttributes.session_data.correct_result', r, 0)
-    assert_keypath('sessionAttributes.session_data.questions_count', r, 0)
-    assert_keypath('sessionAttributes.session_data.correct_answers_count', r, 0)
-    assert_keypath('sessionAttributes.session_data.streak_count', r, 0)
+    assert_session(r, launch_count=0, previous_session_end=0,
+                   operation=None, difficulty=None, correct_result=0,
+                   questions_count=0, correct_answers_count=0,
+                   streak_count=0)
     assert_keypath('response.directives', r, None)
 
 def test_session_ended_request_handler(session_ended_request):
@@ -58,32 +78,30 @@ def test_did_select_operation_handler(did_select_operation_intent):
     r = main.sb.lambda_handler()(did_select_operation_intent, {})
 
     assert isinstance(r, dict)
-    assert_keypath('sessionAttributes.session_data.operation', r, 'add')
+    assert_session(r, operation='add')
     assert_keypath('response.directives', r, None)
 
 def test_did_select_difficulty_handler(did_select_difficulty_intent):
     r = main.sb.lambda_handler()(did_select_difficulty_intent, {})
 
     assert isinstance(r, dict)
-    assert_keypath('sessionAttributes.session_data.difficulty', r, 3)
+    assert_session(r, difficulty=3)
     assert_has_apl(r)
 
 def test_did_answer_handler_correct_answer(did_answer_intent_correct):
     r = main.sb.lambda_handler()(did_answer_intent_correct, {})
 
     assert isinstance(r, dict)
-    assert_keypath('sessionAttributes.session_data.questions_count', r, 1)
-    assert_keypath('sessionAttributes.session_data.correct_answers_count', r, 1)
-    assert_keypath('sessionAttributes.session_data.streak_count', r, 1)
+    assert_session(r, questions_count=1, correct_answers_count=1,
+                   streak_count=1)
     assert_has_apl(r)
 
 def test_did_answer_handler_wrong_answer(did_answer_intent_wrong):
     r = main.sb.lambda_handler()(did_answer_intent_wrong, {})
 
     assert isinstance(r, dict)
-    assert_keypath('sessionAttributes.session_data.questions_count', r, 1)
-    assert_keypath('sessionAttributes.session_data.correct_answers_count', r, 0)
-    assert_keypath('sessionAttributes.session_data.streak_count', r, 0)
+    assert_session(r, questions_count=1, correct_answers_count=0,
+                   streak_count=0)
     assert_has_apl(r)
 
 @pytest.mark.parametrize('intent_name', ['AMAZON.HelpIntent',
@@ -111,8 +129,418 @@ def test_early_stop(intent_name):
     assert_keypath('response.shouldEndSession', r, True)
     assert_keypath('response.directives', r, None)
 
+@pytest.mark.parametrize('intent_name', ['AMAZON.StopIntent',
+                                         'AMAZON.CancelIntent'])
+def test_stop_followed_by_session_end(intent_name, dynamodb_client):
+    intent_event = build_intent_event(intent_name)
+    r = main.sb.lambda_handler()(intent_event, {})
+    assert_keypath('sessionAttributes.persisted', r, True)
+
+    session_ended = load_event('session_ended_request')
+    session_ended['session']['attributes'] = r['sessionAttributes']
+    main.sb.lambda_handler()(session_ended, {})
+
+    table = dynamodb_client.Table()
+    assert table.put_item.call_count + table.update_item.call_count == 1
+
+def test_persistence_under_throttling(launch_request):
+    # the client's retries absorb throttled reads and writes
+    client = mock_dynamodb_client(throttle_rate=0.5, seed=3,
+                                  sleep=lambda seconds: None)
+    main.sb.dynamodb_client = client
+    for launch_count in [1, 2, 3]:
+        r = main.handler(copy.deepcopy(launch_request), {})
+        assert_session(r, launch_count=launch_count - 1)
+        session_ended = load_event('session_ended_request')
+        session_ended['session']['attributes'] = r['sessionAttributes']
+        main.handler(session_ended, {})
+
+    stats = client.local_table.stats()
+    assert sum(stats['throttled'].values()) > 0
+    item, = client.local_table.items.values()
+    assert item['attributes']['launch_count'] == 3
+
+@pytest.fixture
+def with_global_stats(monkeypatch):
+    monkeypatch.setattr(main, 'GLOBAL_STATS', True)
+    # a fresh one, with nothing cached
+    monkeypatch.setattr(main, 'stats',
+                        main.global_stats.GlobalStats(main.skill_table))
+
+def test_global_stats(with_global_stats, did_select_difficulty_intent): # pylint: disable=redefined-outer-name,unused-argument
+    r = main.handler(did_select_difficulty_intent, {})
+    for offset in [0, 0, 1, 0]:
+        usage = main.models.SkillUsage.from_attributes(r['sessionAttributes'])
+        event = load_event('did_answer_correct')
+        event['session']['attributes'] = r['sessionAttributes']
+        event['request']['intent']['slots']['answer']['value'] = \
+            str(main.content.asked_question(usage)[2] + offset)
+        r = main.handler(event, {})
+    assert_session(r, streak_count=1, best_streak=2)
+    session_ended = load_event('session_ended_request')
+    session_ended['session']['attributes'] = r['sessionAttributes']
+    main.handler(session_ended, {})
+
+    assert main.handler({'rollup': True}, {}) == {'rollup': True}
+    assert main.stats.questions() == 4
+    (_, best_streak), = main.stats.leaderboard()
+    assert best_streak == 2
+
+def test_global_stats_failure(with_global_stats, monkeypatch, caplog, # pylint: disable=redefined-outer-name,unused-argument
+                              session_ended_request):
+    def fail(*_args):
+        raise RuntimeError('throttled')
+    monkeypatch.setattr(main.stats, 'record_session', fail)
+    caplog.set_level(logging.INFO)
+
+    main.handler(session_ended_request, {})
+
+    events = [log['event'] for log in test_utils.load_log_events(caplog)]
+    assert 'recording global stats failed' in events
+    assert 'handler exception' not in events
+
+def test_answer_history(did_select_difficulty_intent, dynamodb_client):
+    r = main.sb.lambda_handler()(did_select_difficulty_intent, {})
+    usage = main.models.SkillUsage.from_attributes(r['sessionAttributes'])
+
+    for offset in [0, 1]: # a correct answer, then a wrong one
+        answer = main.content.asked_question(usage)[2] + offset
+        event = load_event('did_answer_correct')
+        event['session']['attributes'] = r['sessionAttributes']
+        event['request']['intent']['slots']['answer']['value'] = str(answer)
+        r = main.sb.lambda_handler()(event, {})
+        usage = main.models.SkillUsage.from_attributes(r['sessionAttributes'])
+
+    stop = build_intent_event('AMAZON.StopIntent')
+    stop['session']['attributes'] = r['sessionAttributes']
+    main.sb.lambda_handler()(stop, {})
+
+    table = dynamodb_client.Table()
+    item = table.put_item.call_args[1]['Item']
+    history = main.models.History(item['attributes']['history'])
+    assert [exercise.correct for exercise in history] == [True, False]
+    for exercise in history:
+        assert exercise.operation.value == 'add'
+        assert exercise.op1 and exercise.op2
+
+    # difficulty 3 ("hard") facts aren't tracked for mastery
+    assert item['attributes']['mastery'] is None
+
+def test_mastery_is_read_once_and_merged(did_select_difficulty_intent,
+                                         dynamodb_client):
+    stored = main.models.SkillUsage()
+    stored.mastery.set('add1', 4, 100)
+    stored.mastery.set('sub1', 2, 55)
+    stored.history.append(main.models.Operation.SUB, 9, 2, True, 1539255600)
+    user_id = did_select_difficulty_intent['context']['System']['user']['userId']
+    dynamodb_client.local_table.items[user_id] = {
+        'id': user_id, 'attributes': main.models.asdict(stored)}
+
+    did_select_difficulty_intent['request']['intent']['slots']['difficulty']\
+        ['value'] = 'easy'
+    r = main.sb.lambda_handler()(did_select_difficulty_intent, {})
+    # only the mastery of the facts asked
+    assert r['sessionAttributes']['k'] == {'add1': stored.mastery.encode()['add1']}
+
+    usage = main.models.SkillUsage.from_attributes(r['sessionAttributes'])
+    op1, op2, result = main.content.asked_question(usage)
+    answer = result + 1 # wrong
+    # the missed fact may be asked again, weighted as it is
+    main.exercises.record_answer(stored.mastery, main.models.Operation.ADD,
+                                 1, op1, op2, False)
+    event = load_event('did_answer_correct')
+    event['session']['attributes'] = r['sessionAttributes']
+    event['request']['intent']['slots']['answer']['value'] = str(answer)
+    r = main.sb.lambda_handler()(event, {})
+    assert len(json.dumps(r['sessionAttributes'])) < 150
+
+    stop = build_intent_event('AMAZON.StopIntent')
+    stop['session']['attributes'] = r['sessionAttributes']
+    main.sb.lambda_handler()(stop, {})
+
+    # read when the difficulty was selected and when the session ended
+    assert dynamodb_client.Table().get_item.call_count == 2
+    attributes = dynamodb_client.local_table.items[user_id]['attributes']
+    usage = main.models.SkillUsage.from_attributes(attributes)
+    assert usage.mastery == stored.mastery
+    assert [e.operation.value for e in usage.history] == ['sub', 'add']
+    assert not attributes['session_data']['mastery']
+
+def test_questions_derive_from_seed(did_select_difficulty_intent):
+    r = main.sb.lambda_handler()(did_select_difficulty_intent, {})
+    attributes = r['sessionAttributes']
+    # only the seed, neither the result nor the operands
+    assert 'e' in attributes
+    assert not {'r', 'a', 'b'} & attributes.keys()
+
+    for questions_count in [1, 2]:
+        usage = main.models.SkillUsage.from_attributes(attributes)
+        answer = main.content.asked_question(usage)[2]
+        event = load_event('did_answer_correct')
+        event['session']['attributes'] = attributes
+        event['request']['intent']['slots']['answer']['value'] = str(answer)
+        r = main.sb.lambda_handler()(event, {})
+        attributes = r['sessionAttributes']
+        assert_session(r, questions_count=questions_count,
+                       correct_answers_count=questions_count,
+                       seed=usage.session_data.seed)
+
+def test_operation_change_asks_again(did_select_difficulty_intent,
+                                     did_select_operation_intent):
+    did_select_difficulty_intent['request']['intent']['slots']['difficulty']\
+        ['value'] = 'normal'
+    r = main.sb.lambda_handler()(did_select_difficulty_intent, {})
+
+    # mid-question
+    did_select_operation_intent['session']['attributes'] = \
+        r['sessionAttributes']
+    did_select_operation_intent['request']['intent']['slots']['operation']\
+        ['value'] = 'multiplication'
+    r = main.sb.lambda_handler()(did_select_operation_intent, {})
+    usage = main.models.SkillUsage.from_attributes(r['sessionAttributes'])
+    op1, op2, result = main.content.asked_question(usage)
+    assert usage.session_data.operation == main.models.Operation.MUL
+    # the question asked is the one the answer is checked against
+    ssml = r['response']['outputSpeech']['ssml']
+    assert f'{op1}' in ssml and f'{op2}' in ssml
+    assert result == op1 * op2
+
+    event = load_event('did_answer_correct')
+    event['session']['attributes'] = r['sessionAttributes']
+    event['request']['intent']['slots']['answer']['value'] = str(result)
+    r = main.sb.lambda_handler()(event, {})
+    assert_session(r, correct_answers_count=1)
+
+def test_legacy_session_gets_seed(did_answer_intent_correct):
+    # a session from before the seed, with the result stored
+    r = main.sb.lambda_handler()(did_answer_intent_correct, {})
+
+    assert_session(r, correct_answers_count=1, correct_result=0)
+    assert r['sessionAttributes']['e'] is not None
+
+def test_missed_fact_is_marked(did_answer_intent_wrong):
+    did_answer_intent_wrong['session']['attributes'] = {
+        'v': 1, 'o': 'mul', 'd': 2, 'r': 56, 'a': 7, 'b': 8}
+    did_answer_intent_wrong['request']['intent']['slots']['answer']['value'] = '54'
+
+    r = main.sb.lambda_handler()(did_answer_intent_wrong, {})
+
+    usage = main.models.SkillUsage.from_attributes(r['sessionAttributes'])
+    index = main.exercises.pool(usage.session_data.operation, 2).index_of(7, 8)
+    mastery = usage.session_data.mastery
+    assert mastery.count('mul2') == 1
+    assert mastery.test('mul2', index)
+
 def test_response_with_help_message_on_exception(unhandled_intent):
     r = main.sb.lambda_handler()(unhandled_intent, {})
 
     assert isinstance(r, dict)
     assert_keypath('response.directives', r, None)
+
+def test_handler(did_select_difficulty_intent):
+    r = main.handler(did_select_difficulty_intent, {})
+
+    assert isinstance(r, dict)
+    assert_session(r, difficulty=3)
+    assert_has_apl(r)
+
+@pytest.fixture
+def sdk_responses(monkeypatch):
+    # has main build its responses the SDK's way, to compare against
+    def response_dict(message, question=None, directives=()):
+        factory = ResponseFactory()
+        factory.speak(message).ask(question or message)
+        for directive in directives:
+            factory.add_directive(main.serializer.deserialize(
+                json.dumps(directive), Directive))
+        return factory.response
+
+    main.constant_response.cache_clear()
+    monkeypatch.setattr(main.utils, 'response_dict', response_dict)
+    yield
+    monkeypatch.undo()
+    main.constant_response.cache_clear()
+
+@pytest.mark.parametrize('event_fixture', ['did_answer_intent_correct',
+                                           'did_answer_intent_wrong',
+                                           'unhandled_intent'])
+@pytest.mark.parametrize('apl', [True, False])
+def test_fast_responses_match_sdk(request, monkeypatch, event_fixture, apl):
+    event = request.getfixturevalue(event_fixture)
+    if not apl:
+        interfaces = event['context']['System']['device']['supportedInterfaces']
+        interfaces.pop('Alexa.Presentation.APL', None)
+    monkeypatch.setattr(main.time, 'time', lambda: 1539255600)
+
+    def invoke():
+        random.seed(7)
+        return json.dumps(main.handler(copy.deepcopy(event), {}))
+
+    fast = invoke()
+    request.getfixturevalue('sdk_responses')
+    assert fast == invoke()
+
+@pytest.mark.parametrize('intent_name', ['AMAZON.HelpIntent',
+                                         'AMAZON.FallbackIntent'])
+def test_help_response_matches_sdk(request, intent_name):
+    event = build_intent_event(intent_name)
+    fast = json.dumps(main.handler(event, {}))
+    # the cached response, the second time
+    assert json.dumps(main.handler(event, {})) == fast
+
+    request.getfixturevalue('sdk_responses')
+    assert json.dumps(main.handler(event, {})) == fast
+
+@pytest.mark.parametrize('event_fixture', ['launch_request',
+                                           'did_select_operation_intent',
+                                           'did_select_difficulty_intent',
+                                           'did_answer_intent_correct',
+                                           'session_ended_request',
+                                           'unhandled_intent'])
+def test_lazy_envelope_mode(request, monkeypatch, event_fixture):
+    event = request.getfixturevalue(event_fixture)
+    monkeypatch.setattr(main.time, 'time', lambda: 1539255600)
+
+    def invoke():
+        random.seed(7)
+        main.sb.dynamodb_client = mock_dynamodb_client()
+        return json.dumps(main.handler(copy.deepcopy(event), {}))
+
+    expected = invoke()
+    monkeypatch.setattr(main, 'LAZY_ENVELOPE', True)
+    assert invoke() == expected
+
+def test_warm_up(caplog, dynamodb_client):
+    caplog.set_level(logging.INFO)
+    core.metrics.flush() # of the tests not going through main.handler
+    caplog.clear()
+
+    assert main.handler({'warmup': True}, None) == {'warmup': True}
+
+    table = dynamodb_client.Table.return_value
+    table.get_item.assert_called_once_with(Key={'id': main.WARMUP_ITEM_ID})
+    # not an invocation, nothing to log
+    assert test_utils.load_log_events(caplog) == []
+
+def test_warm_up_failure(caplog, dynamodb_client):
+    table = dynamodb_client.Table.return_value
+    table.get_item.side_effect = RuntimeError('no connection')
+    caplog.set_level(logging.INFO)
+    core.metrics.flush()
+    caplog.clear()
+
+    assert main.handler({'warmup': True}, None) == {'warmup': True}
+    log, = test_utils.load_log_events(caplog)
+    assert log['event'] == 'warm up failed'
+
+def test_lazy_init_mode(monkeypatch, dynamodb_client, launch_request):
+    monkeypatch.setenv('LAZY_INIT', 'true')
+    lazy_main = importlib.reload(main)
+    try:
+        assert isinstance(lazy_main.sb, lazy_main.LazySkillBuilder)
+        lazy_main.sb.dynamodb_client = dynamodb_client
+
+        r = lazy_main.handler(launch_request, {})
+        assert_session(r, launch_count=0)
+        assert lazy_main.get_skill() is lazy_main.get_skill()
+    finally:
+        monkeypatch.undo()
+        importlib.reload(main)
+
+@pytest.fixture
+def async_main(monkeypatch):
+    monkeypatch.setenv('LAZY_INIT', 'true')
+    monkeypatch.setenv('ASYNC_IO', 'true')
+    async_main = importlib.reload(main)
+    yield async_main
+    async_main.sb.persistence_adapter.executor.shutdown()
+    monkeypatch.undo()
+    importlib.reload(main)
+
+def test_async_io_mode(async_main, launch_request): # pylint: disable=redefined-outer-name
+    client = mock_dynamodb_client(latency=local_dynamodb.constant(0.01))
+    async_main.sb.dynamodb_client = client
+
+    for launch_count in [0, 1]:
+        r = async_main.handler(copy.deepcopy(launch_request), {})
+        assert_session(r, launch_count=launch_count)
+        stop = build_intent_event('AMAZON.StopIntent')
+        stop['session']['attributes'] = r['sessionAttributes']
+        stop['context'] = launch_request['context']
+        async_main.handler(stop, {})
+        # written by the time the handler returned
+        item, = client.local_table.items.values()
+        assert item['attributes']['launch_count'] == launch_count + 1
+
+    table = client.Table()
+    # prefetched, read once by each launch and stop
+    assert table.get_item.call_count == 4
+    assert not async_main.sb.persistence_adapter._reads # pylint: disable=protected-access
+
+def test_async_io_global_stats(async_main, monkeypatch, session_ended_request): # pylint: disable=redefined-outer-name
+    async_main.sb.dynamodb_client = mock_dynamodb_client()
+    monkeypatch.setattr(async_main, 'GLOBAL_STATS', True)
+    threads = []
+    monkeypatch.setattr(async_main.stats, 'record_session',
+                        lambda *_args: threads.append(threading.current_thread()))
+
+    async_main.handler(session_ended_request, {})
+    # recorded by the time the handler returned, off the main thread
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
+
+@pytest.mark.parametrize('event_name, slot, attributes, expected', [
+    ('did_select_difficulty', 'hard', {'v': 1, 'o': 'add'}, False),
+    ('did_select_difficulty', 'easy', {'v': 1, 'o': 'add'}, True),
+    ('did_select_difficulty', 'easy',
+     {'v': 1, 'o': 'add', 'k': {'add1': ''}}, False),
+    ('did_select_operation', 'addition', {}, False),
+    ('did_select_operation', 'addition', {'v': 1, 'd': 2}, True),
+    ('did_select_operation', 'modulo', {'v': 1, 'd': 2}, False),
+])
+def test_reads_persistent_attributes(event_name, slot, attributes, expected):
+    # prefetched only if the mastery will be loaded
+    event = load_event(event_name)
+    event['session']['attributes'] = attributes
+    slot_name = 'difficulty' if event_name == 'did_select_difficulty' \
+        else 'operation'
+    event['request']['intent']['slots'][slot_name]['value'] = slot
+    assert main.reads_persistent_attributes(event) is expected
+
+def test_async_io_write_failure(async_main, caplog): # pylint: disable=redefined-outer-name
+    client = mock_dynamodb_client()
+    client.Table().put_item.side_effect = RuntimeError('throttled')
+    async_main.sb.dynamodb_client = client
+    core.metrics.flush()
+    caplog.clear()
+    caplog.set_level(logging.INFO)
+
+    r = async_main.handler(build_intent_event('AMAZON.StopIntent'), {})
+
+    # handled by global_exception_handler
+    assert_keypath('response.shouldEndSession', r, False)
+    log, = [log for log in test_utils.load_log_events(caplog)
+            if log['event'] == 'metrics']
+    assert log['error'] == 'PersistenceException'
+    assert log['persistence_wait'] >= 0
+
+@pytest.mark.parametrize('event_fixture, intent, phases', [
+    ('launch_request', 'LaunchRequest', ['persistence_read']),
+    ('did_answer_intent_correct', 'DidAnswer', []),
+    ('session_ended_request', 'SessionEndedRequest', ['persistence_write'])
+])
+def test_handler_metrics(request, caplog, event_fixture, intent, phases):
+    event = request.getfixturevalue(event_fixture)
+    core.metrics.flush() # of the tests not going through main.handler
+    caplog.clear()
+    caplog.set_level(logging.INFO)
+
+    main.handler(event, {})
+
+    log, = [log for log in test_utils.load_log_events(caplog)
+            if log['event'] == 'metrics']
+    assert log['intent'] == intent
+    for phase in ['deserialize', 'dispatch', 'handler', 'serialize',
+                  'total'] + phases:
+        assert log[phase] >= 0
+    assert log['total'] >= log['handler']
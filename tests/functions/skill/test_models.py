@@ -1,10 +1,11 @@
 # pylint: disable=no-self-use,no-member
 
+import json
 import time
 
 import pytest
 
-from src.functions.skill import models
+from src.functions.skill import exercises, models
 
 
 class TestOperation:
@@ -32,6 +33,13 @@ class TestOperation:
         assert Op.MUL.as_verb(locale) == 'times'
         assert Op.DIV.as_verb(locale) == 'divided by'
 
+    def test_from_value(self):
+        Op = models.Operation
+        assert models.to_operation('div') is Op.DIV
+        assert models.to_operation(Op.DIV) is Op.DIV
+        assert models.to_operation(None) is None
+        assert models.to_operation('') is None
+
     def test_as_symbol(self):
         Op = models.Operation
         assert Op.ADD.as_symbol() == '+'
@@ -118,7 +126,173 @@ class TestSkillUsage:
 
         assert skill_usage.is_new_session() == expected
 
-@pytest.mark.skip(reason='currently no way how to dumps Operation as str')
+    def test_is_new_session_at(self):
+        skill_usage = models.SkillUsage.from_attributes(
+            {'session_data': {'operation': 'sub'},
+             'previous_session_end': 1539255600})
+
+        assert not skill_usage.is_new_session(now=1539255600 + 60)
+        assert skill_usage.is_new_session(
+            now=1539255600 + models.STALE_SESSION_THRESHOLD)
+
+    @pytest.mark.parametrize('attributes', [
+        None,
+        {'launch_count': 4},
+        {'previous_session_end': 1539255600,
+         'session_data': {'operation': 'mul',
+                          'difficulty': 2,
+                          'correct_result': 12,
+                          'questions_count': 9,
+                          'correct_answers_count': 7,
+                          'streak_count': 2},
+         'launch_count': 4}
+    ])
+    def test_session_attributes_roundtrip(self, attributes):
+        skill_usage = models.SkillUsage.from_attributes(attributes)
+        encoded = skill_usage.to_session_attributes()
+
+        assert encoded['v'] == models.SESSION_FORMAT_VERSION
+        assert models.SkillUsage.from_attributes(encoded) == skill_usage
+        assert len(json.dumps(encoded)) < \
+            len(json.dumps(models.asdict(skill_usage), default=str))
+
+    def test_dict_roundtrip(self):
+        attributes = {'launch_count': 4,
+                      'previous_session_end': 1539255600,
+                      'session_data': {'operation': 'sub',
+                                       'difficulty': None,
+                                       'correct_result': 1,
+                                       'questions_count': 2,
+                                       'correct_answers_count': 1,
+                                       'streak_count': 0,
+                                       'best_streak': 1,
+                                       'op1': 4,
+                                       'op2': 3,
+                                       'seed': 1234567,
+                                       'answers': None,
+                                       'mastery': None},
+                      'history': None,
+                      'mastery': None}
+        skill_usage = models.SkillUsage.from_attributes(attributes)
+        assert skill_usage.to_dict() == attributes
+
+    def test_slots(self):
+        skill_usage = models.SkillUsage(session_data=models.SessionData())
+        assert not hasattr(skill_usage, '__dict__')
+        assert not hasattr(skill_usage.session_data, '__dict__')
+
+    def test_session_attributes_leave_out_defaults(self):
+        encoded = models.SkillUsage().to_session_attributes()
+        assert encoded == {'v': models.SESSION_FORMAT_VERSION}
+
+    def test_history_passes_through_undecoded(self):
+        history = models.History()
+        history.append(models.Operation.ADD, 1, 2, True, 1539255600)
+        attributes = {'launch_count': 1, 'history': history.encode()}
+
+        skill_usage = models.SkillUsage.from_attributes(attributes)
+
+        assert skill_usage.to_dict()['history'] is attributes['history']
+        assert skill_usage.history._buffer is None # pylint: disable=protected-access
+        assert list(skill_usage.history) == list(history)
+
+    def test_session_attributes_size(self):
+        # a user with a full history and mastery of every fact space,
+        # in the middle of a session
+        Op = models.Operation
+        skill_usage = models.SkillUsage(launch_count=40,
+                                        previous_session_end=1539255600)
+        for i in range(models.HISTORY_SIZE):
+            skill_usage.history.append(Op.ADD, i, i, False, 1539255600)
+        for operation in Op:
+            for difficulty in exercises.MASTERY_DIFFICULTIES:
+                pool = exercises.pool(operation, difficulty)
+                skill_usage.mastery.set(
+                    exercises.mastery_key(operation, difficulty), 0, pool.size)
+        session_data = models.SessionData(operation='mul', difficulty=2,
+                                          questions_count=10, seed=1234567)
+        session_data.mastery.load(skill_usage.mastery, 'mul2')
+        for i in range(10):
+            session_data.answers.append(Op.MUL, i, 7, True, 1539255600 + i)
+        skill_usage.session_data = session_data
+
+        encoded = skill_usage.to_session_attributes()
+        # neither the history nor the mastery of other fact spaces
+        assert not {'h', 'm'} & encoded.keys()
+        assert list(encoded['k']) == ['mul2']
+        # the session's answers and mastery of mul2 (115 bytes) included
+        assert len(json.dumps(encoded)) < 400
+        assert len(json.dumps(models.asdict(skill_usage))) > 1500
+
+        decoded = models.SkillUsage.from_attributes(encoded)
+        assert decoded.session_data == session_data
+        assert not decoded.history and not decoded.mastery
+
+    def test_end_session(self):
+        Op = models.Operation
+        stored = models.SkillUsage()
+        stored.history.append(Op.ADD, 1, 2, True, 1539255600)
+        stored.mastery.set('add1', 3, 100)
+        stored.mastery.set('mul2', 5, 900)
+
+        session_data = models.SessionData(operation='mul', difficulty=2)
+        session_data.mastery.load(stored.mastery, 'mul2')
+        session_data.mastery.load(stored.mastery, 'sub1') # none yet
+        session_data.mastery.set('mul2', 5, 900, False)
+        session_data.mastery.set('mul2', 6, 900)
+        session_data.answers.append(Op.MUL, 2, 3, False, 1539255601)
+        skill_usage = models.SkillUsage(session_data=session_data)
+
+        skill_usage.end_session(stored)
+        assert [exercise.op1 for exercise in skill_usage.history] == [1, 2]
+        mastery = skill_usage.mastery
+        assert mastery.test('add1', 3)
+        assert not mastery.test('mul2', 5) and mastery.test('mul2', 6)
+        assert 'sub1' not in mastery
+        # not persisted twice
+        assert skill_usage.to_dict()['session_data']['answers'] is None
+        assert skill_usage.to_dict()['session_data']['mastery'] is None
+
+    def test_rebase(self):
+        Op = models.Operation
+        stored = models.SkillUsage(launch_count=3,
+                                   previous_session_end=1539255600)
+        stored.history.append(Op.ADD, 1, 2, True, 1539255500)
+        stored.mastery.set('add1', 3, 100)
+
+        # a session ended on this container...
+        usage = models.SkillUsage.from_attributes(models.asdict(stored))
+        usage.launch_count += 1
+        usage.previous_session_end = 1539255700
+        usage.session_data = models.SessionData(operation='mul')
+        usage.history.append(Op.MUL, 2, 3, False, 1539255650)
+        usage.mastery.set('mul2', 5, 900)
+        # ...and one on another, saved first
+        current = models.SkillUsage.from_attributes(models.asdict(stored))
+        current.launch_count += 1
+        current.previous_session_end = 1539255690
+        current.history.append(Op.SUB, 5, 4, True, 1539255640)
+        current.mastery.set('add1', 3, 100, False)
+
+        rebased = models.SkillUsage.from_attributes(models.rebase(
+            models.asdict(stored), models.asdict(usage),
+            models.asdict(current)))
+        assert rebased.launch_count == 5
+        assert rebased.previous_session_end == 1539255700
+        assert rebased.session_data.operation == Op.MUL
+        assert [e.op1 for e in rebased.history] == [1, 5, 2]
+        assert not rebased.mastery.test('add1', 3)
+        assert rebased.mastery.test('mul2', 5)
+
+    @pytest.mark.parametrize('attributes', [
+        {'session_data': {'operation': 'add', 'difficulty': 0}},
+        {'v': 1, 'o': 'add'}
+    ])
+    def test_session_data_value(self, attributes):
+        assert models.session_data_value(attributes, 'operation') == 'add'
+        assert not models.session_data_value(attributes, 'difficulty')
+        assert models.session_data_value(attributes, 'streak_count') is None
+
 def test_serialization():
     attributes = {
         'launch_count': 23,
@@ -138,3 +312,93 @@ def test_serialization():
 
     assert isinstance(su.session_data.operation, models.Operation)
     assert isinstance(as_dict['session_data']['operation'], str)
+
+
+class TestHistory:
+
+    def test_empty(self):
+        history = models.History()
+        assert not history
+        assert len(history) == 0
+        assert not list(history)
+        assert models.History(history.encode()) == history
+
+    def test_append(self):
+        Op = models.Operation
+        history = models.History()
+        history.append(Op.DIV, 1000, 100, False, 1539255600)
+        history.append(Op.SUB, 7, 3, True, 1539255601)
+
+        history = models.History(history.encode())
+        assert history
+        assert list(history) == [
+            models.Exercise(Op.DIV, 1000, 100, False, 1539255600),
+            models.Exercise(Op.SUB, 7, 3, True, 1539255601)]
+
+    def test_ring_buffer(self):
+        history = models.History()
+        sizes = set()
+
+        for i in range(3 * models.HISTORY_SIZE + 5):
+            history.append(models.Operation.MUL, i, i + 1, i % 2 == 0, i)
+            history = models.History(history.encode())
+            sizes.add(len(history.encode()))
+        # growing until it's full
+        assert len(sizes) == models.HISTORY_SIZE
+
+        exercises = list(history)
+        assert len(exercises) == models.HISTORY_SIZE
+        assert [e.op1 for e in exercises] == \
+            list(range(2 * models.HISTORY_SIZE + 5, 3 * models.HISTORY_SIZE + 5))
+        assert all(e.correct == (e.op1 % 2 == 0) for e in exercises)
+
+    def test_since(self):
+        Op = models.Operation
+        history = models.History()
+        assert history.since(models.History()) == []
+        for i in range(models.HISTORY_SIZE):
+            history.append(Op.ADD, i, i, True, 1539255600 + i)
+        before = models.History(history.encode())
+
+        history.append(Op.SUB, 1, 1, True, 1539255700)
+        history.append(Op.SUB, 2, 2, True, 1539255701)
+        assert [e.op1 for e in history.since(before)] == [1, 2]
+        assert history.since(history) == []
+        assert len(history.since(models.History())) == models.HISTORY_SIZE
+
+
+class TestBitsets:
+
+    def test_set_and_test(self):
+        bitsets = models.Bitsets()
+        assert not bitsets
+        assert bitsets.encode() is None
+
+        bitsets.set('add1', 0, 100)
+        bitsets.set('add1', 99, 100)
+        bitsets.set('add1', 99, 100) # no double counting
+        bitsets.set('sub1', 3, 55, False) # clearing creates nothing
+
+        bitsets = models.Bitsets(bitsets.encode())
+        assert bitsets.count('add1') == 2
+        assert bitsets.test('add1', 0) and bitsets.test('add1', 99)
+        assert not bitsets.test('add1', 50)
+        assert bitsets.count('sub1') == 0
+        assert not bitsets.test('sub1', 3)
+
+        bitsets.set('add1', 0, 100, False)
+        assert bitsets.count('add1') == 1
+        assert not bitsets.test('add1', 0)
+
+    def test_lazy_decoding(self):
+        bitsets = models.Bitsets()
+        bitsets.set('add1', 5, 100)
+        bitsets.set('mul2', 5, 900)
+        encoded = dict(bitsets.encode())
+
+        bitsets = models.Bitsets(encoded)
+        bitsets.set('add1', 6, 100)
+        new_encoded = dict(bitsets.encode())
+        assert new_encoded['mul2'] is encoded['mul2']
+        assert new_encoded['add1'] != encoded['add1']
+        assert list(bitsets._decoded) == ['add1'] # pylint: disable=protected-access
@@ -0,0 +1,457 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import sys
+import threading
+from unittest.mock import Mock
+
+from ask_sdk_core.exceptions import PersistenceException
+from ask_sdk_model import RequestEnvelope
+from botocore.exceptions import ClientError
+import pytest
+
+from src.functions.skill import models, persistence
+from tests import test_utils
+from .fixtures import ( # pylint: disable=unused-import
+    dynamodb_client, load_event, mock_dynamodb_client, serializer)
+from .local_dynamodb import constant
+
+
+@pytest.fixture
+def request_envelope():
+    return serializer.deserialize(load_event('launch_request', as_json=False),
+                                  RequestEnvelope)
+
+def test_user_id(request_envelope):
+    assert persistence.user_id(request_envelope) == \
+        request_envelope.context.system.user.user_id
+
+def test_round_trip(dynamodb_client, request_envelope):
+    adapter = persistence.SkillTableAdapter('test-table', dynamodb_client)
+
+    assert adapter.get_attributes(request_envelope) == {}
+    adapter.save_attributes(request_envelope, {'launch_count': 3})
+    assert adapter.get_attributes(request_envelope) == {'launch_count': 3}
+
+    dynamodb_client.Table.assert_called_once_with('test-table')
+
+def test_connects_lazily(monkeypatch, dynamodb_client, request_envelope):
+    boto3 = Mock()
+    boto3.session.Session.return_value.resource.return_value = dynamodb_client
+    monkeypatch.setitem(sys.modules, 'boto3', boto3)
+
+    adapter = persistence.SkillTableAdapter('test-table')
+    boto3.session.Session.assert_not_called()
+
+    adapter.get_attributes(request_envelope)
+    adapter.get_attributes(request_envelope)
+    boto3.session.Session.return_value.resource.assert_called_once_with(
+        'dynamodb')
+
+def test_resource_per_thread(monkeypatch):
+    boto3 = Mock()
+    boto3.session.Session.side_effect = Mock # a new session each time
+    monkeypatch.setitem(sys.modules, 'boto3', boto3)
+    adapter = persistence.SkillTableAdapter('test-table')
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other = executor.submit(lambda: adapter.table).result()
+        assert executor.submit(lambda: adapter.table).result() is other
+    table = adapter.table
+    assert adapter.table is table
+    assert table is not other
+    assert boto3.session.Session.call_count == 2
+
+def test_replacing_the_resource(dynamodb_client, request_envelope):
+    stale = Mock()
+    stale.Table.return_value.get_item.return_value = {}
+    adapter = persistence.SkillTableAdapter('test-table', stale)
+    adapter.get_attributes(request_envelope)
+
+    adapter.dynamodb = dynamodb_client
+    adapter.save_attributes(request_envelope, {'launch_count': 1})
+    assert adapter.get_attributes(request_envelope) == {'launch_count': 1}
+
+@pytest.mark.parametrize('method, args', [
+    ('get_attributes', ()),
+    ('save_attributes', ({},)),
+    ('delete_attributes', ())
+])
+def test_errors_are_wrapped(request_envelope, method, args):
+    table = Mock()
+    for operation in ['get_item', 'put_item', 'delete_item']:
+        getattr(table, operation).side_effect = RuntimeError('throttled')
+    resource = Mock()
+    resource.Table.return_value = table
+    adapter = persistence.SkillTableAdapter('test-table', resource)
+
+    with pytest.raises(PersistenceException):
+        getattr(adapter, method)(request_envelope, *args)
+
+def test_diff():
+    old = {'launch_count': 3,
+           'session_data': {'operation': 'add', 'streak_count': 2},
+           'gone': 1}
+    new = {'launch_count': 4,
+           'session_data': {'operation': 'add', 'streak_count': 0,
+                            'difficulty': 2},
+           'fresh': None}
+
+    changes = dict(persistence.diff(old, new))
+    assert changes == {('launch_count',): 4,
+                       ('session_data', 'streak_count'): 0,
+                       ('session_data', 'difficulty'): 2,
+                       ('fresh',): None,
+                       ('gone',): persistence.REMOVED}
+    assert not list(persistence.diff(new, new))
+
+def test_update_expression():
+    expression, condition, names, values = persistence.update_expression([
+        (('attributes', 'launch_count'), 4),
+        (('attributes', 'session_data', 'streak_count'), 0),
+        (('attributes', 'gone'), persistence.REMOVED)
+    ], [
+        (('attributes', 'launch_count'), 3),
+        (('attributes', 'fresh'), persistence.REMOVED)
+    ])
+
+    assert expression == 'SET #n0.#n1 = :v0, #n0.#n2.#n3 = :v1 REMOVE #n0.#n4'
+    assert condition == '#n0.#n1 = :v2 AND attribute_not_exists(#n0.#n5)'
+    assert names == {'#n0': 'attributes', '#n1': 'launch_count',
+                     '#n2': 'session_data', '#n3': 'streak_count',
+                     '#n4': 'gone', '#n5': 'fresh'}
+    assert values == {':v0': 4, ':v1': 0, ':v2': 3}
+
+def test_lookup():
+    attributes = {'session_data': {'operation': 'add'}}
+    assert persistence.lookup(attributes, ('session_data', 'operation')) \
+        == 'add'
+    assert persistence.lookup(attributes, ('session_data', 'difficulty')) \
+        is persistence.REMOVED
+    assert persistence.lookup(attributes, ('session_data', 'operation', 'x')) \
+        is persistence.REMOVED
+
+class TestDeltaWrites:
+
+    @pytest.fixture
+    def table(self, dynamodb_client):
+        return dynamodb_client.Table()
+
+    @pytest.fixture
+    def adapter(self, dynamodb_client):
+        return persistence.SkillTableAdapter('test-table', dynamodb_client)
+
+    attributes = {'launch_count': 1,
+                  'previous_session_end': 1539255600,
+                  'session_data': {'operation': 'add', 'streak_count': 2}}
+
+    def test_unknown_item_is_put(self, adapter, table, request_envelope):
+        adapter.save_attributes(request_envelope, self.attributes)
+
+        table.put_item.assert_called_once()
+        table.update_item.assert_not_called()
+
+    def test_unchanged_item_is_not_written(self, adapter, table,
+                                           request_envelope):
+        adapter.save_attributes(request_envelope, self.attributes)
+        adapter.save_attributes(request_envelope, dict(self.attributes))
+
+        assert table.put_item.call_count == 1
+        table.update_item.assert_not_called()
+
+    def test_only_changed_fields_are_updated(self, adapter, table,
+                                             request_envelope):
+        table.put_item(Item={'id': persistence.user_id(request_envelope),
+                             'attributes': self.attributes})
+        table.put_item.reset_mock()
+        adapter.get_attributes(request_envelope)
+
+        changed = {'launch_count': 2,
+                   'previous_session_end': 1539255600,
+                   'session_data': {'operation': 'add', 'streak_count': 0}}
+        adapter.save_attributes(request_envelope, changed)
+
+        table.put_item.assert_not_called()
+        kwargs = table.update_item.call_args[1]
+        # the new values, then the remembered ones they must replace
+        assert kwargs['ExpressionAttributeValues'] == \
+            {':v0': 2, ':v1': 0, ':v2': 1, ':v3': 2}
+        assert adapter.get_attributes(request_envelope) == changed
+
+    def test_missing_item_is_put(self, adapter, table, request_envelope):
+        assert adapter.get_attributes(request_envelope) == {}
+        adapter.save_attributes(request_envelope, self.attributes)
+
+        table.put_item.assert_called_once()
+        table.update_item.assert_not_called()
+        assert adapter.get_attributes(request_envelope) == self.attributes
+
+    def test_deleted_item_is_put(self, adapter, table, request_envelope):
+        adapter.save_attributes(request_envelope, self.attributes)
+        table.delete_item(Key={'id': persistence.user_id(request_envelope)})
+
+        changed = dict(self.attributes, launch_count=2)
+        adapter.save_attributes(request_envelope, changed)
+        # the update failed, there was nothing to rebase on
+        table.update_item.assert_called_once()
+        table.get_item.assert_called_once()
+        assert table.put_item.call_count == 2
+        assert adapter.get_attributes(request_envelope) == changed
+
+    def test_put_does_not_overwrite(self, adapter, table, dynamodb_client,
+                                    request_envelope):
+        assert adapter.get_attributes(request_envelope) == {}
+        # saved by another container in the meantime
+        table.put_item(Item={'id': persistence.user_id(request_envelope),
+                             'attributes': {'launch_count': 1, 'streak': 5}})
+
+        adapter.save_attributes(request_envelope,
+                                {'launch_count': 1, 'best': 3})
+        kwargs = table.put_item.call_args[1]
+        assert kwargs['ConditionExpression'] == 'attribute_not_exists(id)'
+        # rebased on the item it found
+        table.update_item.assert_called_once()
+        item, = dynamodb_client.local_table.items.values()
+        assert item['attributes'] == {'launch_count': 1, 'streak': 5,
+                                      'best': 3}
+        assert adapter.get_attributes(request_envelope) == item['attributes']
+
+    def test_failed_write_is_forgotten(self, adapter, table,
+                                       request_envelope):
+        adapter.save_attributes(request_envelope, self.attributes)
+        table.put_item.side_effect = RuntimeError('throttled')
+        table.update_item.side_effect = RuntimeError('throttled')
+
+        with pytest.raises(PersistenceException):
+            adapter.save_attributes(request_envelope, {'launch_count': 2})
+        with pytest.raises(PersistenceException):
+            adapter.save_attributes(request_envelope, self.attributes)
+        # not skipped as unchanged, the last write may not have happened
+        assert table.update_item.call_count == 1
+        assert table.put_item.call_count == 2
+
+    def test_remembers_a_bounded_number_of_items(self, dynamodb_client):
+        adapter = persistence.SkillTableAdapter(
+            'test-table', dynamodb_client,
+            partition_keygen=lambda envelope: envelope,
+            remembered_items=2)
+        for key in ['a', 'b', 'c']:
+            adapter.save_attributes(key, self.attributes)
+
+        table = dynamodb_client.Table()
+        adapter.save_attributes('c', self.attributes)
+        adapter.save_attributes('a', self.attributes)
+        assert table.put_item.call_count == 4
+
+class TestReadThroughCache:
+
+    class Clock: # pylint: disable=too-few-public-methods
+        now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+    @pytest.fixture
+    def clock(self):
+        return self.Clock()
+
+    @pytest.fixture
+    def table(self, dynamodb_client):
+        return dynamodb_client.Table()
+
+    @pytest.fixture
+    def adapter(self, dynamodb_client, clock):
+        return persistence.SkillTableAdapter('test-table', dynamodb_client,
+                                             cache_ttl=60, clock=clock)
+
+    def test_hit_within_ttl(self, adapter, table, clock, request_envelope):
+        adapter.get_attributes(request_envelope)
+        clock.now += 60
+        adapter.get_attributes(request_envelope)
+
+        assert table.get_item.call_count == 1
+        assert (adapter.cache_hits, adapter.cache_misses) == (1, 1)
+
+    def test_miss_after_ttl(self, adapter, table, clock, request_envelope):
+        adapter.get_attributes(request_envelope)
+        clock.now += 61
+        adapter.get_attributes(request_envelope)
+
+        assert table.get_item.call_count == 2
+        assert (adapter.cache_hits, adapter.cache_misses) == (0, 2)
+
+    def test_write_through(self, adapter, table, clock, request_envelope):
+        adapter.save_attributes(request_envelope, {'launch_count': 5})
+        clock.now += 30
+
+        attributes = adapter.get_attributes(request_envelope)
+        assert attributes == {'launch_count': 5}
+        table.get_item.assert_not_called()
+
+        # callers get their own copy
+        attributes['launch_count'] = 6
+        assert adapter.get_attributes(request_envelope) == {'launch_count': 5}
+
+    def test_disabled_by_default(self, dynamodb_client, table,
+                                 request_envelope):
+        adapter = persistence.SkillTableAdapter('test-table', dynamodb_client)
+        adapter.get_attributes(request_envelope)
+        adapter.get_attributes(request_envelope)
+
+        assert table.get_item.call_count == 2
+        assert (adapter.cache_hits, adapter.cache_misses) == (0, 0)
+
+    def test_missing_item_is_cached(self, adapter, table, request_envelope):
+        assert adapter.get_attributes(request_envelope) == {}
+        assert adapter.get_attributes(request_envelope) == {}
+        adapter.save_attributes(request_envelope, {'launch_count': 1})
+
+        table.get_item.assert_called_once()
+        table.put_item.assert_called_once()
+        table.update_item.assert_not_called()
+
+    def test_write_of_another_container_is_not_lost(self, dynamodb_client,
+                                                    adapter, clock,
+                                                    request_envelope, caplog):
+        table = dynamodb_client.Table()
+        other = persistence.SkillTableAdapter('test-table', dynamodb_client,
+                                              cache_ttl=60, clock=clock)
+        adapter.save_attributes(request_envelope,
+                                {'launch_count': 1, 'streak': 0})
+        # the next session lands on the other container
+        attributes = other.get_attributes(request_envelope)
+        other.save_attributes(request_envelope,
+                              dict(attributes, launch_count=2, streak=4))
+
+        # and the one after on the first again, with a stale cache
+        caplog.set_level(logging.INFO)
+        attributes = adapter.get_attributes(request_envelope)
+        assert attributes == {'launch_count': 1, 'streak': 0}
+        adapter.save_attributes(request_envelope,
+                                dict(attributes, launch_count=2, best=1))
+
+        # the update didn't apply over the newer item, it was rebased on
+        # a fresh read and retried
+        assert table.update_item.call_count == 3
+        assert table.get_item.call_count == 2
+        assert table.put_item.call_count == 1
+        item, = dynamodb_client.local_table.items.values()
+        assert item['attributes'] == {'launch_count': 2, 'streak': 4,
+                                      'best': 1}
+        logs = [log['event'] for log in test_utils.load_log_events(caplog)]
+        assert logs.count('persistence conflict') == 1
+
+    def test_sessions_on_two_containers_add_up(self, dynamodb_client,
+                                               clock, request_envelope):
+        first, second = (persistence.SkillTableAdapter(
+            'test-table', dynamodb_client, cache_ttl=60, clock=clock,
+            rebase=models.rebase) for _ in range(2))
+        usage = models.SkillUsage(launch_count=1)
+        first.save_attributes(request_envelope, models.asdict(usage))
+
+        # a session relaunched on the second container, ended on the first
+        usage = models.SkillUsage.from_attributes(
+            second.get_attributes(request_envelope))
+        usage.launch_count += 1
+        usage.history.append(models.Operation.ADD, 1, 1, True, 1539255600)
+        second.save_attributes(request_envelope, models.asdict(usage))
+
+        usage = models.SkillUsage.from_attributes(
+            first.get_attributes(request_envelope))
+        usage.launch_count += 1
+        usage.history.append(models.Operation.SUB, 2, 2, True, 1539255700)
+        first.save_attributes(request_envelope, models.asdict(usage))
+
+        item, = dynamodb_client.local_table.items.values()
+        stored = models.SkillUsage.from_attributes(item['attributes'])
+        assert stored.launch_count == 3
+        assert [e.op1 for e in stored.history] == [1, 2]
+
+    def test_conflicts_are_retried_a_few_times(self, adapter, table,
+                                               request_envelope):
+        adapter.save_attributes(request_envelope, {'launch_count': 1})
+        conflict = persistence.CONFLICTS[0]
+        table.update_item.side_effect = ClientError(
+            {'Error': {'Code': conflict}}, 'UpdateItem')
+
+        with pytest.raises(PersistenceException):
+            adapter.save_attributes(request_envelope, {'launch_count': 2})
+        assert table.update_item.call_count == \
+            persistence.CONFLICT_RETRIES + 1
+
+    def test_counters_are_logged(self, adapter, request_envelope, caplog):
+        caplog.set_level(logging.INFO)
+        adapter.get_attributes(request_envelope)
+        adapter.get_attributes(request_envelope)
+
+        logs = [log for log in test_utils.load_log_events(caplog)
+                if log['event'] == 'persistence cache']
+        assert [log['hit'] for log in logs] == [False, True]
+        assert logs[-1]['hits'] == 1
+        assert logs[-1]['misses'] == 1
+
+class TestExecutor:
+
+    attributes = {'launch_count': 1, 'previous_session_end': 1539255600}
+
+    @pytest.fixture
+    def released(self):
+        # DynamoDB calls (with latency) block until it's set
+        return threading.Event()
+
+    @pytest.fixture
+    def dynamodb_client(self, released):
+        return mock_dynamodb_client(latency=constant(1),
+                                    sleep=lambda _: released.wait(5))
+
+    @pytest.fixture
+    def adapter(self, dynamodb_client):
+        executor = ThreadPoolExecutor(max_workers=2)
+        yield persistence.SkillTableAdapter('test-table', dynamodb_client,
+                                            cache_ttl=60, executor=executor)
+        executor.shutdown()
+
+    def test_prefetch(self, adapter, dynamodb_client, released,
+                      request_envelope):
+        key = persistence.user_id(request_envelope)
+        dynamodb_client.local_table.items[key] = {
+            'id': key, 'attributes': self.attributes}
+
+        adapter.prefetch(key)
+        adapter.prefetch(key)
+        released.set()
+        assert adapter.get_attributes(request_envelope) == self.attributes
+        dynamodb_client.Table().get_item.assert_called_once()
+
+        # not when it's cached
+        adapter.prefetch(key)
+        adapter.get_attributes(request_envelope)
+        dynamodb_client.Table().get_item.assert_called_once()
+
+    def test_save_does_not_wait(self, adapter, dynamodb_client, released,
+                                request_envelope):
+        adapter.save_attributes(request_envelope, self.attributes)
+        assert not dynamodb_client.local_table.items
+
+        released.set()
+        adapter.wait()
+        item, = dynamodb_client.local_table.items.values()
+        assert item['attributes'] == self.attributes
+
+    def test_failed_save_raises_on_wait(self, adapter, dynamodb_client,
+                                        released, request_envelope):
+        released.set()
+        dynamodb_client.Table().put_item.side_effect = RuntimeError('throttled')
+        adapter.save_attributes(request_envelope, self.attributes)
+
+        with pytest.raises(PersistenceException):
+            adapter.wait()
+        key = persistence.user_id(request_envelope)
+        assert adapter.remembered(key) is None
+        adapter.wait() # raised once
+
+    def test_wait_drops_reads(self, adapter, dynamodb_client, released):
+        dynamodb_client.Table().get_item.side_effect = RuntimeError('down')
+        adapter.prefetch('somebody')
+        released.set()
+        adapter.wait()
+        assert not adapter._reads # pylint: disable=protected-access
@@ -1,7 +1,10 @@
 import json
+import pickle
 
 from ask_sdk_core.handler_input import HandlerInput
 from ask_sdk_model import RequestEnvelope, Response
+from ask_sdk_model.interfaces.alexa.presentation.apl import \
+    RenderDocumentDirective
 import pytest
 
 from src.functions.skill import utils
@@ -19,6 +22,31 @@ def test_build_response(handler_input):
     assert response.output_speech.ssml == '<speak>same same</speak>'
     assert response.reprompt.output_speech.ssml == '<speak>but different</speak>'
 
+@pytest.mark.parametrize('message, question', [
+    ('same same', None),
+    ('same same', 'but different'),
+    ('  padded.  ', '<speak> already wrapped? </speak>'),
+    ('<b>tags</b> & ampersands', None),
+])
+@pytest.mark.parametrize('with_directive', [False, True])
+def test_response_dict_matches_sdk(handler_input, message, question,
+                                   with_directive):
+    directive = RenderDocumentDirective(document=utils.freeze({'type': 'APL'}),
+                                        datasources={'data': {'op1': 4}})
+    rb = handler_input.response_builder
+    rb.speak(message).ask(question or message)
+    directives = []
+    if with_directive:
+        rb.add_directive(directive)
+        directives.append(serializer.serialize(directive))
+
+    fast = utils.response_dict(message, question, directives)
+    expected = serializer.serialize(rb.response)
+
+    assert fast == expected
+    assert json.dumps(utils.Serializer().serialize(fast)) == \
+        json.dumps(expected)
+
 @pytest.mark.parametrize('messages, expected', [
     (('hi', 'there'), 'hi. there.'),
     (('working?', 'yes'), 'working? yes.'),
@@ -29,17 +57,6 @@ def test_build_response(handler_input):
 def test_combine_messages(messages, expected):
     assert utils.combine_messages(*messages) == expected
 
-def test_randomize():
-    @utils.randomize
-    def five():
-        return list(range(5))
-
-    values = set()
-    for _ in range(100):
-        values.add(five())
-
-    assert len(values) == 5
-
 def test_speechcon():
     expected = '<say-as interpret-as="interjection">boom</say-as>'
     assert utils.speechcon('boom') == expected
@@ -58,3 +75,32 @@ def test_has_apl_support(event_name, has_support):
                                               RequestEnvelope)
     hi = HandlerInput(request_envelope)
     assert utils.has_apl_support(hi) == has_support
+
+def test_freeze():
+    data = {'a': [1, {'b': 'c'}], 'd': {'e': None}}
+    frozen = utils.freeze(data)
+
+    assert frozen == {'a': (1, {'b': 'c'}), 'd': {'e': None}}
+    assert isinstance(frozen, dict)
+    assert isinstance(frozen['a'][1], utils.FrozenDict)
+    assert pickle.loads(pickle.dumps(frozen)) == frozen
+
+    for mutate in [lambda: frozen.__setitem__('x', 1),
+                   lambda: frozen.__delitem__('a'),
+                   lambda: frozen['d'].update(e=1),
+                   lambda: frozen.setdefault('x', 1),
+                   frozen.clear,
+                   frozen.popitem]:
+        with pytest.raises(TypeError):
+            mutate()
+
+def test_serializer_passes_frozen_data_through():
+    document = utils.freeze({'type': 'APL', 'items': [{'type': 'Text'}]})
+    directive = RenderDocumentDirective(document=document,
+                                        datasources={'op1': 4})
+
+    serialized = utils.Serializer().serialize(directive)
+    expected = serializer.serialize(directive)
+
+    assert serialized['document'] is document
+    assert json.dumps(serialized) == json.dumps(expected)
@@ -0,0 +1,129 @@
+import gzip
+import json
+
+import pytest
+
+import models # the one the tool imports, unlike src.functions.skill.models
+from tools import export_stats
+
+
+NOW = 1540000000
+DAY = export_stats.DAY
+
+def usage(launch_count, days_ago, operation=None, questions_count=0):
+    session_data = models.SessionData(
+        operation=operation and models.Operation(operation),
+        difficulty=2 if operation else None,
+        questions_count=questions_count)
+    end = NOW - int(days_ago * DAY) if days_ago is not None else 0
+    return models.SkillUsage(launch_count=launch_count,
+                             previous_session_end=end,
+                             session_data=session_data)
+
+def plain_item(user_id, skill_usage):
+    return {'id': user_id, 'attributes': models.asdict(skill_usage)}
+
+def typed(value):
+    # as DynamoDB JSON
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float)):
+        return {'N': str(value)}
+    if isinstance(value, dict):
+        return {'M': {key: typed(item) for key, item in value.items()}}
+    if isinstance(value, list):
+        return {'L': [typed(item) for item in value]}
+    return {'S': value}
+
+def typed_item(user_id, skill_usage):
+    return {'Item': {key: typed(value) for key, value
+                     in plain_item(user_id, skill_usage).items()}}
+
+USERS = [
+    usage(1, 0.5),
+    usage(3, 0.01, 'mul', 4), # resumable
+    usage(7, 3, 'add', 9), # stale
+    usage(12, 20),
+    usage(2, 100, 'div', 1), # stale
+    usage(0, None), # launched, never ended a session
+]
+
+def write_export(path, items, opener=open):
+    with opener(path, 'wt') as f:
+        for item in items:
+            f.write(json.dumps(item) + '\n')
+        f.write('\n')
+        f.write('{"broken json\n')
+
+@pytest.fixture
+def exports(tmp_path):
+    plain = str(tmp_path / 'plain.json')
+    write_export(plain, [plain_item(f'user{i}', u) for i, u in enumerate(USERS)])
+    typed_gz = str(tmp_path / 'typed.json.gz')
+    write_export(typed_gz, [typed_item(f'user{i}', u)
+                            for i, u in enumerate(USERS)], gzip.open)
+    return [plain, typed_gz]
+
+def test_decode_item():
+    item = usage(3, 0.01, 'mul', 4)
+    assert export_stats.decode_item(json.dumps(plain_item('u', item))) == item
+    assert export_stats.decode_item(json.dumps(typed_item('u', item))) == item
+    assert export_stats.decode_item(b'  \n') is None
+    assert export_stats.decode_item('{"id": "stats#streaks", "top": []}') \
+        is None
+
+def test_report(exports): # pylint: disable=redefined-outer-name
+    report = export_stats.analyze(exports[:1], now=NOW).report()
+
+    assert report['users'] == 6
+    assert report['invalid'] == 1
+    retention = report['retention']
+    assert retention['returning'] == 4
+    assert retention['active']['1d']['users'] == 2
+    assert retention['active']['7d']['returning'] == 2
+    assert retention['active']['30d']['users'] == 4
+    assert list(retention['last_seen'].values()) == [2, 1, 1, 0, 1, 0]
+
+    launch_count = report['launch_count']
+    assert (launch_count['count'], launch_count['p50'], launch_count['max']) \
+        == (6, 2, 12)
+    assert list(launch_count['buckets'].values()) == [2, 1, 1, 1, 1, 0, 0, 0]
+
+    sessions = report['sessions']
+    assert (sessions['unfinished'], sessions['stale'],
+            sessions['resumable']) == (3, 2, 1)
+    assert sessions['stale_questions']['max'] == 9
+
+def test_typed_gzipped_export(exports): # pylint: disable=redefined-outer-name
+    plain, typed_gz = exports
+    assert export_stats.analyze([typed_gz], now=NOW).report() == \
+        export_stats.analyze([plain], now=NOW).report()
+
+@pytest.mark.parametrize('chunk_bytes', [1, 7, 100, 333])
+def test_chunks_cover_each_line_once(tmp_path, chunk_bytes):
+    path = str(tmp_path / 'export.json')
+    items = [plain_item(f'user{i}', usage(i, i)) for i in range(40)]
+    write_export(path, items)
+
+    tasks = list(export_stats.chunks([path], chunk_bytes))
+    lines = [line for task in tasks for line in export_stats.read_chunk(*task)]
+    with open(path, 'rb') as f:
+        assert lines == f.readlines()
+
+def test_parallel_matches_serial(exports): # pylint: disable=redefined-outer-name
+    serial = export_stats.analyze(exports, now=NOW, workers=1).report()
+    parallel = export_stats.analyze(exports, now=NOW, workers=2,
+                                    chunk_bytes=200).report()
+    assert parallel == serial
+    assert serial['users'] == 12
+
+def test_main(exports, capsys): # pylint: disable=redefined-outer-name
+    report = export_stats.main(['--now', str(NOW), '--workers', '1', *exports])
+    out = capsys.readouterr().out
+    assert '12 users (2 invalid items)' in out
+    assert 'unfinished sessions: 6, stale 4' in out
+
+    export_stats.main(['--now', str(NOW), '--json', *exports])
+    assert json.loads(capsys.readouterr().out) == report
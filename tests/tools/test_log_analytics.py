@@ -0,0 +1,144 @@
+import gzip
+import json
+import logging
+import random
+
+import pytest
+
+import core # the one main imports, unlike src.core
+from src.functions.skill import main
+from tests.functions.skill.fixtures import ( # pylint: disable=unused-import
+    build_intent_event, dynamodb_client, load_event)
+from tools import log_analytics
+
+
+@pytest.fixture
+def skill_log(caplog, dynamodb_client): # pylint: disable=redefined-outer-name
+    """
+    The log lines of a session that answers right, wrong, right and stops,
+    plus an unhandled intent, as the skill writes them.
+    """
+    main.sb.dynamodb_client = dynamodb_client
+    caplog.set_level(logging.INFO)
+    core.metrics.flush() # of tests not going through main.handler
+    caplog.clear()
+
+    r = main.handler(load_event('did_select_difficulty'), None)
+    for correct in [True, False, True]:
+        usage = main.models.SkillUsage.from_attributes(r['sessionAttributes'])
+        answer = main.content.asked_question(usage)[2] + (0 if correct else 1)
+        event = load_event('did_answer_correct')
+        event['session']['attributes'] = r['sessionAttributes']
+        event['request']['intent']['slots']['answer']['value'] = str(answer)
+        r = main.handler(event, None)
+    stop = build_intent_event('AMAZON.StopIntent')
+    stop['session']['attributes'] = r['sessionAttributes']
+    main.handler(stop, None)
+    main.handler(load_event('unhandled_intent'), None)
+
+    return [record[2] for record in caplog.record_tuples]
+
+def write_log(path, lines):
+    # as in a CloudWatch export: a timestamp in front, and some noise
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('START RequestId: 42 Version: $LATEST\n')
+        for line in lines:
+            f.write(f'2018-10-11T12:00:00.000Z\t{line}\n')
+        f.write('{"not": "a log event"}\n')
+        f.write('{broken json\n')
+
+def test_report_of_skill_log(tmp_path, skill_log): # pylint: disable=redefined-outer-name
+    path = str(tmp_path / 'skill.log')
+    write_log(path, skill_log)
+
+    report = log_analytics.analyze([path]).report()
+
+    row, = report['accuracy']['by_operation_and_difficulty']
+    assert (row['operation'], row['difficulty']) == ('add', 3)
+    assert (row['answers'], row['correct']) == (3, 2)
+    assert report['accuracy']['by_operation']['add']['answers'] == 3
+    assert report['accuracy']['by_difficulty']['3']['correct'] == 2
+
+    assert report['sessions']['count'] == 1
+    assert report['sessions']['max'] == 3
+
+    assert report['errors']['DidAnswer'] == {'invocations': 3, 'errors': 0,
+                                             'rate': 0}
+    # the unhandled one, without an operation in the session
+    assert report['errors']['DidSelectDifficulty'] == {
+        'invocations': 2, 'errors': 1, 'rate': 0.5}
+
+    assert report['latency']['DidAnswer']['count'] == 3
+    assert report['phases']['total']['count'] == 6
+    assert report['phases']['persistence_write']['count'] == 1
+
+def test_execution_errors():
+    events = [{'event': 'execution error',
+               'invocation': {'request': {'type': 'IntentRequest',
+                                          'intent': {'name': 'DidAnswer'}}}},
+              {'event': 'execution error', 'invocation': '{"request": {"ty...'}]
+    stats = log_analytics.analyze_events(events)
+    assert stats.errors == {'DidAnswer': 1, log_analytics.UNKNOWN: 1}
+
+def test_parallel_and_gzipped_files(tmp_path, skill_log): # pylint: disable=redefined-outer-name
+    paths = []
+    for number in range(4):
+        path = str(tmp_path / f'skill{number}.log')
+        write_log(path, skill_log)
+        paths.append(path)
+    gzipped = str(tmp_path / 'skill.log.gz')
+    with open(paths[0], 'rb') as f, gzip.open(gzipped, 'wb') as gz:
+        gz.write(f.read())
+    paths.append(gzipped)
+
+    single = log_analytics.analyze([paths[0]]).report()
+    parallel = log_analytics.analyze(paths, workers=2).report()
+
+    row, = parallel['accuracy']['by_operation_and_difficulty']
+    assert row['answers'] == 5 * 3
+    assert parallel['sessions']['count'] == 5
+    assert parallel['phases']['total']['count'] == \
+        5 * single['phases']['total']['count']
+    assert log_analytics.analyze(paths, workers=1).report() == parallel
+
+def test_sampled_metrics_are_scaled():
+    metrics = {'event': 'metrics', 'intent': 'DidAnswer', 'operation': 'add',
+               'difficulty': 1, 'correct': True, 'total': 12.5,
+               '_aws': {'CloudWatchMetrics': [
+                   {'Metrics': [{'Name': 'total'}]}]}}
+    events = [dict(metrics, sample_rate=0.25),
+              dict(metrics, sample_rate=0.25, correct=False),
+              dict(metrics, error='ValueError')] # errors aren't sampled
+
+    report = log_analytics.analyze_events(events).report()
+    assert report['errors']['DidAnswer'] == {
+        'invocations': 9, 'errors': 1, 'rate': 1 / 9}
+    assert report['accuracy']['by_operation']['add'] == {
+        'answers': 9, 'correct': 5, 'accuracy': 5 / 9}
+    assert report['latency']['DidAnswer']['count'] == 9
+
+def test_histogram_percentiles():
+    rng = random.Random(3)
+    samples = [rng.lognormvariate(1, 1.5) for _ in range(10000)]
+    histogram = log_analytics.Histogram()
+    for sample in samples:
+        histogram.add(sample)
+
+    samples.sort()
+    for fraction in log_analytics.PERCENTILES:
+        exact = samples[int(fraction * len(samples)) - 1]
+        assert histogram.percentile(fraction) == \
+            pytest.approx(exact, rel=log_analytics.RELATIVE_ERROR * 1.01)
+    # the same memory whatever the count
+    assert len(histogram.buckets) < 2000
+
+def test_main_json(tmp_path, capsys, skill_log): # pylint: disable=redefined-outer-name
+    path = str(tmp_path / 'skill.log')
+    write_log(path, skill_log)
+
+    log_analytics.main([path])
+    assert 'DidAnswer' in capsys.readouterr().out
+
+    log_analytics.main(['--json', path])
+    report = json.loads(capsys.readouterr().out)
+    assert report['sessions']['count'] == 1
@@ -0,0 +1,9 @@
+import os
+import sys
+
+
+# the skill's modules are imported the way Lambda imports them (flat,
+# from the function dir), see tests/conftest.py
+here = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src')) # for core
+sys.path.insert(0, os.path.join(here, '..', 'src', 'functions', 'skill'))
@@ -0,0 +1,336 @@
+"""
+Statistics of SkillTable exports: how many users come back, how often
+they launch the skill and how many sessions are left unfinished.
+
+    python -m tools.export_stats [--workers N] [--now SECONDS] [--json]
+                                 FILE [FILE ...]
+
+FILEs are exports of the table, plain or gzipped, one item per line,
+either as plain JSON ({"id": ..., "attributes": {...}}) or in the
+DynamoDB JSON of the table export to S3 ({"Item": {"id": {"S": ...},
+...}}). The attributes are decoded by models.SkillUsage.from_attributes,
+as the skill reads them; lines that don't decode are counted as invalid.
+Items that aren't a user's (the skill's global_stats) are skipped.
+
+The work is split into tasks of about CHUNK_BYTES of a plain file (a
+range of lines) or a whole gzipped one, run by a pool of worker
+processes, so one big export keeps all cores busy as well as many small
+ones. Tasks stream their lines and keep only counters, so memory doesn't
+grow with the number of users.
+
+Everything relative to time (days since last seen, stale sessions) is
+relative to --now, the current time by default.
+"""
+import argparse
+import collections
+import functools
+import gzip
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import global_stats
+import models
+
+
+CHUNK_BYTES = 64 * 1024 * 1024
+DAY = 24 * 60 * 60
+
+# users active in the last N days
+ACTIVE_DAYS = [1, 7, 30]
+# days since last seen, the upper bounds of the report's buckets
+LAST_SEEN_DAYS = [1, 7, 30, 90, 365]
+# launch counts, the upper bounds of the report's buckets
+LAUNCH_BUCKETS = [1, 2, 5, 10, 20, 50, 100]
+PERCENTILES = [0.5, 0.9, 0.99]
+
+
+def untype(value):
+    # a value in DynamoDB JSON, e.g. {"N": "5"}, as plain JSON
+    (kind, data), = value.items()
+    if kind == 'M':
+        return {key: untype(item) for key, item in data.items()}
+    if kind == 'L':
+        return [untype(item) for item in data]
+    if kind == 'N':
+        return number(data)
+    if kind == 'NS':
+        return [number(item) for item in data]
+    if kind == 'NULL':
+        return None
+    return data # S, B, BOOL, SS, BS
+
+def number(text):
+    # the skill only stores integers (seconds, counts, operands)
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def decode_item(line):
+    """The SkillUsage of an exported item, None if it isn't a user's."""
+    if not line.strip():
+        return None
+    item = json.loads(line)
+    if 'Item' in item:
+        item = {key: untype(value) for key, value in item['Item'].items()}
+    if str(item['id']).startswith(global_stats.PREFIX):
+        return None
+    return models.SkillUsage.from_attributes(item['attributes'])
+
+def read_chunk(path, start=0, end=None):
+    # the lines starting in [start, end) of a file; gzipped files can't
+    # be split, they're read whole
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            yield from f
+        return
+
+    with open(path, 'rb') as f:
+        if start:
+            # skip the line started in the previous chunk, unless it ends
+            # right before this one
+            f.seek(start - 1)
+            f.readline()
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+def chunks(paths, chunk_bytes=CHUNK_BYTES):
+    # (path, start, end) tasks covering the files
+    for path in paths:
+        if path.endswith('.gz'):
+            yield path, 0, None
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_bytes):
+            yield path, start, min(start + chunk_bytes, size)
+
+
+class Stats:
+    """What the report is computed from; add() takes one SkillUsage."""
+
+    def __init__(self, now):
+        self.now = now
+        self.users = 0
+        self.invalid = 0
+        self.launch_counts = collections.Counter()
+        self.last_seen = collections.Counter() # bucket index -> users
+        self.active = collections.Counter() # days -> users
+        self.returning_active = collections.Counter() # days -> users
+        # sessions persisted while a question was asked, see
+        # SkillUsage.is_new_session
+        self.unfinished = 0
+        self.stale = 0
+        self.stale_questions = collections.Counter()
+
+    def add(self, usage):
+        self.users += 1
+        self.launch_counts[usage.launch_count] += 1
+
+        if usage.previous_session_end:
+            age = self.now - usage.previous_session_end
+            self.last_seen[bucket(age / DAY, LAST_SEEN_DAYS)] += 1
+            for days in ACTIVE_DAYS:
+                if age < days * DAY:
+                    self.active[days] += 1
+                    if usage.launch_count > 1:
+                        self.returning_active[days] += 1
+
+        session_data = usage.session_data
+        if usage.previous_session_end and session_data.operation is not None:
+            self.unfinished += 1
+            if usage.is_new_session(self.now):
+                self.stale += 1
+                self.stale_questions[session_data.questions_count] += 1
+
+    def merge(self, other):
+        self.users += other.users
+        self.invalid += other.invalid
+        for counter in ['launch_counts', 'last_seen', 'active',
+                        'returning_active', 'stale_questions']:
+            getattr(self, counter).update(getattr(other, counter))
+        self.unfinished += other.unfinished
+        self.stale += other.stale
+        return self
+
+    def report(self):
+        returning = sum(users for launches, users
+                        in self.launch_counts.items() if launches > 1)
+        return {
+            'now': self.now,
+            'users': self.users,
+            'invalid': self.invalid,
+            'retention': {
+                'returning': returning,
+                'returning_rate': rate(returning, self.users),
+                'active': {f'{days}d': {
+                    'users': self.active[days],
+                    'rate': rate(self.active[days], self.users),
+                    'returning': self.returning_active[days],
+                    'returning_rate': rate(self.returning_active[days],
+                                           returning)}
+                           for days in ACTIVE_DAYS},
+                'last_seen': {label: self.last_seen[index]
+                              for index, label
+                              in enumerate(labels(LAST_SEEN_DAYS, 'd'))},
+            },
+            'launch_count': dict(
+                distribution(self.launch_counts),
+                buckets={label: count for label, count in zip(
+                    labels(LAUNCH_BUCKETS),
+                    bucket_counts(self.launch_counts, LAUNCH_BUCKETS))}),
+            'sessions': {
+                'unfinished': self.unfinished,
+                'stale': self.stale,
+                'resumable': self.unfinished - self.stale,
+                'stale_rate': rate(self.stale, self.unfinished),
+                'stale_questions': distribution(self.stale_questions),
+            },
+        }
+
+
+def rate(count, total):
+    return count / total if total else None
+
+def bucket(value, bounds):
+    # index of the first bound the value is at or below
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            return index
+    return len(bounds)
+
+def bucket_counts(counter, bounds):
+    counts = [0] * (len(bounds) + 1)
+    for value, count in counter.items():
+        counts[bucket(value, bounds)] += count
+    return counts
+
+def labels(bounds, unit=''):
+    # '<=1', '2-5', ... for integer bounds, '<=1d', '1-7d', ... otherwise
+    if unit:
+        lows = [0] + bounds
+        return ([f'<={bounds[0]}{unit}']
+                + [f'{low}-{high}{unit}' for low, high
+                   in zip(lows[1:], bounds[1:])]
+                + [f'>{bounds[-1]}{unit}'])
+    lows = [bound + 1 for bound in bounds]
+    return ([f'<={bounds[0]}']
+            + [f'{low}-{high}' if low != high else str(low)
+               for low, high in zip(lows, bounds[1:])]
+            + [f'>{bounds[-1]}'])
+
+def distribution(counter):
+    # of integer values, counter being value -> count
+    count = sum(counter.values())
+    if not count:
+        return {'count': 0}
+    values = sorted(counter.items())
+
+    def percentile(fraction):
+        # nearest-rank
+        rank = max(1, math.ceil(fraction * count))
+        seen = 0
+        for value, times in values:
+            seen += times
+            if seen >= rank:
+                return value
+        return None # not reached
+
+    total = sum(value * times for value, times in values)
+    return dict({'count': count, 'mean': total / count},
+                **{f'p{int(fraction * 100)}': percentile(fraction)
+                   for fraction in PERCENTILES},
+                max=values[-1][0])
+
+def analyze_lines(lines, now):
+    stats = Stats(now)
+    for line in lines:
+        try:
+            usage = decode_item(line)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            stats.invalid += 1
+            continue
+        if usage is not None:
+            stats.add(usage)
+    return stats
+
+def analyze_chunk(chunk, now):
+    return analyze_lines(read_chunk(*chunk), now)
+
+def analyze(paths, now=None, workers=None, chunk_bytes=CHUNK_BYTES):
+    """The merged Stats of the exports, analyzed in worker processes."""
+    now = int(time.time()) if now is None else now
+    tasks = list(chunks(paths, chunk_bytes))
+    analyze_task = functools.partial(analyze_chunk, now=now)
+    if workers == 1 or len(tasks) < 2:
+        return functools.reduce(Stats.merge, map(analyze_task, tasks),
+                                Stats(now))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(analyze_task, tasks)
+        return functools.reduce(Stats.merge, results, Stats(now))
+
+def print_report(report, out=None):
+    def line(*columns):
+        print(*columns, file=out or sys.stdout)
+
+    def fraction(value):
+        return '      -' if value is None else f'{value:7.1%}'
+
+    def summary(values):
+        if not values['count']:
+            return 'none'
+        return (f"mean {values['mean']:.1f}, p50 {values['p50']}, "
+                f"p90 {values['p90']}, p99 {values['p99']}, "
+                f"max {values['max']}")
+
+    retention = report['retention']
+    line(f"{report['users']} users ({report['invalid']} invalid items)")
+    line(f"returning (launched more than once): {retention['returning']}",
+         fraction(retention['returning_rate']).strip())
+    line('active in          users            returning')
+    for days, row in retention['active'].items():
+        line(days.ljust(10), f"{row['users']:10d}", fraction(row['rate']),
+             f"{row['returning']:10d}", fraction(row['returning_rate']))
+    line('last seen', ', '.join(f'{label}: {users}' for label, users
+                                in retention['last_seen'].items()))
+
+    launch_count = report['launch_count']
+    line('launch count:', summary(launch_count))
+    line('launches', ', '.join(f'{label}: {users}' for label, users
+                               in launch_count['buckets'].items()))
+
+    sessions = report['sessions']
+    line(f"unfinished sessions: {sessions['unfinished']}, "
+         f"stale {sessions['stale']}",
+         fraction(sessions['stale_rate']).strip(),
+         f"resumable {sessions['resumable']}")
+    line('questions of stale sessions:', summary(sessions['stale_questions']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--now', type=int, default=None,
+                        help='seconds since epoch (default: now)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = analyze(args.files, args.now, args.workers).report()
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""
+Offline analytics of the skill's structured logs, the JSON lines core
+writes: accuracy per operation and difficulty, session lengths, error
+rates per intent and latency percentiles.
+
+    python -m tools.log_analytics [--workers N] [--json] FILE [FILE ...]
+
+FILEs are log exports, plain or gzipped, one log event per line.
+Anything in front of the JSON on a line (e.g. the timestamp of a
+CloudWatch export) is skipped, and so are lines that aren't JSON at all.
+
+Files are streamed through a pipeline of generators, so memory doesn't
+grow with their size: latencies go into logarithmic histograms instead
+of being kept. Several files are processed in parallel by a pool of
+worker processes, one file per task, and their stats merged.
+
+Most numbers come from the metrics line a logged invocation ends with
+(see core.Metrics), which is sampled along with its invocation and
+result lines; failed invocations are always logged:
+  - did_answer annotates it with the operation, difficulty and whether
+    the answer was correct
+  - persist_skill_data with the questions (and correct answers) of the
+    session that ended
+  - global_exception_handler with the error
+Errors that escape the skill come as "execution error" lines.
+
+Metrics lines of sampled invocations (see LOG_SAMPLE_RATE in core) come
+with their sample rate and count 1 / sample rate times, so the counts
+reported are estimates of all invocations, rounded.
+"""
+import argparse
+import collections
+import functools
+import gzip
+import json
+import math
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+# latencies (ms) are bucketed with this relative error, smaller
+# ones are counted as MIN_LATENCY
+RELATIVE_ERROR = 0.01
+MIN_LATENCY = 0.001
+_GAMMA = (1 + RELATIVE_ERROR) / (1 - RELATIVE_ERROR)
+_LOG_GAMMA = math.log(_GAMMA)
+
+PERCENTILES = [0.5, 0.95, 0.99]
+UNKNOWN = '-'
+
+
+def open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+def read_lines(path):
+    with open_log(path) as f:
+        yield from f
+
+def parse(lines):
+    # log events (dicts with an "event" message) of the lines that have one
+    for line in lines:
+        start = line.find('{')
+        if start < 0:
+            continue
+        try:
+            event = json.loads(line[start:])
+        except ValueError:
+            continue
+        if isinstance(event, dict) and 'event' in event:
+            yield event
+
+def values(value):
+    # a phase timed more than once in an invocation is logged as a list
+    return value if isinstance(value, list) else [value]
+
+def invocation_intent(invocation):
+    # of the (maybe cut, so a string) event logged with an execution error
+    if not isinstance(invocation, dict):
+        return UNKNOWN
+    request = invocation.get('request') or {}
+    intent = request.get('intent') or {}
+    return intent.get('name') or request.get('type') or UNKNOWN
+
+
+def answer_counts():
+    # [answers, correct answers]; a function, so that Stats pickle
+    return [0, 0]
+
+
+class Histogram:
+    """
+    Counts of values in logarithmic buckets, each RELATIVE_ERROR wide.
+    Takes the same memory whatever the count, merges by adding up the
+    buckets and gives percentiles within RELATIVE_ERROR.
+    """
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+
+    def add(self, value, weight=1):
+        value = max(value, MIN_LATENCY)
+        self.buckets[math.ceil(math.log(value) / _LOG_GAMMA)] += weight
+        self.count += weight
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+
+    def percentile(self, fraction):
+        # nearest-rank, the bucket's value is the middle of its range
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return 2 * _GAMMA ** bucket / (_GAMMA + 1)
+        return None # not reached
+
+
+class Stats:
+    """What the report is computed from; add() takes one log event."""
+
+    def __init__(self):
+        self.events = 0
+        # (operation, difficulty) -> [answers, correct answers]
+        self.answers = collections.defaultdict(answer_counts)
+        # questions in a session -> sessions
+        self.session_lengths = collections.Counter()
+        self.invocations = collections.Counter() # per intent
+        self.errors = collections.Counter() # per intent
+        self.latencies = collections.defaultdict(Histogram) # total, per intent
+        self.phases = collections.defaultdict(Histogram) # per phase
+
+    def add(self, event):
+        self.events += 1
+        name = event['event']
+        if name == 'metrics':
+            self.add_metrics(event)
+        elif name == 'execution error':
+            self.errors[invocation_intent(event.get('invocation'))] += 1
+
+    def add_metrics(self, event):
+        # each sampled line stands for 1 / sample_rate invocations
+        weight = 1 / event.get('sample_rate', 1)
+        intent = event.get('intent') or UNKNOWN
+        self.invocations[intent] += weight
+        if 'error' in event:
+            self.errors[intent] += weight
+        if event.get('operation') is not None:
+            counts = self.answers[event['operation'], event.get('difficulty')]
+            counts[0] += weight
+            counts[1] += weight * bool(event.get('correct'))
+        if event.get('session_questions') is not None:
+            self.session_lengths[event['session_questions']] += weight
+
+        aws = event.get('_aws') or {}
+        for metric_set in aws.get('CloudWatchMetrics', []):
+            for metric in metric_set.get('Metrics', []):
+                phase = metric['Name']
+                for value in values(event.get(phase, [])):
+                    self.phases[phase].add(value, weight)
+                    if phase == 'total':
+                        self.latencies[intent].add(value, weight)
+
+    def merge(self, other):
+        self.events += other.events
+        for key, (answers, correct) in other.answers.items():
+            counts = self.answers[key]
+            counts[0] += answers
+            counts[1] += correct
+        self.session_lengths.update(other.session_lengths)
+        self.invocations.update(other.invocations)
+        self.errors.update(other.errors)
+        for target, source in [(self.latencies, other.latencies),
+                               (self.phases, other.phases)]:
+            for key, histogram in source.items():
+                target[key].merge(histogram)
+        return self
+
+    def report(self):
+        return {
+            'events': self.events,
+            'accuracy': self.accuracy(),
+            'sessions': self.sessions(),
+            'errors': {intent: {'invocations': round(count),
+                                'errors': round(self.errors[intent]),
+                                'rate': self.errors[intent] / count}
+                       for intent, count in sorted(self.invocations.items())},
+            # execution errors of invocations without a metrics line
+            'unmatched_errors': {intent: round(count)
+                                 for intent, count in self.errors.items()
+                                 if intent not in self.invocations},
+            'latency': {intent: percentiles(histogram)
+                        for intent, histogram in sorted(self.latencies.items())},
+            'phases': {phase: percentiles(histogram)
+                       for phase, histogram in sorted(self.phases.items())},
+        }
+
+    def accuracy(self):
+        # per (operation, difficulty), per operation and per difficulty
+        def row(answers, correct):
+            return {'answers': round(answers), 'correct': round(correct),
+                    'accuracy': correct / answers if answers else None}
+
+        by_operation = collections.defaultdict(answer_counts)
+        by_difficulty = collections.defaultdict(answer_counts)
+        for (operation, difficulty), (answers, correct) in self.answers.items():
+            for totals in [by_operation[operation], by_difficulty[difficulty]]:
+                totals[0] += answers
+                totals[1] += correct
+        return {
+            'by_operation_and_difficulty': [
+                dict(row(*counts), operation=operation, difficulty=difficulty)
+                for (operation, difficulty), counts
+                in sorted(self.answers.items(), key=sort_key)],
+            'by_operation': {operation: row(*counts) for operation, counts
+                             in sorted(by_operation.items(), key=sort_key)},
+            'by_difficulty': {str(difficulty): row(*counts)
+                              for difficulty, counts
+                              in sorted(by_difficulty.items(), key=sort_key)},
+        }
+
+    def sessions(self):
+        count = sum(self.session_lengths.values())
+        if not count:
+            return {'count': 0}
+        lengths = sorted(self.session_lengths.items())
+
+        def percentile(fraction):
+            rank = max(1, math.ceil(fraction * count))
+            seen = 0
+            for length, sessions in lengths:
+                seen += sessions
+                if seen >= rank:
+                    return length
+            return None # not reached
+
+        total = sum(length * sessions for length, sessions in lengths)
+        return {'count': round(count),
+                'mean': total / count,
+                'p50': percentile(0.5),
+                'p90': percentile(0.9),
+                'max': lengths[-1][0]}
+
+
+def sort_key(item):
+    # keys may mix None with strings or numbers
+    key = item[0]
+    return tuple(str(part) for part in key) if isinstance(key, tuple) \
+        else str(key)
+
+def percentiles(histogram):
+    return dict({f'p{int(fraction * 100)}': histogram.percentile(fraction)
+                 for fraction in PERCENTILES}, count=round(histogram.count))
+
+def analyze_events(events):
+    stats = Stats()
+    for event in events:
+        stats.add(event)
+    return stats
+
+def analyze_file(path):
+    return analyze_events(parse(read_lines(path)))
+
+def analyze(paths, workers=None):
+    """The merged Stats of the log files, analyzed in worker processes."""
+    if workers == 1 or len(paths) < 2:
+        results = map(analyze_file, paths)
+        return functools.reduce(Stats.merge, results, Stats())
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(analyze_file, paths)
+        return functools.reduce(Stats.merge, results, Stats())
+
+def print_report(report, out=None):
+    def line(*columns):
+        print(*columns, file=out or sys.stdout)
+
+    def fraction(value):
+        return '      -' if value is None else f'{value:7.1%}'
+
+    def ms(value):
+        return '         -' if value is None else f'{value:10.2f}'
+
+    accuracy = report['accuracy']
+    line(f"{report['events']} log events")
+    line('operation  difficulty    answers  accuracy')
+    for row in accuracy['by_operation_and_difficulty']:
+        line(str(row['operation']).ljust(10), str(row['difficulty']).rjust(10),
+             f"{row['answers']:10d}", fraction(row['accuracy']))
+    for name, rows in [('operation', accuracy['by_operation']),
+                       ('difficulty', accuracy['by_difficulty'])]:
+        for key, row in rows.items():
+            line(f'all of {name} {key}'.ljust(21), f"{row['answers']:10d}",
+                 fraction(row['accuracy']))
+
+    sessions = report['sessions']
+    if sessions['count']:
+        line(f"{sessions['count']} sessions, questions per session: "
+             f"mean {sessions['mean']:.1f}, p50 {sessions['p50']}, "
+             f"p90 {sessions['p90']}, max {sessions['max']}")
+    else:
+        line('no sessions ended')
+
+    line('intent                    invocations    errors      rate')
+    for intent, row in report['errors'].items():
+        line(intent.ljust(24), f"{row['invocations']:12d}",
+             f"{row['errors']:9d}", fraction(row['rate']))
+    for intent, count in report['unmatched_errors'].items():
+        line(intent.ljust(24), '           -', f'{count:9d}', '      -')
+
+    for title, rows in [('latency (total ms)', report['latency']),
+                        ('phase (ms)', report['phases'])]:
+        line(title.ljust(24), '   count', '       p50', '       p95',
+             '       p99')
+        for name, row in rows.items():
+            line(name.ljust(24), f"{row['count']:8d}", ms(row['p50']),
+                 ms(row['p95']), ms(row['p99']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = analyze(args.files, args.workers).report()
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+    return report
+
+
+if __name__ == '__main__':
+    main()